@@ -23,9 +23,15 @@ document.addEventListener('DOMContentLoaded', () => {
     
     // 應用程式狀態
     let sentimentChart;
-    let mainInterval;
+    let mainInterval = null;
     let countdownInterval;
     let currentDiscountData = null;
+    let eventSource = null;
+    let codeInterval = null;
+
+    // 推播模式的倒數以後端排程的下一輪時間 (next_scrape_at) 為準，沒有時假設約 3 分鐘；輪詢模式則為每分鐘
+    const STREAM_UPDATE_SECONDS = 180;
+    const POLL_INTERVAL_SECONDS = 60;
 
     // [FINAL FIX] 請將此處的網址，換成您在 "Railway" 上的真實公開網址！
     // 例如：https://my-cool-app.up.railway.app
@@ -89,12 +95,19 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     };
 
-    // 在前端複製折扣計算邏輯，用於轉換歷史數據
-    function calculateDiscountFromPpi(ppi, settings) {
-        const { base_discount = 5.0, ppi_threshold = 70.0, conversion_factor = 0.5, discount_cap = 25.0 } = settings;
-        const extra_discount = Math.max(0, (ppi_threshold - ppi) * conversion_factor);
-        const final_discount = Math.min(base_discount + extra_discount, discount_cap);
-        return final_discount;
+    // 記住每個網址上次回應的 ETag 與內容；再次請求時帶上 If-None-Match，收到 304 就沿用上次的內容
+    const cachedResponses = {};
+    async function fetchJsonWithValidators(url) {
+        const headers = {};
+        const cached = cachedResponses[url];
+        if (cached) headers['If-None-Match'] = cached.etag;
+        const response = await fetch(url, { headers, cache: 'no-store' });
+        if (response.status === 304 && cached) return cached.data;
+        if (!response.ok) throw new Error(`Network response was not ok (${response.status})`);
+        const data = await response.json();
+        const etag = response.headers.get('ETag');
+        if (etag) cachedResponses[url] = { etag, data };
+        return data;
     }
 
     // 獲取並預填歷史數據的函式
@@ -102,20 +115,18 @@ document.addEventListener('DOMContentLoaded', () => {
         try {
             connectionStatusEl.textContent = "正在載入歷史數據...";
             if (!currentDiscountData) {
-                const response = await fetch(`${API_BASE_URL}/api/current-discount`);
-                if (!response.ok) throw new Error('無法獲取折扣設定來初始化圖表');
-                currentDiscountData = await response.json();
+                currentDiscountData = await fetchJsonWithValidators(`${API_BASE_URL}/api/current-discount`)
+                    .catch(() => { throw new Error('無法獲取折扣設定來初始化圖表'); });
                 if (currentDiscountData.error) throw new Error(currentDiscountData.error);
             }
 
-            const response = await fetch(`${API_BASE_URL}/api/history?timescale=realtime`);
-            if (!response.ok) throw new Error('無法獲取歷史數據');
-            const history = await response.json();
+            const history = await fetchJsonWithValidators(`${API_BASE_URL}/api/history?timescale=realtime`)
+                .catch(() => { throw new Error('無法獲取歷史數據'); });
             if(history.error) throw new Error(history.error);
 
             const initialData = history.map(p => ({ 
                 x: new Date(p.timestamp), 
-                y: calculateDiscountFromPpi(p.ppi, currentDiscountData.settings) 
+                y: p.discount // 後端以目前設定換算，與 /api/current-discount 同一套公式
             }));
             
             sentimentChart.data.datasets[0].data = initialData;
@@ -127,31 +138,45 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
-    // 簡化後的折扣獲取與 UI 更新函式
-    async function fetchAndUpdateDiscount() {
-        try {
-            const response = await fetch(`${API_BASE_URL}/api/current-discount`);
-            if (!response.ok) throw new Error(`Network response was not ok (${response.status})`);
-            const data = await response.json();
-            if (data.error) throw new Error(data.error);
-            
-            currentDiscountData = data; // 更新全域的折扣數據
-            generateCodeBtn.disabled = false;
+    // 套用一筆折扣數據 (來自推播或輪詢) 並更新 UI 與圖表
+    function applyDiscountData(data, countdownSeconds) {
+        currentDiscountData = data; // 更新全域的折扣數據
+        generateCodeBtn.disabled = false;
 
-            // 更新主要的 UI 顯示
-            updateUIDisplay(data);
-            
-            // 將最新的折扣數據點加入圖表
-            const chartData = sentimentChart.data.datasets[0].data;
-            chartData.push({ x: new Date(), y: data.final_discount_percentage });
-            if (chartData.length > 60) chartData.shift();
-            sentimentChart.update('quiet');
+        // 更新主要的 UI 顯示
+        updateUIDisplay(data);
+
+        // 將最新的折扣數據點加入圖表；同一筆紀錄 (例如設定變更) 只更新數值
+        const chartData = sentimentChart.data.datasets[0].data;
+        const pointTime = data.timestamp ? new Date(data.timestamp) : new Date();
+        const lastPoint = chartData[chartData.length - 1];
+        if (lastPoint && lastPoint.x.getTime() === pointTime.getTime()) {
+            lastPoint.y = data.final_discount_percentage;
+        } else {
+            chartData.push({ x: pointTime, y: data.final_discount_percentage });
+        }
+        if (chartData.length > 60) chartData.shift();
+        sentimentChart.update('quiet');
 
-            // 更新狀態並啟動倒數計時
+        // 更新狀態並啟動倒數計時；stale 表示伺服器剛重啟、資料庫還在準備中，顯示的是上次保存的數據
+        connectionStatusEl.classList.remove('text-green-400', 'text-yellow-400', 'text-red-500');
+        if (data.stale) {
+            connectionStatusEl.textContent = `伺服器暖機中，暫時顯示上次保存的數據 (${new Date(data.as_of).toLocaleTimeString('zh-TW')})`;
+            connectionStatusEl.classList.add('text-yellow-400');
+        } else {
             connectionStatusEl.textContent = `連線正常 | 上次更新：${new Date().toLocaleTimeString('zh-TW')}`;
-            connectionStatusEl.classList.remove('text-yellow-400', 'text-red-500');
             connectionStatusEl.classList.add('text-green-400');
-            startCountdown();
+        }
+        startCountdown(countdownSeconds);
+    }
+
+    // 輪詢模式 (推播不可用時的備援) 的折扣獲取函式
+    async function fetchAndUpdateDiscount() {
+        try {
+            const data = await fetchJsonWithValidators(`${API_BASE_URL}/api/current-discount`);
+            if (data.error) throw new Error(data.error);
+
+            applyDiscountData(data, POLL_INTERVAL_SECONDS);
 
         } catch (error) {
             console.error('獲取折扣失敗:', error);
@@ -171,9 +196,47 @@ document.addEventListener('DOMContentLoaded', () => {
         formulaDisplayEl.textContent = `${settings.base_discount}% + (${settings.ppi_threshold}% - ${current_ppi.toFixed(1)}%) * ${settings.conversion_factor}`;
     }
     
-    function startCountdown() {
+    function startPolling() {
+        if (mainInterval) return;
+        console.warn("即時推播無法使用，改為每分鐘輪詢。");
+        fetchAndUpdateDiscount();
+        mainInterval = setInterval(fetchAndUpdateDiscount, POLL_INTERVAL_SECONDS * 1000);
+    }
+
+    function stopPolling() {
+        clearInterval(mainInterval);
+        mainInterval = null;
+    }
+
+    // 透過 SSE 接收伺服器推播；瀏覽器會自動重連並帶上 Last-Event-ID，錯過的數據點會由伺服器補送
+    function connectStream() {
+        if (typeof EventSource === 'undefined') {
+            startPolling();
+            return;
+        }
+        eventSource = new EventSource(`${API_BASE_URL}/api/stream`);
+        eventSource.addEventListener('discount', (event) => {
+            stopPolling();
+            const data = JSON.parse(event.data);
+            applyDiscountData(data, secondsUntilNextScrape(data));
+        });
+        eventSource.onopen = () => stopPolling();
+        eventSource.onerror = () => {
+            // 重連期間先以輪詢維持畫面更新
+            connectionStatusEl.textContent = "即時連線中斷，正在重新連線...";
+            connectionStatusEl.classList.remove('text-green-400');
+            connectionStatusEl.classList.add('text-yellow-400');
+            startPolling();
+        };
+    }
+
+    function secondsUntilNextScrape(data) {
+        if (!data.next_scrape_at) return STREAM_UPDATE_SECONDS;
+        return Math.max(0, Math.round((new Date(data.next_scrape_at) - Date.now()) / 1000));
+    }
+
+    function startCountdown(seconds = POLL_INTERVAL_SECONDS) {
         clearInterval(countdownInterval);
-        let seconds = 60;
         countdownTextEl.style.display = 'block';
         countdownTimerEl.textContent = seconds;
         countdownInterval = setInterval(() => {
@@ -183,20 +246,34 @@ document.addEventListener('DOMContentLoaded', () => {
         }, 1000);
     }
     
-    function showBarcode() {
+    // 向伺服器索取簽章折扣碼 (內含折扣、簽發時間與來源紀錄)，到期時若視窗仍開著就自動換新
+    async function showBarcode() {
         if (!currentDiscountData) return;
         codeModal.classList.remove('hidden');
-        const discountCode = `MILK-${currentDiscountData.final_discount_percentage.toFixed(2)}-${Date.now()}`;
-        JsBarcode("#barcode", discountCode, {
-            format: "CODE128", lineColor: "#000", width: 2, height: 80, displayValue: true, fontSize: 18
+        clearInterval(codeInterval);
+        let issued;
+        try {
+            const response = await fetch(`${API_BASE_URL}/api/discount-code`, { method: 'POST' });
+            if (!response.ok) throw new Error(`Network response was not ok (${response.status})`);
+            issued = await response.json();
+        } catch (error) {
+            console.error('取得折扣碼失敗:', error);
+            document.getElementById('barcode').innerHTML = '';
+            codeCountdownEl.textContent = '--';
+            return;
+        }
+        JsBarcode("#barcode", issued.code, {
+            format: "CODE128", lineColor: "#000", width: 1.2, height: 80, displayValue: true, fontSize: 12
         });
-        let seconds = 60;
+        let seconds = issued.ttl_seconds;
         codeCountdownEl.textContent = seconds;
-        const codeInterval = setInterval(() => {
+        codeInterval = setInterval(() => {
             seconds--;
             codeCountdownEl.textContent = seconds;
-            if (seconds <= 0 || codeModal.classList.contains('hidden')) {
+            if (codeModal.classList.contains('hidden')) {
                 clearInterval(codeInterval);
+            } else if (seconds <= 0) {
+                showBarcode();
             }
         }, 1000);
     }
@@ -209,11 +286,8 @@ document.addEventListener('DOMContentLoaded', () => {
         // 2. 透過 API 獲取並預先填滿圖表的歷史數據
         await initializeChartWithHistory();
         
-        // 3. 獲取當前折扣 (這會更新 UI 並啟動倒數)
-        await fetchAndUpdateDiscount();
-
-        // 4. 設定每分鐘的折扣更新
-        mainInterval = setInterval(fetchAndUpdateDiscount, 60000);
+        // 3. 連上即時推播 (連線後會先收到當前折扣，並更新 UI 與啟動倒數)；不支援時改為每分鐘輪詢
+        connectStream();
 
         // 5. 綁定按鈕事件
         generateCodeBtn.addEventListener('click', showBarcode);
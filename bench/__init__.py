@@ -0,0 +1 @@
+"""離線效能量測工具：PTT 頁面產生器與各項基準測試腳本 (不會被 ptt_backend 匯入)。"""
@@ -0,0 +1,131 @@
+"""以 SQLite 對 /api/current-discount 與 /api/history 做負載測試。
+
+先在暫存目錄建立 SQLite 資料庫並寫入指定天數的紀錄 (每 SCRAPE_INTERVAL_SECONDS 一筆) 與彙總時間桶，
+再以 APP_ROLE=api 在子程序啟動 uvicorn (不啟動爬蟲)，由多個並行的客戶端在固定時間內持續請求每個端點。
+--conditional 會讓客戶端帶上一次的 ETag，量測 304 路徑。客戶端與伺服器分屬不同程序，
+伺服器的 CPU 時間與尖峰 RSS 由 /proc 讀取 (僅 Linux)。
+
+    python -m bench.bench_api [--clients 20] [--duration 10] [--days 30] [--output bench_api.json]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+from bench import harness
+
+ENDPOINTS = {
+    "current_discount": "/api/current-discount",
+    "history_realtime": "/api/history?timescale=realtime",
+    "history_day": "/api/history?timescale=day",
+    "history_month": "/api/history?timescale=month",
+}
+
+
+async def seed_database(backend, days, interval):
+    await backend.initialize_database()
+    now = datetime.now(timezone.utc)
+    count = int(days * 86400 / interval)
+    async with backend.SessionLocal() as db:
+        for start in range(0, count, 5000):
+            db.add_all([
+                backend.SentimentRecord(ppi=40 + (n * 7919 % 500) / 10, engine="bench",
+                                        timestamp=now - timedelta(seconds=interval * (count - n)))
+                for n in range(start, min(start + 5000, count))
+            ])
+            await db.commit()
+    await backend.backfill_rollups()
+    await backend.engine.dispose()
+    return count
+
+
+async def client_loop(client, path, deadline, conditional, latencies, statuses):
+    etag = None
+    while time.perf_counter() < deadline:
+        headers = {"If-None-Match": etag} if conditional and etag else None
+        started = time.perf_counter()
+        try:
+            response = await client.get(path, headers=headers)
+        except httpx.HTTPError as e:
+            statuses[type(e).__name__] += 1
+            continue
+        latencies.append(time.perf_counter() - started)
+        statuses[response.status_code] += 1
+        etag = response.headers.get("etag", etag)
+
+
+async def load_endpoint(base_url, path, clients, duration, conditional):
+    latencies = []
+    statuses = Counter()
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30.0) as client:
+        deadline = time.perf_counter() + duration
+        started = time.perf_counter()
+        await asyncio.gather(*(client_loop(client, path, deadline, conditional, latencies, statuses)
+                               for _ in range(clients)))
+        elapsed = time.perf_counter() - started
+    return {
+        "requests": len(latencies),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "latency_seconds": {"mean": round(sum(latencies) / len(latencies), 6) if latencies else None,
+                            **harness.percentiles(latencies)},
+        "statuses": {str(code): n for code, n in sorted(statuses.items(), key=str)},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=20, help="並行的客戶端數")
+    parser.add_argument("--duration", type=float, default=10, help="每個端點的測試秒數")
+    parser.add_argument("--days", type=float, default=30, help="預先寫入幾天的紀錄")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help=f"可用: {', '.join(ENDPOINTS)}")
+    parser.add_argument("--conditional", action="store_true", help="帶 If-None-Match 重送 (量測 304)")
+    parser.add_argument("--output", help="將結果寫入 JSON 檔")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="ptt-bench-") as workdir:
+        database_url = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        os.environ["DATABASE_URL"] = database_url
+        import ptt_backend
+
+        started = time.perf_counter()
+        records = asyncio.run(seed_database(ptt_backend, args.days, ptt_backend.SCRAPE_INTERVAL_SECONDS))
+        seed_seconds = time.perf_counter() - started
+
+        port = harness.free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        env = {"DATABASE_URL": database_url, "APP_ROLE": "api", "LEADER_LOCK_PATH": os.path.join(workdir, "leader.lock")}
+        server = harness.start_process(["-m", "uvicorn", "ptt_backend:app", "--port", str(port), "--log-level", "warning"],
+                                       env=env, ready_url=f"{base_url}/api/current-discount", timeout=120)
+        endpoints = {}
+        try:
+            for name in args.endpoints.split(","):
+                cpu_before = harness.process_cpu_seconds(server.pid)
+                endpoints[name] = asyncio.run(load_endpoint(base_url, ENDPOINTS[name], args.clients,
+                                                            args.duration, args.conditional))
+                cpu_after = harness.process_cpu_seconds(server.pid)
+                if cpu_before is not None and cpu_after is not None:
+                    endpoints[name]["server_cpu_seconds"] = round(cpu_after - cpu_before, 3)
+            server_peak_rss = harness.process_peak_rss_mb(server.pid)
+        finally:
+            harness.stop_process(server)
+
+    results = {
+        "records": records,
+        "seed_seconds": round(seed_seconds, 3),
+        "server_peak_rss_mb": server_peak_rss,
+        "endpoints": endpoints,
+    }
+    parameters = {key: value for key, value in vars(args).items() if key != "output"}
+    harness.write_report("api", parameters, results, args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
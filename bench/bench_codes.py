@@ -0,0 +1,170 @@
+"""對 /api/verify-code 做結帳尖峰的負載測試：單一驗證、批次驗證與重複使用的拒絕。
+
+先以 bench_api 的方式建立 SQLite 資料庫，再以 APP_ROLE=api 在子程序啟動 uvicorn。由 /api/discount-code 簽發
+--issue 個碼量測簽發速度，並取得目前的折扣與來源紀錄；其餘的碼由本程序以相同的 CODE_SIGNING_KEY 直接產生
+(與伺服器簽發的完全相同)，模擬大量顧客同時結帳。每個碼只送一次，所以 valid 數應等於送出的碼數；
+最後把已使用的碼再送一次，應全部回應 replayed。客戶端與伺服器在同一台機器時吞吐量會受客戶端限制，
+因此另外由 /proc 讀取伺服器的 CPU 時間換算每 CPU 秒可驗證的碼數，並量測不經 HTTP 時 CodeVerifier 的速度。
+
+    python -m bench.bench_codes [--clients 20] [--duration 10] [--batch-size 200] [--output bench_codes.json]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import httpx
+
+import ptt_codes
+from bench import harness
+from bench.bench_api import seed_database
+
+SIGNING_KEY = "bench-signing-key"
+
+
+async def issue_codes(base_url, count, clients):
+    """由伺服器簽發 count 個碼；回傳 (每秒簽發數, 最後一次的回應)"""
+    issued = []
+    async with httpx.AsyncClient(base_url=base_url, timeout=30.0) as client:
+        async def worker(n):
+            for _ in range(n):
+                response = await client.post("/api/discount-code")
+                response.raise_for_status()
+                issued.append(response.json())
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(count // clients + (i < count % clients)) for i in range(clients)))
+        elapsed = time.perf_counter() - started
+    return round(len(issued) / elapsed, 1), issued[-1]
+
+
+def make_codes(count, discount, record_id):
+    key = ptt_codes.derive_key(SIGNING_KEY)
+    now = int(time.time())
+    return [ptt_codes.issue(key, discount, record_id, now) for _ in range(count)]
+
+
+async def verify_load(base_url, codes, clients, duration, batch_size):
+    """每個客戶端從共用的碼清單依序取出 batch_size 個 (1 表示單一驗證) 送出，直到時間到或碼用完"""
+    latencies = []
+    statuses = Counter()
+    results = Counter()
+    used = []
+    position = 0
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30.0) as client:
+        deadline = time.perf_counter() + duration
+
+        async def worker():
+            nonlocal position
+            while time.perf_counter() < deadline and position < len(codes):
+                batch = codes[position:position + batch_size]
+                position += len(batch)
+                body = {"code": batch[0]} if batch_size == 1 else {"codes": batch}
+                started = time.perf_counter()
+                try:
+                    response = await client.post("/api/verify-code", json=body)
+                except httpx.HTTPError as e:
+                    statuses[type(e).__name__] += 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+                statuses[response.status_code] += 1
+                if response.status_code != 200:
+                    continue
+                payload = response.json()
+                for result in ([payload] if batch_size == 1 else payload["results"]):
+                    results[result["reason"] or "valid"] += 1
+                used.extend(batch)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(clients)))
+        elapsed = time.perf_counter() - started
+    return {
+        "requests": len(latencies),
+        "codes": len(used),
+        "codes_per_second": round(len(used) / elapsed, 1),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "latency_seconds": {"mean": round(sum(latencies) / len(latencies), 6) if latencies else None,
+                            **harness.percentiles(latencies)},
+        "statuses": {str(code): n for code, n in sorted(statuses.items(), key=str)},
+        "results": dict(results),
+    }, used
+
+
+def verifier_throughput(count, discount, record_id):
+    """不經 HTTP：同一組檢查每秒可驗證的碼數"""
+    recent = ptt_codes.RecentDiscounts(8)
+    recent.observe(record_id, 50.0, discount)
+    verifier = ptt_codes.CodeVerifier(ptt_codes.derive_key(SIGNING_KEY), 600, recent, ptt_codes.ReplayCache(count))
+    codes = make_codes(count, discount, record_id)
+    started = time.perf_counter()
+    for code in codes:
+        verifier.verify(code)
+    elapsed = time.perf_counter() - started
+    return {"codes": count, "codes_per_second": round(count / elapsed), "results": dict(verifier.results)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=20, help="並行的客戶端數")
+    parser.add_argument("--duration", type=float, default=10, help="每種驗證方式的測試秒數")
+    parser.add_argument("--batch-size", type=int, default=200, help="批次驗證每次送出的碼數")
+    parser.add_argument("--issue", type=int, default=1000, help="由伺服器簽發的碼數")
+    parser.add_argument("--codes", type=int, default=200000, help="每種驗證方式最多使用的碼數")
+    parser.add_argument("--days", type=float, default=1, help="預先寫入幾天的紀錄")
+    parser.add_argument("--output", help="將結果寫入 JSON 檔")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="ptt-bench-") as workdir:
+        database_url = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        os.environ["DATABASE_URL"] = database_url
+        import ptt_backend
+
+        asyncio.run(seed_database(ptt_backend, args.days, ptt_backend.SCRAPE_INTERVAL_SECONDS))
+        port = harness.free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        env = {"DATABASE_URL": database_url, "APP_ROLE": "api", "CODE_SIGNING_KEY": SIGNING_KEY,
+               "CODE_TTL_SECONDS": "600", "CODE_VERIFY_BATCH_MAX": str(max(args.batch_size, 1)),
+               "WARM_STATE_PATH": "", "LEADER_LOCK_PATH": os.path.join(workdir, "leader.lock")}
+        server = harness.start_process(["-m", "uvicorn", "ptt_backend:app", "--port", str(port), "--log-level", "warning"],
+                                       env=env, ready_url=f"{base_url}/readyz", timeout=120)
+        modes = {}
+        try:
+            issue_rate, sample = asyncio.run(issue_codes(base_url, args.issue, args.clients))
+            discount, record_id = sample["discount_percentage"], sample["record_id"]
+            for name, batch_size in (("single", 1), ("batch", args.batch_size)):
+                codes = make_codes(args.codes, discount, record_id)
+                cpu_before = harness.process_cpu_seconds(server.pid)
+                modes[name], used = asyncio.run(verify_load(base_url, codes, args.clients, args.duration, batch_size))
+                cpu_after = harness.process_cpu_seconds(server.pid)
+                if cpu_before is not None and cpu_after is not None:
+                    # 客戶端與伺服器在同一台機器上搶 CPU 時，以伺服器實際用掉的 CPU 換算它單獨能處理的碼數
+                    cpu_seconds = cpu_after - cpu_before
+                    modes[name]["server_cpu_seconds"] = round(cpu_seconds, 3)
+                    if cpu_seconds > 0:
+                        modes[name]["server_codes_per_cpu_second"] = round(modes[name]["codes"] / cpu_seconds, 1)
+            modes["replay"], _ = asyncio.run(verify_load(base_url, used, args.clients, args.duration, args.batch_size))
+            server_peak_rss = harness.process_peak_rss_mb(server.pid)
+            server_stats = httpx.get(f"{base_url}/api/scraper-status").json()["discount_codes"]
+        finally:
+            harness.stop_process(server)
+
+    results = {
+        "issue_per_second": issue_rate,
+        "discount_percentage": discount,
+        "record_id": record_id,
+        "verify": modes,
+        "in_process": verifier_throughput(min(args.codes, 100000), discount, record_id),
+        "server_peak_rss_mb": server_peak_rss,
+        "server": server_stats,
+    }
+    parameters = {key: value for key, value in vars(args).items() if key != "output"}
+    harness.write_report("codes", parameters, results, args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
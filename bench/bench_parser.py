@@ -0,0 +1,155 @@
+"""比較 ptt_parser 與原本 BeautifulSoup('html.parser') 寫法的解析結果與速度。
+
+先以 bench/fixtures 下的邊界案例與產生的大型頁面檢查每個後端的輸出是否與 BeautifulSoup 完全一致
+(不一致時以非零狀態結束)，再量測各後端的解析時間，結果以 JSON 輸出。
+
+    python -m bench.bench_parser [--pushes 2000] [--repeat 5] [--output bench_parser.json]
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+
+import ptt_parser
+from bench import ptt_fixtures
+
+FIXTURE_DIR = Path(__file__).parent / "fixtures"
+
+
+# --- 原本 ptt_backend 中的 BeautifulSoup 寫法，作為正確性的參考 ---
+def bs4_article_hrefs(html):
+    soup = BeautifulSoup(html, "html.parser")
+    hrefs = []
+    for entry in soup.select("div.r-ent"):
+        link = entry.select_one("div.title a")
+        if link is not None and link.get('href') is not None:
+            hrefs.append(link['href'])
+    return hrefs
+
+
+def bs4_prev_page_href(html):
+    soup = BeautifulSoup(html, "html.parser")
+    for link in soup.select("div.btn-group-paging a"):
+        if link.get('href') is not None and ptt_parser.PREV_PAGE_TEXT in link.get_text():
+            return link['href']
+    return None
+
+
+def bs4_board(html):
+    return bs4_article_hrefs(html), bs4_prev_page_href(html)
+
+
+def parser_board(html, backend):
+    return ptt_parser.extract_article_hrefs(html, backend), ptt_parser.extract_prev_page_href(html, backend)
+
+
+def bs4_pushes(html):
+    soup = BeautifulSoup(html, 'html.parser')
+    pushes = []
+    for push_div in soup.select('div.push'):
+        tag_span = push_div.select_one('span.push-tag')
+        user_span = push_div.select_one('span.push-userid')
+        ip_span = push_div.select_one('span.push-ipdatetime')
+        pushes.append((
+            tag_span.string.strip() if tag_span and tag_span.string else None,
+            user_span.get_text().strip() if user_span else None,
+            ip_span.get_text().strip() if ip_span else None,
+        ))
+    return pushes
+
+
+def available_backends():
+    backends = ["stream"]
+    if ptt_parser.LexborHTMLParser is not None:
+        backends.append("selectolax")
+    return backends
+
+
+def build_pages(push_count):
+    articles, board_html = ptt_fixtures.make_board(count=20, prev_page=39000)
+    large_article = ptt_fixtures.render_article(articles[1][0], ptt_fixtures.make_pushes(push_count, seed=2), seed=2)
+    # 增量爬取時只解析最後一段推文之後的片段 (前面沒有 <html>/<body>，後面有多餘的結束標籤)
+    tail_start = large_article.index('<div class="push">', len(large_article) * 3 // 4)
+    pages = {
+        "board_edge_cases": ("board", (FIXTURE_DIR / "board_edge_cases.html").read_text(encoding="utf-8")),
+        "article_edge_cases": ("article", (FIXTURE_DIR / "article_edge_cases.html").read_text(encoding="utf-8")),
+        "board_index": ("board", board_html),
+        "board_oldest_page": ("board", ptt_fixtures.make_board(count=20, seed=3)[1]),
+        "article_small": ("article", ptt_fixtures.render_article(articles[0][0], ptt_fixtures.make_pushes(30, seed=1))),
+        f"article_{push_count}_pushes": ("article", large_article),
+        "article_tail_fragment": ("article", large_article[tail_start:]),
+    }
+    return pages
+
+
+def check_equivalence(pages, backends):
+    failures = []
+    for name, (kind, html) in pages.items():
+        expected = bs4_board(html) if kind == "board" else bs4_pushes(html)
+        for backend in backends:
+            if kind == "board":
+                actual = parser_board(html, backend)
+            else:
+                actual = ptt_parser.extract_pushes(html, backend)
+            if actual != expected:
+                failures.append((name, backend, expected, actual))
+    return failures
+
+
+def time_call(func, html, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(html)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def run_benchmark(pages, backends, repeat):
+    results = {}
+    for name, (kind, html) in pages.items():
+        if kind == "board":
+            candidates = {"bs4": bs4_article_hrefs}
+            candidates.update({b: (lambda h, b=b: ptt_parser.extract_article_hrefs(h, b)) for b in backends})
+        else:
+            candidates = {"bs4": bs4_pushes}
+            candidates.update({b: (lambda h, b=b: ptt_parser.extract_pushes(h, b)) for b in backends})
+        timings = {label: time_call(func, html, repeat) for label, func in candidates.items()}
+        results[name] = {
+            "bytes": len(html.encode("utf-8")),
+            "best_seconds": {label: round(seconds, 6) for label, seconds in timings.items()},
+            "speedup_vs_bs4": {label: round(timings["bs4"] / seconds, 1) for label, seconds in timings.items() if label != "bs4"},
+        }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pushes", type=int, default=2000, help="大型文章的推文數")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="將結果寫入 JSON 檔")
+    args = parser.parse_args(argv)
+
+    backends = available_backends()
+    pages = build_pages(args.pushes)
+
+    failures = check_equivalence(pages, backends)
+    for name, backend, expected, actual in failures:
+        print(f"[不一致] {name} / {backend}\n  bs4: {expected}\n  {backend}: {actual}", file=sys.stderr)
+    if failures:
+        return 1
+    print(f"一致性檢查通過：{len(pages)} 個頁面 x {len(backends)} 個後端 ({', '.join(backends)})")
+
+    report = {"default_backend": ptt_parser.PARSER_BACKEND, "pages": run_benchmark(pages, backends, args.repeat)}
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    print(output)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
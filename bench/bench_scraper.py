@@ -0,0 +1,137 @@
+"""以本機的 PTT 替身伺服器量測完整一輪 deep_scrape_ppi 的延遲、CPU 時間與尖峰 RSS。
+
+替身伺服器 (bench/ptt_server.py) 在子程序中執行，量到的資源用量只包含爬蟲本身。
+第一輪為冷啟動 (完整下載與解析)，之後每輪前伺服器會替每篇文章新增推文，量測增量爬取。
+爬蟲設定 (PTT_URL、SCRAPE_*、PARSE_* 等) 在匯入 ptt_backend 之前以環境變數指定。
+爬取期間另有一個探測任務每 LOOP_PROBE_INTERVAL 秒量一次事件迴圈的延遲 (同一迴圈上的 API 請求會多等這麼久)，
+可用 --parse-mode inline 與 process 比較解析移出事件迴圈的效果。
+
+    python -m bench.bench_scraper [--cycles 3] [--large-ratio 0.1] [--slow-ratio 0.05] [--parse-mode process] [--output bench_scraper.json]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+
+import ptt_parser
+from bench import harness, ptt_server
+
+LOOP_PROBE_INTERVAL = 0.005
+
+
+def configure_backend(base_url, args):
+    os.environ.update({
+        "LOG_LEVEL": "DEBUG" if args.verbose else "WARNING",
+        "PTT_URL": base_url,
+        "SCRAPE_ENGINE": args.engine,
+        "SCRAPE_BOARDS": args.boards,
+        "SCRAPE_PAGE_DEPTH": str(args.pages),
+        "ARTICLES_PER_BOARD": str(args.articles_per_board),
+        "SCRAPE_CONCURRENCY": str(args.concurrency),
+        "HOST_RATE_LIMIT": str(args.host_rate_limit),
+        "ARTICLE_TIMEOUT": str(args.article_timeout),
+        "SCRAPE_CYCLE_BUDGET": str(args.budget),
+        "PARSE_MODE": args.parse_mode,
+        "PARSE_WORKERS": str(args.parse_workers),
+    })
+    os.environ.pop("ARTICLE_CACHE_PATH", None)
+
+
+async def probe_loop_lag(lags):
+    """每次預定睡 LOOP_PROBE_INTERVAL 秒，記錄實際多等的時間"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(LOOP_PROBE_INTERVAL)
+        lags.append(loop.time() - started - LOOP_PROBE_INTERVAL)
+
+async def run_cycles(backend, base_url, cycles):
+    results = []
+    for cycle in range(cycles):
+        if cycle:
+            httpx.post(f"{base_url}/_bench/advance").raise_for_status()
+        cache_before = backend.article_cache.stats()
+        cpu_before = time.process_time()
+        lags = []
+        probe = asyncio.create_task(probe_loop_lag(lags))
+        started = time.perf_counter()
+        ppi = await backend.deep_scrape_ppi()
+        elapsed = time.perf_counter() - started
+        probe.cancel()
+        cache_after = backend.article_cache.stats()
+        results.append({
+            "cycle": cycle,
+            "seconds": round(elapsed, 4),
+            "cpu_seconds": round(time.process_time() - cpu_before, 4),
+            "loop_lag_seconds": {"max": round(max(lags), 6) if lags else None, **harness.percentiles(lags)},
+            "ppi": round(ppi, 4) if ppi is not None else None,
+            "engine": backend.last_scrape_engine,
+            "boards": backend.last_board_ppis,
+            "article_modes": {
+                mode: cache_after[mode] - cache_before[mode] for mode in ("full", "incremental", "not_modified")
+            },
+        })
+    await backend.close_http_client()
+    await backend.browser_pool.close()
+    await backend.parse_stage.close()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ptt_server.add_arguments(parser)
+    parser.add_argument("--cycles", type=int, default=3)
+    parser.add_argument("--engine", default="httpx", choices=("httpx", "auto", "playwright"))
+    parser.add_argument("--articles-per-board", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--host-rate-limit", type=float, default=0, help="每秒請求上限；0 表示不限制")
+    parser.add_argument("--article-timeout", type=float, default=20)
+    parser.add_argument("--budget", type=float, default=120)
+    parser.add_argument("--parse-mode", default="process", choices=("process", "thread", "inline"))
+    parser.add_argument("--parse-workers", type=int, default=4)
+    parser.add_argument("--verbose", action="store_true", help="顯示爬蟲的逐篇輸出")
+    parser.add_argument("--output", help="將結果寫入 JSON 檔")
+    args = parser.parse_args(argv)
+
+    port = harness.free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server_args = ["-m", "bench.ptt_server", "--port", str(port)]
+    for name in ("boards", "pages", "articles_per_page", "pushes", "large_pushes", "large_ratio", "slow_ratio",
+                 "slow_seconds", "fail_ratio", "fail_status", "growth", "seed"):
+        server_args += [f"--{name.replace('_', '-')}", str(getattr(args, name))]
+    server = harness.start_process(server_args, ready_url=f"{base_url}/_bench/stats")
+    try:
+        configure_backend(base_url, args)
+        baseline = harness.self_usage()
+        import ptt_backend
+        imported = harness.self_usage()
+        cycles = asyncio.run(run_cycles(ptt_backend, base_url, args.cycles))
+        parse_stage = ptt_backend.parse_stage.stats()
+        server_stats = httpx.get(f"{base_url}/_bench/stats").json()
+    finally:
+        harness.stop_process(server)
+
+    usage = harness.self_usage()
+    cold, warm = cycles[0], cycles[1:]
+    results = {
+        "cold_cycle_seconds": cold["seconds"],
+        "warm_cycle_seconds_mean": round(sum(c["seconds"] for c in warm) / len(warm), 4) if warm else None,
+        "cpu_seconds_total": round(sum(c["cpu_seconds"] for c in cycles), 4),
+        "peak_rss_mb": usage["peak_rss_mb"],
+        "rss_before_import_mb": baseline["peak_rss_mb"],
+        "rss_after_import_mb": imported["peak_rss_mb"],
+        "parser_backend": ptt_parser.PARSER_BACKEND,
+        "parse_stage": parse_stage,
+        "cycles": cycles,
+        "server": server_stats,
+    }
+    parameters = {key: value for key, value in vars(args).items() if key not in ("output", "verbose")}
+    harness.write_report("scraper", parameters, results, args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
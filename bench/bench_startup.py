@@ -0,0 +1,99 @@
+"""量測 API 程序的冷啟動：從啟動子程序到各端點第一次可用的時間。
+
+先以 bench_api 的方式建立 SQLite 資料庫，再以 APP_ROLE=api 在子程序啟動 uvicorn，每 POLL_INTERVAL 秒輪詢
+/healthz、/api/current-discount 與 /readyz，記錄第一次成功的時間；current-discount 另外記錄第一次回應非 stale 資料的時間。
+每一輪分兩種情況各啟動 --runs 次：cold 沒有暖啟動檔案，warm 沿用 cold 最後一次留下的檔案。
+伺服器自己記錄的啟動時間軸 (/healthz 的 startup.phases，從程序建立起算) 也一併輸出。
+
+    python -m bench.bench_startup [--runs 3] [--days 30] [--output bench_startup.json]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+
+from bench import harness
+from bench.bench_api import seed_database
+
+POLL_INTERVAL = 0.01
+
+
+def measure_startup(port, env, timeout):
+    base_url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    server = harness.start_process(["-m", "uvicorn", "ptt_backend:app", "--port", str(port), "--log-level", "warning"],
+                                   env=env)
+    firsts = {}
+    try:
+        with httpx.Client(base_url=base_url, timeout=1.0) as client:
+            deadline = started + timeout
+            while "fresh_discount" not in firsts or "readyz" not in firsts:
+                if time.perf_counter() > deadline:
+                    raise RuntimeError(f"等待伺服器就緒超過 {timeout:g} 秒")
+                if server.poll() is not None:
+                    raise RuntimeError(f"伺服器提早結束:\n{server.stderr.read()}")
+                for name, path in (("healthz", "/healthz"), ("discount", "/api/current-discount"), ("readyz", "/readyz")):
+                    if name in firsts and (name != "discount" or "fresh_discount" in firsts):
+                        continue
+                    try:
+                        response = client.get(path)
+                    except httpx.HTTPError:
+                        continue
+                    if not response.is_success:
+                        continue
+                    elapsed = round(time.perf_counter() - started, 4)
+                    firsts.setdefault(name, elapsed)
+                    if name == "discount" and not response.json().get("stale"):
+                        firsts["fresh_discount"] = elapsed
+                time.sleep(POLL_INTERVAL)
+            timeline = client.get("/healthz").json()["startup"]
+    finally:
+        harness.stop_process(server)
+    return {"first_success_seconds": firsts, "server_timeline": timeline}
+
+
+def summarize(runs):
+    names = sorted({name for run in runs for name in run["first_success_seconds"]})
+    return {name: {"mean": round(sum(r["first_success_seconds"][name] for r in runs) / len(runs), 4),
+                   "min": min(r["first_success_seconds"][name] for r in runs)}
+            for name in names if all(name in r["first_success_seconds"] for r in runs)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3, help="每種情況啟動幾次")
+    parser.add_argument("--days", type=float, default=30, help="預先寫入幾天的紀錄")
+    parser.add_argument("--timeout", type=float, default=120, help="單次啟動的等待上限 (秒)")
+    parser.add_argument("--output", help="將結果寫入 JSON 檔")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="ptt-bench-") as workdir:
+        database_url = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        warm_state_path = os.path.join(workdir, "warm_state.json")
+        os.environ["DATABASE_URL"] = database_url
+        import ptt_backend
+
+        records = asyncio.run(seed_database(ptt_backend, args.days, ptt_backend.SCRAPE_INTERVAL_SECONDS))
+        env = {"DATABASE_URL": database_url, "APP_ROLE": "api", "WARM_STATE_PATH": warm_state_path,
+               "LEADER_LOCK_PATH": os.path.join(workdir, "leader.lock")}
+        scenarios = {}
+        for scenario in ("cold", "warm"):
+            runs = []
+            for _ in range(args.runs):
+                if scenario == "cold" and os.path.exists(warm_state_path):
+                    os.remove(warm_state_path)
+                runs.append(measure_startup(harness.free_port(), env, args.timeout))
+            scenarios[scenario] = {"summary": summarize(runs), "runs": runs}
+
+    results = {"records": records, "scenarios": scenarios}
+    parameters = {key: value for key, value in vars(args).items() if key != "output"}
+    harness.write_report("startup", parameters, results, args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""基準測試共用的工具：子程序伺服器、資源用量量測與 JSON 結果輸出"""
+import json
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_process(args, env=None, ready_url=None, timeout=30.0):
+    """以目前的 Python 在專案根目錄啟動子程序；指定 ready_url 時等到它回應 2xx 為止"""
+    process = subprocess.Popen([sys.executable, *args], cwd=ROOT, env={**os.environ, **(env or {})},
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if ready_url is None:
+        return process
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"子程序提早結束: {' '.join(args)}\n{process.stderr.read()}")
+        try:
+            if httpx.get(ready_url, timeout=1.0, cookies={"over18": "1"}).is_success:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    stop_process(process)
+    raise RuntimeError(f"等待 {ready_url} 超過 {timeout:g} 秒")
+
+
+def stop_process(process):
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def process_peak_rss_mb(pid):
+    """Linux 上讀取 /proc/<pid>/status 的 VmHWM；其他平台回傳 None"""
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def process_cpu_seconds(pid):
+    """Linux 上由 /proc/<pid>/stat 讀取 user + system CPU 時間；其他平台回傳 None"""
+    try:
+        with open(f"/proc/{pid}/stat", encoding="ascii") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def self_usage():
+    """目前程序的 CPU 時間 (秒) 與尖峰 RSS (MB)"""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    peak_kb = usage.ru_maxrss / 1024 if sys.platform == "darwin" else usage.ru_maxrss
+    return {
+        "cpu_user_seconds": round(usage.ru_utime, 3),
+        "cpu_system_seconds": round(usage.ru_stime, 3),
+        "peak_rss_mb": round(peak_kb / 1024, 1),
+    }
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    if not samples:
+        return {f"p{p}": None for p in points}
+    ordered = sorted(samples)
+    return {f"p{p}": round(ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))], 6) for p in points}
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_report(name, parameters, results, output=None):
+    """加上 commit 與環境資訊後輸出 JSON；不同 commit 的結果可直接比較"""
+    report = {
+        "benchmark": name,
+        "commit": git_revision(),
+        "recorded_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": parameters,
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if output:
+        Path(output).write_text(text, encoding="utf-8")
+    return report
@@ -0,0 +1,151 @@
+"""依照 PTT 網頁版的實際標記產生看板列表頁與文章內頁，供解析器與爬蟲的離線基準測試使用。
+
+產生結果只由參數與亂數種子決定，同一組參數每次都會得到位元組完全相同的頁面。
+"""
+import html
+import random
+
+BOARD = "Gossiping"
+PUSH_USERS = [f"user{n:03d}" for n in range(200)]
+PUSH_CONTENTS = ["真的假的", "推推", "這個有料", "笑死", "？？？", "專業", "好喔", "樓上說的對", "噓爆", "先推再看"]
+
+
+def article_id(index: int, base_time: int = 1697400000):
+    return f"M.{base_time + index * 37}.A.{index * 2654435761 % 4096:03X}"
+
+
+def article_href(board: str, article: str):
+    return f"/bbs/{board}/{article}.html"
+
+
+def make_pushes(count: int, seed: int = 0, boo_ratio: float = 0.3, neutral_ratio: float = 0.2):
+    """產生 (推文標籤, 使用者, 內容, IP 與時間) 的清單"""
+    rng = random.Random(seed)
+    pushes = []
+    for n in range(count):
+        roll = rng.random()
+        if roll < neutral_ratio:
+            tag = "→"
+        elif roll < neutral_ratio + boo_ratio:
+            tag = "噓"
+        else:
+            tag = "推"
+        minute = n % (24 * 60)
+        ipdatetime = f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)} 10/16 {minute // 60:02d}:{minute % 60:02d}"
+        pushes.append((tag, rng.choice(PUSH_USERS), rng.choice(PUSH_CONTENTS), ipdatetime))
+    return pushes
+
+
+def render_push(tag: str, user: str, content: str, ipdatetime: str):
+    tag_class = "hl push-tag" if tag == "推" else "f1 hl push-tag"
+    return (
+        f'<div class="push"><span class="{tag_class}">{tag} </span>'
+        f'<span class="f3 hl push-userid">{html.escape(user)}</span>'
+        f'<span class="f3 push-content">: {html.escape(content)}</span>'
+        f'<span class="push-ipdatetime"> {ipdatetime}\n</span></div>'
+    )
+
+
+def render_article(article: str, pushes, title: str = "[問卦] 測試文章", board: str = BOARD,
+                   author: str = "tester (測試)", body_lines: int = 20, seed: int = 0):
+    rng = random.Random(seed)
+    body = "\n".join("".join(rng.choice("今天天氣很好大家覺得呢我想問問看八卦版的鄉民們") for _ in range(30)) for _ in range(body_lines))
+    url = f"https://www.ptt.cc{article_href(board, article)}"
+    push_html = "".join(render_push(*push) for push in pushes)
+    return f"""<!DOCTYPE html>
+<html>
+	<head>
+		<meta charset="utf-8">
+		<meta name="viewport" content="width=device-width, initial-scale=1">
+		<title>{html.escape(title)} - 看板 {board} - 批踢踢實業坊</title>
+		<link rel="stylesheet" type="text/css" href="//images.ptt.cc/bbs/v2.27/bbs-common.css">
+		<link rel="stylesheet" type="text/css" href="//images.ptt.cc/bbs/v2.27/bbs-base.css" media="screen">
+		<link rel="stylesheet" type="text/css" href="//images.ptt.cc/bbs/v2.27/pushstream.css" media="screen">
+		<script src="//ajax.googleapis.com/ajax/libs/jquery/2.1.1/jquery.min.js"></script>
+		<script src="//images.ptt.cc/bbs/v2.27/bbs.js"></script>
+		<script async src="https://www.googletagmanager.com/gtag/js?id=G-DZ6Y3BY9GW"></script>
+	</head>
+	<body>
+<div id="topbar-container">
+	<div id="topbar" class="bbs-content">
+		<a id="logo" href="/bbs/">批踢踢實業坊</a>
+		<span>&rsaquo;</span>
+		<a class="board" href="/bbs/{board}/index.html"><span class="board-label">看板 </span>{board}</a>
+	</div>
+</div>
+<div id="main-container">
+<div id="main-content" class="bbs-screen bbs-content"><div class="article-metaline"><span class="article-meta-tag">作者</span><span class="article-meta-value">{html.escape(author)}</span></div><div class="article-metaline-right"><span class="article-meta-tag">看板</span><span class="article-meta-value">{board}</span></div><div class="article-metaline"><span class="article-meta-tag">標題</span><span class="article-meta-value">{html.escape(title)}</span></div><div class="article-metaline"><span class="article-meta-tag">時間</span><span class="article-meta-value">Mon Oct 16 12:00:00 2023</span></div>
+{body}
+
+--
+<span class="f2">※ 發信站: 批踢踢實業坊(ptt.cc), 來自: 1.2.3.4 (臺灣)
+</span><span class="f2">※ 文章網址: <a href="{url}" target="_blank" rel="noopener noreferrer nofollow">{url}</a>
+</span>{push_html}</div>
+<div id="article-polling" data-pollurl="/poll/{board}/{article}.html?cacheKey=2001-000000000&offset=0&offset-sig=0" data-longpollurl="/v1/longpoll?id=0" data-offset="0"></div>
+</div>
+<script>
+  window.dataLayer = window.dataLayer || [];
+  function gtag(){{dataLayer.push(arguments);}}
+  gtag('js', new Date());
+</script>
+	</body>
+</html>
+"""
+
+
+def render_board_index(articles, board: str = BOARD, prev_page: int = None, deleted_every: int = 7):
+    """articles 為 (文章 ID, 標題, 推文數) 的清單；prev_page 為「上頁」連結的頁碼"""
+    entries = []
+    for n, (article, title, push_count) in enumerate(articles):
+        if deleted_every and n % deleted_every == deleted_every - 1:
+            title_html = "\n\t\t\t\n\t\t\t\t(本文已被刪除) [someone]\n\t\t\t\n\t\t\t"
+        else:
+            title_html = f'\n\t\t\t\n\t\t\t\t<a href="{article_href(board, article)}">{html.escape(title)}</a>\n\t\t\t\n\t\t\t'
+        nrec = "爆" if push_count >= 100 else (str(push_count) if push_count else "")
+        entries.append(f"""
+		<div class="r-ent">
+			<div class="nrec"><span class="hl f2">{nrec}</span></div>
+			<div class="title">{title_html}</div>
+			<div class="meta">
+				<div class="author">author{n}</div>
+				<div class="article-menu">
+					<div class="trigger">&#x22ef;</div>
+				</div>
+				<div class="date">10/16</div>
+				<div class="mark"></div>
+			</div>
+		</div>""")
+    prev_link = f'<a class="btn wide" href="/bbs/{board}/index{prev_page}.html">&lsaquo; 上頁</a>' if prev_page else '<a class="btn wide disabled">&lsaquo; 上頁</a>'
+    return f"""<!DOCTYPE html>
+<html>
+	<head>
+		<meta charset="utf-8">
+		<title>看板 {board} 文章列表 - 批踢踢實業坊</title>
+		<link rel="stylesheet" type="text/css" href="//images.ptt.cc/bbs/v2.27/bbs-common.css">
+	</head>
+	<body>
+<div id="main-container">
+	<div id="action-bar-container">
+		<div class="action-bar">
+			<div class="btn-group btn-group-paging">
+				<a class="btn wide" href="/bbs/{board}/index1.html">最舊</a>
+				{prev_link}
+				<a class="btn wide disabled">下頁 &rsaquo;</a>
+				<a class="btn wide" href="/bbs/{board}/index.html">最新</a>
+			</div>
+		</div>
+	</div>
+	<div class="r-list-container action-bar-margin bbs-screen">
+		<div class="search-bar"><form type="get" action="search" id="search-bar"><input class="query" type="text" name="q" value="" placeholder="搜尋文章&#x22ef;"></form></div>{"".join(entries)}
+		<div class="r-list-sep"></div>
+	</div>
+</div>
+	</body>
+</html>
+"""
+
+
+def make_board(count: int = 20, seed: int = 0, board: str = BOARD, prev_page: int = None, start: int = 0):
+    rng = random.Random(seed)
+    articles = [(article_id(start + n), f"[問卦] 第 {start + n} 篇", rng.randint(0, 150)) for n in range(count)]
+    return articles, render_board_index(articles, board=board, prev_page=prev_page)
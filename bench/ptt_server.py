@@ -0,0 +1,243 @@
+"""離線的 PTT 替身伺服器：以 bench.ptt_fixtures 產生的看板列表頁與文章內頁回應爬蟲。
+
+行為盡量貼近 ptt.cc：
+- 沒有 over18=1 cookie 的請求會被導向 /ask/over18 年齡確認頁
+- 文章支援 ETag / If-None-Match 與 Range (bytes=N-)，讓增量爬取走與正式環境相同的路徑
+- 可設定大型推文串、回應緩慢與回應失敗的文章比例，以及每輪 (/_bench/advance) 新增的推文數
+
+所有頁面只由參數與種子決定，同一組參數在不同 commit 之間會得到相同的內容。
+
+    python -m bench.ptt_server [--port 8765] [--boards Gossiping,Stock] [--slow-ratio 0.1]
+"""
+import argparse
+import asyncio
+import hashlib
+import random
+import re
+from dataclasses import dataclass
+
+from starlette.applications import Starlette
+from starlette.responses import HTMLResponse, JSONResponse, RedirectResponse, Response
+from starlette.routing import Route
+
+from bench import ptt_fixtures
+
+OVER18_PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>批踢踢實業坊</title></head>
+<body><div class="bbs-screen bbs-content"><div class="over18-notice">
+<p>本網站已依網站內容分級規定處理</p><p>警告︰您即將進入之看板內容需滿十八歲方可瀏覽。</p></div>
+<form action="/ask/over18" method="post"><input type="hidden" name="from" value="{from_path}">
+<div class="over18-button-container"><button class="btn-big" type="submit" name="yes" value="yes">我同意，我已年滿十八歲<br><small>進入</small></button></div>
+<div class="over18-button-container"><button class="btn-big" type="submit" name="no" value="no">未滿十八歲或不同意本條款<br><small>離開</small></button></div>
+</form></div></body></html>
+"""
+
+_RANGE = re.compile(r"bytes=(\d+)-$")
+
+
+@dataclass
+class StandInConfig:
+    boards: tuple = (ptt_fixtures.BOARD,)
+    pages: int = 3                # 每個看板可往「上頁」翻的頁數
+    articles_per_page: int = 20
+    pushes: int = 80              # 一般文章的推文數
+    large_pushes: int = 3000      # 大型推文串的推文數
+    large_ratio: float = 0.1
+    slow_ratio: float = 0.0
+    slow_seconds: float = 2.0
+    fail_ratio: float = 0.0
+    fail_status: int = 404        # 5xx/403/429 會讓爬蟲判定為被擋並改用 Playwright
+    growth: int = 5               # 每次 /_bench/advance 每篇文章新增的推文數
+    seed: int = 0
+
+
+class PttStandIn:
+    """依 StandInConfig 產生並快取所有頁面；文章內容在 advance() 時才會改變"""
+    def __init__(self, config: StandInConfig):
+        self.config = config
+        self.round = 0
+        self.requests = 0
+        self.over18_redirects = 0
+        self.not_modified = 0
+        self.partial = 0
+        self.failed = 0
+        self._boards = {}
+        self._articles = {}
+        self._rendered = {}
+        for board_index, board in enumerate(config.boards):
+            self._build_board(board, board_index)
+
+    def _build_board(self, board, board_index):
+        config = self.config
+        rng = random.Random(f"{config.seed}:{board}")
+        newest_page = 1000 + board_index
+        for depth in range(config.pages):
+            page_number = newest_page - depth
+            start = (board_index * config.pages + depth) * config.articles_per_page
+            prev_page = page_number - 1 if depth + 1 < config.pages else None
+            articles, html = ptt_fixtures.make_board(config.articles_per_page, seed=start, board=board,
+                                                     prev_page=prev_page, start=start)
+            self._boards[(board, "index.html" if depth == 0 else f"index{page_number}.html")] = html
+            for article, _title, _nrec in articles:
+                roll = rng.random()
+                self._articles[(board, article)] = {
+                    "pushes": config.large_pushes if roll < config.large_ratio else config.pushes,
+                    "slow": rng.random() < config.slow_ratio,
+                    "fail": rng.random() < config.fail_ratio,
+                    "seed": start + len(self._articles),
+                }
+
+    def advance(self):
+        """模擬下一輪爬取前新增推文 (文章尾端變長，ETag 改變)"""
+        self.round += 1
+        self._rendered.clear()
+
+    def article_body(self, board, article):
+        key = (board, article)
+        cached = self._rendered.get(key)
+        if cached is None:
+            spec = self._articles[key]
+            count = spec["pushes"] + self.round * self.config.growth
+            pushes = ptt_fixtures.make_pushes(count, seed=spec["seed"])
+            body = ptt_fixtures.render_article(article, pushes, board=board, seed=spec["seed"]).encode("utf-8")
+            cached = (body, f'"{hashlib.md5(body).hexdigest()[:16]}"')
+            self._rendered[key] = cached
+        return cached
+
+    def stats(self):
+        specs = self._articles.values()
+        return {
+            "round": self.round,
+            "requests": self.requests,
+            "over18_redirects": self.over18_redirects,
+            "not_modified": self.not_modified,
+            "partial": self.partial,
+            "failed": self.failed,
+            "articles": len(self._articles),
+            "large_articles": sum(spec["pushes"] == self.config.large_pushes for spec in specs),
+            "slow_articles": sum(spec["slow"] for spec in specs),
+            "failing_articles": sum(spec["fail"] for spec in specs),
+        }
+
+
+def create_app(config: StandInConfig = None):
+    stand_in = PttStandIn(config or StandInConfig())
+
+    def over18_gate(request):
+        if request.cookies.get("over18") == "1":
+            return None
+        stand_in.over18_redirects += 1
+        return RedirectResponse(f"/ask/over18?from={request.url.path}", status_code=302)
+
+    async def bbs_page(request):
+        stand_in.requests += 1
+        redirect = over18_gate(request)
+        if redirect is not None:
+            return redirect
+        board, name = request.path_params["board"], request.path_params["name"]
+        if name.startswith("index"):
+            html = stand_in._boards.get((board, name))
+            if html is None:
+                return HTMLResponse("404 - Not Found.", status_code=404)
+            return HTMLResponse(html)
+        return await article_page(request, board, name.removesuffix(".html"))
+
+    async def article_page(request, board, article):
+        spec = stand_in._articles.get((board, article))
+        if spec is None:
+            return HTMLResponse("404 - Not Found.", status_code=404)
+        if spec["slow"]:
+            await asyncio.sleep(stand_in.config.slow_seconds)
+        if spec["fail"]:
+            stand_in.failed += 1
+            return HTMLResponse("Service Unavailable", status_code=stand_in.config.fail_status)
+
+        body, etag = stand_in.article_body(board, article)
+        headers = {"ETag": etag, "Accept-Ranges": "bytes"}
+        if request.headers.get("if-none-match") == etag:
+            stand_in.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        match = _RANGE.match(request.headers.get("range", ""))
+        if match:
+            start = int(match.group(1))
+            if start >= len(body):
+                return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{len(body)}"})
+            stand_in.partial += 1
+            headers["Content-Range"] = f"bytes {start}-{len(body) - 1}/{len(body)}"
+            return Response(body[start:], status_code=206, media_type="text/html; charset=utf-8", headers=headers)
+        return Response(body, media_type="text/html; charset=utf-8", headers=headers)
+
+    async def ask_over18(request):
+        return HTMLResponse(OVER18_PAGE.format(from_path=request.query_params.get("from", "/")))
+
+    async def accept_over18(request):
+        form = await request.form()
+        response = RedirectResponse(form.get("from") or "/", status_code=302)
+        if form.get("yes"):
+            response.set_cookie("over18", "1", path="/")
+        return response
+
+    async def advance(request):
+        stand_in.advance()
+        return JSONResponse(stand_in.stats())
+
+    async def stats(request):
+        return JSONResponse(stand_in.stats())
+
+    app = Starlette(routes=[
+        Route("/bbs/{board}/{name}", bbs_page),
+        Route("/ask/over18", ask_over18, methods=["GET"]),
+        Route("/ask/over18", accept_over18, methods=["POST"]),
+        Route("/_bench/advance", advance, methods=["POST"]),
+        Route("/_bench/stats", stats),
+    ])
+    app.state.stand_in = stand_in
+    return app
+
+
+def add_arguments(parser):
+    defaults = StandInConfig()
+    parser.add_argument("--boards", default=",".join(defaults.boards))
+    parser.add_argument("--pages", type=int, default=defaults.pages)
+    parser.add_argument("--articles-per-page", type=int, default=defaults.articles_per_page)
+    parser.add_argument("--pushes", type=int, default=defaults.pushes)
+    parser.add_argument("--large-pushes", type=int, default=defaults.large_pushes)
+    parser.add_argument("--large-ratio", type=float, default=defaults.large_ratio)
+    parser.add_argument("--slow-ratio", type=float, default=defaults.slow_ratio)
+    parser.add_argument("--slow-seconds", type=float, default=defaults.slow_seconds)
+    parser.add_argument("--fail-ratio", type=float, default=defaults.fail_ratio)
+    parser.add_argument("--fail-status", type=int, default=defaults.fail_status)
+    parser.add_argument("--growth", type=int, default=defaults.growth)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+
+
+def config_from_args(args):
+    return StandInConfig(
+        boards=tuple(b.strip() for b in args.boards.split(",") if b.strip()),
+        pages=args.pages,
+        articles_per_page=args.articles_per_page,
+        pushes=args.pushes,
+        large_pushes=args.large_pushes,
+        large_ratio=args.large_ratio,
+        slow_ratio=args.slow_ratio,
+        slow_seconds=args.slow_seconds,
+        fail_ratio=args.fail_ratio,
+        fail_status=args.fail_status,
+        growth=args.growth,
+        seed=args.seed,
+    )
+
+
+def main(argv=None):
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    uvicorn.run(create_app(config_from_args(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
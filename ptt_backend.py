@@ -1,26 +1,173 @@
 import asyncio
 import httpx
-from bs4 import BeautifulSoup
 import json
 import time
 import os
 import random
+import hmac
+import hashlib
+import re
+import logging
+import sys
+import multiprocessing
+import contextvars
+import math
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import create_engine, Column, Integer, Float, DateTime, desc, String, func
-from sqlalchemy.orm import sessionmaker, declarative_base
+from fastapi.responses import StreamingResponse, JSONResponse, Response
+from email.utils import format_datetime, parsedate_to_datetime
+from sqlalchemy import (Column, Integer, SmallInteger, Float, DateTime, ForeignKey, Index, desc, String, func, inspect,
+                        text, select, insert, delete, exists, literal_column)
+from sqlalchemy.orm import declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.exc import SQLAlchemyError
 from datetime import datetime, timedelta, timezone
 from pydantic import BaseModel
-from fastapi.concurrency import run_in_threadpool
-from playwright.async_api import async_playwright, Page, BrowserContext
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Optional
+from ptt_parser import PUSH_TAG, BOO_TAG, parse_article, parse_board_page, tally_pushes
+import ptt_export
+import ptt_codes
+from ptt_metrics import REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE, Counter, Gauge, Histogram
+
+try:
+    import fcntl
+except ImportError:
+    # Windows 沒有 fcntl：領導鎖的檔案鎖改用 msvcrt.locking
+    fcntl = None
+    import msvcrt
+
+if TYPE_CHECKING:
+    # Playwright 只在瀏覽器池第一次啟動時才匯入，API 程序冷啟動不必載入
+    from playwright.async_api import Page
+
+# --- Logging ---
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# text: 一般文字；json: 每行一個 JSON 物件，附上 extra 傳入的欄位 (url、engine、seconds...)
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text').lower()
+_LOG_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+class JsonLogFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in _LOG_RECORD_FIELDS})
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+logger = logging.getLogger("ptt_backend")
+
+def configure_logging(level=LOG_LEVEL, log_format=LOG_FORMAT):
+    handler = logging.StreamHandler()
+    if log_format == 'json':
+        handler.setFormatter(JsonLogFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    logger.handlers[:] = [handler]
+    logger.setLevel(level)
+    logger.propagate = False
+
+configure_logging()
+
+# --- Metrics (Prometheus 文字格式，由 /metrics 輸出) ---
+SCRAPE_CYCLE_SECONDS = Histogram("ptt_scrape_cycle_seconds", "一輪爬取 (所有看板，含備援) 的耗時", ["engine"])
+SCRAPE_CYCLES = Counter("ptt_scrape_cycles", "爬取輪數；outcome 為 ok、zero_ppi (沒有任何推噓) 或 failed", ["engine", "outcome"])
+ARTICLE_FETCH_SECONDS = Histogram("ptt_article_fetch_seconds", "單篇文章下載的耗時 (含速率限制等待)", ["engine"])
+ARTICLE_PARSE_SECONDS = Histogram("ptt_article_parse_seconds", "單篇文章推文解析的耗時", ["engine", "mode"])
+ARTICLES = Counter("ptt_articles", "文章爬取結果；failed 包含逾時與被取消的文章", ["engine", "result"])
+ARTICLES_ABANDONED = Counter("ptt_articles_abandoned", "因單篇逾時或整輪預算用盡而取消的文章", ["reason"])
+BROWSER_LAUNCH_SECONDS = Histogram("ptt_browser_launch_seconds", "Chromium 啟動 (含建立 context 與年齡確認) 的耗時")
+DB_QUERY_SECONDS = Histogram("ptt_db_query_seconds", "資料庫操作的耗時", ["operation"])
+REQUEST_SECONDS = Histogram("ptt_http_request_seconds", "API 請求到送出回應標頭為止的耗時", ["method", "route", "status"])
+CACHE_LOOKUPS = Counter("ptt_cache_lookups", "快取查詢結果", ["cache", "result"])
+SSE_SUBSCRIBERS = Gauge("ptt_sse_subscribers", "目前的 SSE 連線數")
+ARTICLE_CACHE_ENTRIES = Gauge("ptt_article_cache_entries", "文章狀態快取中的文章數")
+LEADER = Gauge("ptt_scraper_leader", "本程序是否持有爬蟲領導鎖 (1/0)")
+NEXT_SCRAPE_TIMESTAMP = Gauge("ptt_scrape_next_run_timestamp_seconds", "下一輪爬取的預定時間 (Unix 時間)")
+PARSE_STAGE_SECONDS = Histogram("ptt_parse_stage_seconds", "解析管線各階段的耗時：backpressure 為佇列已滿時的等待，"
+                                "queued 為排隊到被取出，execute 為送進執行池到取回結果 (含序列化)", ["stage"])
+PARSE_QUEUE_DEPTH = Gauge("ptt_parse_queue_depth", "等待解析的頁面數")
+EXPORT_ROWS = Counter("ptt_export_rows", "匯出端點送出的資料列數", ["dataset", "format"])
+CODES_ISSUED = Counter("ptt_discount_codes_issued", "簽發的結帳折扣碼數")
+CODE_VERIFICATIONS = Counter("ptt_discount_code_verifications", "折扣碼驗證結果；result 為 valid 或拒絕原因", ["result"])
+CODE_REPLAY_ENTRIES = Gauge("ptt_discount_code_replay_entries", "重複使用檢查中尚未到期的已使用碼數")
+SCRAPE_CONSECUTIVE_FAILURES = Gauge("ptt_scrape_consecutive_failures", "連續失敗的爬取輪數 (達門檻即斷路)")
+STARTUP_SECONDS = Gauge("ptt_startup_seconds", "程序啟動到各階段第一次完成的秒數", ["phase"])
+
+# --- 啟動時間軸 ---
+def process_age_seconds():
+    """程序從建立到現在的秒數 (Linux 由 /proc/self/stat 的 starttime 計算，包含 Python 啟動與匯入)；其他平台回傳 None"""
+    try:
+        with open("/proc/self/stat", encoding="ascii") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        started = int(fields[19]) / os.sysconf("SC_CLK_TCK")
+        return max(time.clock_gettime(time.CLOCK_BOOTTIME) - started, 0.0)
+    except (OSError, AttributeError, ValueError, IndexError):
+        return None
+
+class StartupTimeline:
+    """記錄各啟動階段第一次完成的時間 (從程序建立起算；無法取得時從匯入本模組起算)。
+
+    階段：import_done、warm_state_loaded、first_response、database_ready、first_fresh_discount、first_scrape_saved。
+    只記第一次，之後的呼叫只是一次字典查詢，可以放在請求路徑上。
+    """
+    def __init__(self):
+        age = process_age_seconds()
+        self.origin = "process" if age is not None else "import"
+        self._started = time.monotonic() - (age or 0.0)
+        self.phases = {}
+
+    def mark(self, phase):
+        if phase in self.phases:
+            return
+        seconds = time.monotonic() - self._started
+        self.phases[phase] = round(seconds, 3)
+        STARTUP_SECONDS.labels(phase).set(seconds)
+        logger.info(f"[啟動] {phase}: {seconds:.3f} 秒", extra={"phase": phase, "seconds": round(seconds, 3)})
+
+    def uptime(self):
+        return time.monotonic() - self._started
+
+    def stats(self):
+        return {"origin": self.origin, "phases": dict(self.phases)}
+
+startup_timeline = StartupTimeline()
 
 # --- Pydantic Models for Data Validation ---
 class SettingsUpdate(BaseModel):
     base_discount: float
     ppi_threshold: float
     conversion_factor: float
+    discount_cap: Optional[float] = None
+    secret_key: str
+
+class CodeVerification(BaseModel):
+    """code 驗證單一個碼，codes 批次驗證；consume=False 只檢查不登記使用 (例如結帳前預覽)"""
+    code: Optional[str] = None
+    codes: Optional[List[str]] = None
+    consume: bool = True
+
+class SimulationRequest(BaseModel):
+    """各欄位為候選值清單 (省略時使用目前設定)，模擬所有組合；series_settings 指定要回傳完整折扣序列的設定"""
     secret_key: str
+    base_discount: Optional[List[float]] = None
+    ppi_threshold: Optional[List[float]] = None
+    conversion_factor: Optional[List[float]] = None
+    discount_cap: Optional[List[float]] = None
+    timescale: str = "month"
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    histogram_bins: int = 20
+    series_settings: Optional[Dict[str, float]] = None
 
 # --- FastAPI App & CORS ---
 app = FastAPI()
@@ -31,266 +178,2741 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Last-Modified"],
 )
 
+class RequestMetricsMiddleware:
+    """以路由樣板 (不是實際路徑) 為標籤記錄請求耗時；SSE 等串流回應只計到開始串流為止"""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+
+        async def send_with_metrics(message):
+            if message["type"] == "http.response.start":
+                startup_timeline.mark("first_response")
+                route = scope.get("route")
+                REQUEST_SECONDS.labels(scope["method"], route.path if route is not None else "unmatched",
+                                       message["status"]).observe(time.perf_counter() - started)
+            await send(message)
+
+        await self.app(scope, receive, send_with_metrics)
+
+app.add_middleware(RequestMetricsMiddleware)
+
 # --- Database Setup ---
+# postgres://... 使用 asyncpg；本機測試可使用 sqlite:///./ptt_local.db (aiosqlite)
 DATABASE_URL = os.environ.get('DATABASE_URL')
 ADMIN_SECRET_KEY = os.environ.get('ADMIN_SECRET_KEY', 'default_secret_key')
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', '5'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))
+# Render 的 Postgres 需要 SSL；本機的 Postgres 可設為 disable
+DATABASE_SSL = os.environ.get('DATABASE_SSL', 'require')
+# 初始化失敗 (例如免費方案的資料庫仍在喚醒) 後的重試間隔上限 (秒)；間隔由 1 秒起倍增
+DB_INIT_RETRY_MAX_DELAY = float(os.environ.get('DB_INIT_RETRY_MAX_DELAY', '60'))
 engine = None
 SessionLocal = None
 Base = declarative_base()
 db_ready = False
+db_init_error = None  # 最近一次初始化失敗的原因，由 /healthz 回報
 
 class SentimentRecord(Base):
     __tablename__ = "sentiment_records"
     id = Column(Integer, primary_key=True, index=True)
-    timestamp = Column(DateTime(timezone=True), nullable=False)
+    timestamp = Column(DateTime(timezone=True), nullable=False, index=True)  # 歷史查詢、匯出與保留期限都依時間篩選
     ppi = Column(Float, index=True)
+    # 依推文時間計算的最近 5/15/60 分鐘 PPI；該時段沒有任何推噓時為 NULL
+    ppi_5m = Column(Float)
+    ppi_15m = Column(Float)
+    ppi_60m = Column(Float)
+    engine = Column(String)  # 本輪使用的爬蟲引擎: httpx / playwright
+
+# 只含有效 PPI 的部分索引：latest_record(valid_only=True) 以 id 倒序找最新一筆 ppi > 0 的紀錄時不必逐筆掃描
+Index("ix_sentiment_records_valid_id", SentimentRecord.id,
+      postgresql_where=SentimentRecord.ppi > 0, sqlite_where=SentimentRecord.ppi > 0)
+
+class Article(Base):
+    """文章維度表：看板、文章 ID 與標題每篇只存一次，觀測紀錄以整數 id 參照"""
+    __tablename__ = "articles"
+    id = Column(Integer, primary_key=True)
+    article_id = Column(String, nullable=False)  # M.1700000000.A.ABC
+    board = Column(String, nullable=False)
+    title = Column(String)
+    __table_args__ = (Index("ux_articles_article_board", "article_id", "board", unique=True),)
+
+# 觀測紀錄的 mode 欄位以代碼儲存 (索引即代碼)
+OBSERVATION_MODES = ("failed", "full", "incremental", "cached", "playwright")
+
+class ArticleObservation(Base):
+    """每輪爬取中每篇文章的推/噓/→ 數與抓取耗時，與該輪的 SentimentRecord 在同一個交易寫入。
+
+    為了讓每輪數百列不膨脹資料庫：主鍵直接用 (record_id, seq) 不另設流水號，文字欄位都放在 articles，
+    模式以 SmallInteger 代碼儲存。爬取失敗的文章計數為 NULL，SUM 自動略過，
+    因此 SentimentRecord.ppi 可由 observed_ppi_query() 的單一彙總查詢重算。
+    """
+    __tablename__ = "article_observations"
+    record_id = Column(Integer, ForeignKey("sentiment_records.id", ondelete="CASCADE"), primary_key=True)
+    seq = Column(SmallInteger, primary_key=True)
+    article_ref = Column(Integer, ForeignKey("articles.id"), nullable=False, index=True)
+    push = Column(Integer)
+    boo = Column(Integer)
+    neutral = Column(Integer)
+    fetch_ms = Column(Integer)
+    mode = Column(SmallInteger, nullable=False)
 
 class DiscountSetting(Base):
     __tablename__ = "discount_settings"
     setting_name = Column(String, primary_key=True, index=True)
     setting_value = Column(Float)
 
-def initialize_database():
-    """安全地初始化資料庫連線和表格 (這是一個同步函式)"""
-    global engine, SessionLocal, db_ready
+class SentimentRollup(Base):
+    """sentiment_records 依固定長度時間桶彙總的結果，每寫入一筆新紀錄就增量更新"""
+    __tablename__ = "sentiment_rollups"
+    bucket_seconds = Column(Integer, primary_key=True)
+    bucket_start = Column(Integer, primary_key=True)  # 時間桶起點 (UTC epoch 秒)
+    count = Column(Integer, nullable=False)
+    ppi_sum = Column(Float, nullable=False)
+    ppi_min = Column(Float, nullable=False)
+    ppi_max = Column(Float, nullable=False)
+
+def upgrade_schema(connection):
+    """create_all 不會替既有表格補欄位，這裡以 ALTER TABLE 補上新加入的 (可為空) 欄位 (以 run_sync 執行)"""
+    inspector = inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c['name'] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            logger.info(f"資料表 {table.name} 已補上欄位 {column.name}。")
+
+def ensure_indexes(connection):
+    """create_all 也不會替既有表格建立新加入的索引，這裡補上 (以 run_sync 執行)"""
+    inspector = inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(connection)
+                logger.info(f"資料表 {table.name} 已建立索引 {index.name}。")
+
+def async_database_url(url: str):
+    """轉換成 SQLAlchemy 非同步驅動的網址，並回傳對應的 create_async_engine 參數"""
+    if url.startswith("sqlite"):
+        url = url.replace("sqlite://", "sqlite+aiosqlite://", 1) if "+aiosqlite" not in url else url
+        return url, {"connect_args": {"timeout": DB_POOL_TIMEOUT}}
+    for prefix in ("postgres://", "postgresql://", "postgresql+psycopg2://"):
+        if url.startswith(prefix):
+            url = "postgresql+asyncpg://" + url[len(prefix):]
+            break
+    connect_args = {"ssl": DATABASE_SSL} if DATABASE_SSL != "disable" else {}
+    return url, {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_pre_ping": True,
+        "connect_args": connect_args,
+    }
+
+def insert_default_settings(dialect_name):
+    """以單一 INSERT ... ON CONFLICT DO NOTHING 補上缺少的預設設定，已存在的設定值不覆寫"""
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    rows = [{"setting_name": key, "setting_value": value} for key, value in DEFAULT_SETTINGS.items()]
+    return dialect_insert(DiscountSetting).values(rows).on_conflict_do_nothing(index_elements=["setting_name"])
+
+async def initialize_database(create_indexes=True):
+    """安全地初始化資料庫連線和表格；create_indexes=False 供維護報告先量測建立索引前的查詢計畫。
+
+    建表、補欄位、補索引與預設設定都在同一個交易 (一次連線) 內完成。
+    """
+    global engine, SessionLocal, db_ready, db_init_error
     if not DATABASE_URL:
-        print("[重大錯誤] 找不到環境變數 DATABASE_URL。")
+        logger.error("找不到環境變數 DATABASE_URL。")
+        db_init_error = "找不到環境變數 DATABASE_URL"
         return False
     
-    db_url_for_sqlalchemy = DATABASE_URL.replace("postgres://", "postgresql://", 1)
+    db_url_for_sqlalchemy, engine_options = async_database_url(DATABASE_URL)
     try:
-        engine = create_engine(db_url_for_sqlalchemy, pool_pre_ping=True, connect_args={"sslmode": "require"})
-        with engine.connect() as connection:
-            print("[成功] 資料庫連接成功！")
-        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-        Base.metadata.create_all(bind=engine)
-        print("資料庫表格檢查完畢。")
-
-        db = SessionLocal()
-        try:
-            default_settings = {
-                "base_discount": 5.0, 
-                "ppi_threshold": 70.0,
-                "conversion_factor": 0.5,
-                "discount_cap": 25.0
-            }
-            for key, value in default_settings.items():
-                if not db.query(DiscountSetting).filter(DiscountSetting.setting_name == key).first():
-                    db.add(DiscountSetting(setting_name=key, setting_value=value))
-            db.commit()
-            print("預設折扣設定已確認。")
-        finally:
-            db.close()
-        
+        engine = create_async_engine(db_url_for_sqlalchemy, **engine_options)
+        async with engine.begin() as connection:
+            logger.info("資料庫連接成功！")
+            await connection.run_sync(Base.metadata.create_all)
+            await connection.run_sync(upgrade_schema)
+            if create_indexes:
+                await connection.run_sync(ensure_indexes)
+            await connection.execute(insert_default_settings(connection.dialect.name))
+        SessionLocal = async_sessionmaker(engine, expire_on_commit=False, autoflush=False)
+        logger.info("資料庫表格與預設折扣設定檢查完畢。")
+
         db_ready = True
+        db_init_error = None
+        startup_timeline.mark("database_ready")
         return True
     except Exception as e:
-        print(f"[重大錯誤] 資料庫初始化失敗: {e}")
+        logger.error(f"資料庫初始化失敗: {e}")
         db_ready = False
+        db_init_error = str(e)
+        if engine is not None:
+            await engine.dispose()
+            engine = None
         return False
 
-# --- PTT Scraper using Playwright ---
-PTT_URL = "https://www.ptt.cc"
-GOSSIPING_BOARD_URL = f"{PTT_URL}/bbs/Gossiping/index.html"
+async def initialize_database_with_retry():
+    """失敗時以倍增、上限 DB_INIT_RETRY_MAX_DELAY 秒的間隔重試直到成功；沒有設定 DATABASE_URL 時不重試"""
+    delay = 1.0
+    attempts = 1
+    while not await initialize_database():
+        if not DATABASE_URL:
+            return False
+        logger.warning(f"{delay:g} 秒後重試資料庫初始化 (已失敗 {attempts} 次)。")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, DB_INIT_RETRY_MAX_DELAY)
+        attempts += 1
+    return True
+
+@asynccontextmanager
+async def db_session(operation: str):
+    """開啟 AsyncSession，並將整段資料庫操作的耗時依 operation 記錄到 ptt_db_query_seconds"""
+    with DB_QUERY_SECONDS.labels(operation).time():
+        async with SessionLocal() as db:
+            yield db
+
+async def load_settings(db):
+    result = await db.execute(select(DiscountSetting))
+    return {s.setting_name: s.setting_value for s in result.scalars()}
+
+def latest_record_query(valid_only=False):
+    query = select(SentimentRecord)
+    if valid_only:
+        # 0 直接寫在 SQL 中 (不綁定參數)，查詢規劃器才能確認條件符合 ix_sentiment_records_valid_id 部分索引
+        query = query.where(SentimentRecord.ppi > literal_column("0"))
+    return query.order_by(SentimentRecord.id.desc()).limit(1)
+
+async def latest_record(db, valid_only=False):
+    result = await db.execute(latest_record_query(valid_only))
+    return result.scalars().first()
+
+def observed_ppi_query():
+    """由逐篇觀測重算每筆紀錄的 PPI (與 compute_ppi 相同：失敗的文章不計入，沒有推噓時為 0)"""
+    votes = func.sum(ArticleObservation.push + ArticleObservation.boo)
+    ppi = func.coalesce(100.0 * func.sum(ArticleObservation.push) / func.nullif(votes, 0), 0.0)
+    return select(ArticleObservation.record_id, ppi.label("ppi")).group_by(ArticleObservation.record_id)
+
+async def save_observations(db, record_id: int, observations):
+    """在寫入 SentimentRecord 的同一個交易中，以一次批次 INSERT 寫入本輪的逐篇觀測。
+
+    只有持有領導鎖的程序會寫入，文章維度表不會有並行插入：先查出已存在的文章，缺少的再批次新增。
+    """
+    if not observations:
+        return
+    titles = {(board, article_id): title for board, article_id, title, _ in observations}
+    article_ids = sorted({article_id for _, article_id in titles})
+    lookup = select(Article.id, Article.board, Article.article_id).where(Article.article_id.in_(article_ids))
+    refs = {(board, article_id): ref for ref, board, article_id in await db.execute(lookup)}
+    missing = [{"board": board, "article_id": article_id, "title": title}
+               for (board, article_id), title in titles.items() if (board, article_id) not in refs]
+    if missing:
+        await db.execute(insert(Article), missing)
+        refs.update({(board, article_id): ref for ref, board, article_id in await db.execute(lookup)})
+
+    rows = []
+    for seq, (board, article_id, _, result) in enumerate(observations):
+        row = {"record_id": record_id, "seq": seq, "article_ref": refs[(board, article_id)],
+               "push": None, "boo": None, "neutral": None, "fetch_ms": None, "mode": 0}
+        if result is not None:
+            row.update(push=result.push, boo=result.boo, neutral=result.neutral,
+                       fetch_ms=round(result.fetch_seconds * 1000), mode=OBSERVATION_MODES.index(result.mode))
+        rows.append(row)
+    await db.execute(insert(ArticleObservation), rows)
+
+# --- 折扣計算與記憶體快照 ---
+DEFAULT_SETTINGS = {
+    "base_discount": 5.0,
+    "ppi_threshold": 70.0,
+    "conversion_factor": 0.5,
+    "discount_cap": 25.0
+}
+# 各項設定的允許範圍 (含端點)；base_discount 與 discount_cap 為百分比
+SETTING_BOUNDS = {
+    "base_discount": (0.0, 100.0),
+    "ppi_threshold": (0.0, 100.0),
+    "conversion_factor": (0.0, 100.0),
+    "discount_cap": (0.0, 100.0),
+}
+# 快照的最長存活時間 (秒)；寫入路徑會即時更新快照，這只是其他程序寫入資料庫時的保險
+DISCOUNT_CACHE_TTL = float(os.environ.get('DISCOUNT_CACHE_TTL', '300'))
+# 目標新鮮度：正常情況下爬蟲寫入新紀錄的間隔 (秒)，也是回應 Cache-Control max-age 的上限
+SCRAPE_INTERVAL_SECONDS = float(os.environ.get('SCRAPE_INTERVAL_SECONDS', '180'))
+# 最後一份折扣狀態的本機檔案；重啟後在資料庫就緒前先以它回應 (標示 stale)。設為空字串停用
+# 預設放在系統暫存目錄，不寫進工作目錄 (通常是程式碼所在處)
+WARM_STATE_PATH = os.environ.get('WARM_STATE_PATH', os.path.join(tempfile.gettempdir(), 'ptt_warm_state.json'))
+
+def settings_version(settings):
+    """設定內容的短雜湊，各程序對同一份設定會得到相同的值"""
+    canonical = json.dumps(sorted(settings.items()), separators=(',', ':'))
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()[:10]
+
+def calculate_discount(ppi, settings):
+    base_discount = settings.get("base_discount", DEFAULT_SETTINGS["base_discount"])
+    ppi_threshold = settings.get("ppi_threshold", DEFAULT_SETTINGS["ppi_threshold"])
+    conversion_factor = settings.get("conversion_factor", DEFAULT_SETTINGS["conversion_factor"])
+    discount_cap = settings.get("discount_cap", DEFAULT_SETTINGS["discount_cap"])
+
+    extra_discount = 0
+    if ppi < ppi_threshold:
+        extra_discount = (ppi_threshold - ppi) * conversion_factor
+
+    final_discount = base_discount + extra_discount
+    return min(final_discount, discount_cap)
+
+class DiscountSnapshot:
+    """折扣設定與最新有效 PPI 的記憶體快照，讓 /api/current-discount 不必每次查詢資料庫。
+
+    爬蟲存入新紀錄與更新設定時直接寫入快照 (write-through)；快照不存在或超過 ttl 時才從資料庫載入，
+    同時間多個請求未命中只會有一個實際查詢，其餘等待同一份結果。
+    快照本身是整份替換的 dict，讀取端不需要加鎖。
+    內容變化時另存到 warm_state_path，重啟時由 restore() 載入成 warm_state (stale)，只在資料庫就緒前使用。
+    """
+    def __init__(self, ttl=DISCOUNT_CACHE_TTL, warm_state_path=WARM_STATE_PATH):
+        self.ttl = ttl
+        self.warm_state_path = warm_state_path
+        self.warm_state = None
+        self._state = None
+        self._loaded_at = 0.0
+        self._version = 0
+        self._load_lock = asyncio.Lock()
+        self.hits = 0
+        self.loads = 0
+
+    def _fresh(self):
+        return self._state is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    async def get(self):
+        if self._fresh():
+            self.hits += 1
+            CACHE_LOOKUPS.labels("discount_snapshot", "hit").inc()
+            return self._state
+        CACHE_LOOKUPS.labels("discount_snapshot", "miss").inc()
+        async with self._load_lock:
+            if not self._fresh():
+                await self._load()
+        return self._state
+
+    async def _load(self):
+        version = self._version
+        async with db_session("snapshot_load") as db:
+            settings = await load_settings(db)
+            newest = await latest_record(db)
+            valid_record = newest
+            if newest is not None and newest.ppi == 0.0:
+                # 最新 PPI 為 0 時回溯最後一筆有效 PPI
+                valid_record = await latest_record(db, valid_only=True)
+        self.loads += 1
+        if version != self._version:
+            # 載入期間已有 write-through 寫入更新的資料，以寫入的為準
+            return
+        self._install(
+            settings=settings,
+            latest_record_id=newest.id if newest else None,
+            latest_record_at=newest.timestamp if newest else None,
+            ppi=valid_record.ppi if valid_record else 0.0,
+            ppi_record_id=valid_record.id if valid_record else None,
+        )
+
+    def _install(self, **state):
+        state["settings_version"] = settings_version(state["settings"])
+        previous = self._state
+        if previous is not None and all(previous[k] == state[k] for k in ("latest_record_id", "ppi_record_id", "settings_version")):
+            # 資料沒有變化 (例如 ttl 到期重新載入)，沿用原本的時間，讓相同的 ETag 對應完全相同的內容
+            state["as_of"] = previous["as_of"]
+        else:
+            state["as_of"] = datetime.now(timezone.utc)
+        self._state = state
+        self._loaded_at = time.monotonic()
+        self._version += 1
+        remember_discount(state)
+        startup_timeline.mark("first_fresh_discount")
+        if previous is None or state["as_of"] != previous["as_of"]:
+            self._save_warm_state(state)
+
+    def _save_warm_state(self, state):
+        """整份寫入暫存檔再 os.replace，讀取端不會讀到寫了一半的檔案；檔案只有數百位元組"""
+        if not self.warm_state_path:
+            return
+        tmp_path = f"{self.warm_state_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f, default=lambda value: value.isoformat())
+            os.replace(tmp_path, self.warm_state_path)
+        except Exception as e:
+            logger.warning(f"儲存折扣暖啟動狀態失敗: {e}")
+
+    def restore(self):
+        """載入上次保存的狀態作為 warm_state；檔案不存在或格式不符時略過"""
+        if not self.warm_state_path or not os.path.exists(self.warm_state_path):
+            return None
+        try:
+            with open(self.warm_state_path, encoding='utf-8') as f:
+                state = json.load(f)
+            for key in ("latest_record_at", "as_of"):
+                if state[key] is not None:
+                    state[key] = datetime.fromisoformat(state[key])
+            state["settings_version"] = settings_version(state["settings"])
+            float(state["ppi"])
+        except Exception as e:
+            logger.warning(f"載入折扣暖啟動狀態失敗，將等待資料庫: {e}")
+            return None
+        state["stale"] = True
+        self.warm_state = state
+        remember_discount(state)
+        startup_timeline.mark("warm_state_loaded")
+        logger.info(f"已載入上次保存的折扣狀態 (紀錄 {state['latest_record_id']}，{state['as_of'].isoformat()})。")
+        return state
+
+    def peek(self):
+        """不查詢資料庫：目前的快照，沒有時為暖啟動狀態 (可能為 None)"""
+        return self._state if self._state is not None else self.warm_state
+
+    def record_saved(self, record_id, ppi, timestamp):
+        """爬蟲存入新紀錄後呼叫；PPI 為 0 時沿用上一筆有效 PPI (與回溯邏輯一致)"""
+        state = self._state
+        if state is None:
+            return
+        new_state = dict(state, latest_record_id=record_id, latest_record_at=timestamp)
+        if ppi > 0:
+            new_state.update(ppi=ppi, ppi_record_id=record_id)
+        self._install(**new_state)
+
+    def settings_changed(self, settings):
+        state = self._state
+        if state is None:
+            return
+        new_state = dict(state, settings=dict(settings))
+        self._install(**new_state)
+
+    async def refresh(self):
+        """不論 ttl 立即重新載入 (其他程序寫入資料庫時使用)"""
+        async with self._load_lock:
+            await self._load()
+        return self._state
+
+    def status(self):
+        if self._state is not None:
+            return "fresh"
+        return "stale" if self.warm_state is not None else "empty"
+
+    def stats(self):
+        return {"hits": self.hits, "loads": self.loads, "ttl_seconds": self.ttl, "status": self.status()}
+
+discount_snapshot = DiscountSnapshot()
+
+def build_discount_payload(state):
+    settings = state["settings"]
+    ppi = state["ppi"]
+    return {
+        "current_ppi": round(ppi, 2),
+        "final_discount_percentage": round(calculate_discount(ppi, settings), 2),
+        "settings": settings,
+        "record_id": state["latest_record_id"],
+        "timestamp": to_utc(state["latest_record_at"]).isoformat() if state["latest_record_at"] else None,
+        "as_of": state["as_of"].isoformat(),
+        "stale": state.get("stale", False),
+        "max_staleness_seconds": discount_snapshot.ttl,
+        "next_scrape_at": scrape_scheduler.next_run_at.isoformat() if scrape_scheduler.next_run_at else None,
+    }
+
+# --- 簽章折扣碼 ---
+# 簽章金鑰由 CODE_SIGNING_KEY (未設定時為 ADMIN_SECRET_KEY) 衍生，所有 API 副本共用才能互相驗證
+CODE_SIGNING_KEY = os.environ.get('CODE_SIGNING_KEY') or ADMIN_SECRET_KEY
+CODE_TTL_SECONDS = int(os.environ.get('CODE_TTL_SECONDS', '60'))
+# 最近幾筆有效 PPI 紀錄的折扣可以兌換；以預設爬取間隔約為最近 3 小時
+CODE_RING_SIZE = int(os.environ.get('CODE_RING_SIZE', '64'))
+# 尚未到期的已使用碼上限 (每筆約 200 位元組)；用盡時拒絕兌換而不是淘汰
+CODE_REPLAY_CACHE_SIZE = int(os.environ.get('CODE_REPLAY_CACHE_SIZE', '500000'))
+CODE_VERIFY_BATCH_MAX = int(os.environ.get('CODE_VERIFY_BATCH_MAX', '1000'))
+
+code_signing_key = ptt_codes.derive_key(CODE_SIGNING_KEY)
+recent_discounts = ptt_codes.RecentDiscounts(CODE_RING_SIZE)
+code_verifier = ptt_codes.CodeVerifier(code_signing_key, CODE_TTL_SECONDS, recent_discounts,
+                                       ptt_codes.ReplayCache(CODE_REPLAY_CACHE_SIZE))
+
+def remember_discount(state):
+    """快照每次更新 (新紀錄或設定變更) 時記下該筆紀錄當下的折扣，驗證折扣碼時不必查詢資料庫"""
+    if state["ppi_record_id"] is not None:
+        recent_discounts.observe(state["ppi_record_id"], state["ppi"], calculate_discount(state["ppi"], state["settings"]))
+
+# --- 條件式請求 (ETag / Last-Modified / 304) ---
+def discount_etag(state, prefix="", include_schedule=False):
+    """include_schedule：內容含 as_of 與 next_scrape_at (/api/current-discount) 時一併納入，
+    爬取失敗只改變下一輪時間、或各程序的 as_of 不同時，相同的 ETag 仍對應完全相同的內容"""
+    tag = f'{prefix}{state["latest_record_id"] or 0}-{state["settings_version"]}'
+    if include_schedule:
+        next_run_at = scrape_scheduler.next_run_at
+        tag += f'-{int(state["as_of"].timestamp() * 1e6):x}-{int(next_run_at.timestamp() * 1e6) if next_run_at else 0:x}'
+    return f'"{tag}"'
+
+def seconds_until_next_scrape(state):
+    """距離下一筆紀錄預計寫入的秒數，作為 Cache-Control 的 max-age"""
+    if scrape_scheduler.next_run_at is not None:
+        # 本程序就是爬蟲：直接使用排程器決定的下一輪時間
+        remaining = (scrape_scheduler.next_run_at - datetime.now(timezone.utc)).total_seconds()
+        return int(min(max(remaining, 0), SCRAPE_INTERVAL_SECONDS))
+    latest_record_at = state["latest_record_at"]
+    if latest_record_at is None:
+        return 0
+    if latest_record_at.tzinfo is None:
+        latest_record_at = latest_record_at.replace(tzinfo=timezone.utc)
+    elapsed = (datetime.now(timezone.utc) - latest_record_at).total_seconds()
+    return int(min(max(SCRAPE_INTERVAL_SECONDS - elapsed, 0), SCRAPE_INTERVAL_SECONDS))
+
+def is_not_modified(request: Request, etag: str, last_modified: datetime):
+    """If-None-Match 優先 (弱比較)；沒有時才看 If-Modified-Since (精確到秒)"""
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        candidates = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+        return '*' in candidates or etag in candidates
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+async def conditional_json(request: Request, build_body, etag: str, last_modified: datetime, max_age: int):
+    """驗證標頭相符時回傳 304 (不產生內容)，否則以 await build_body() 回傳 JSON"""
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={max_age}"}
+    if last_modified is not None:
+        if last_modified.tzinfo is None:
+            last_modified = last_modified.replace(tzinfo=timezone.utc)
+        last_modified = last_modified.astimezone(timezone.utc)
+        headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+    if is_not_modified(request, etag, last_modified):
+        CACHE_LOOKUPS.labels("client_etag", "hit").inc()
+        return Response(status_code=304, headers=headers)
+    CACHE_LOOKUPS.labels("client_etag", "miss").inc()
+    return JSONResponse(await build_body(), headers=headers)
+
+# --- 即時推播 (Server-Sent Events) ---
+SSE_BUFFER_SIZE = int(os.environ.get('SSE_BUFFER_SIZE', '100'))
+SSE_KEEPALIVE_SECONDS = 15
+SSE_SUBSCRIBER_QUEUE_SIZE = 32
+
+class DiscountBroadcaster:
+    """新的折扣資料只序列化一次，再推送給所有 SSE 訂閱者。
+
+    事件 id 以毫秒時間遞增 (重啟後仍大於舊的 id)，並保留最近 SSE_BUFFER_SIZE 筆事件，
+    斷線重連的客戶端帶著 Last-Event-ID 回來時補送錯過的事件。跟不上的訂閱者會被中斷，讓它重新連線。
+    """
+    def __init__(self, buffer_size=SSE_BUFFER_SIZE):
+        self._events = deque(maxlen=buffer_size)
+        self._subscribers = set()
+        self._last_id = 0
+        self.published = 0
+        self.dropped_subscribers = 0
+
+    @staticmethod
+    def format_event(event_id, payload):
+        return f"id: {event_id}\nevent: discount\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n".encode('utf-8')
+
+    def publish(self, payload):
+        event_id = max(int(time.time() * 1000), self._last_id + 1)
+        self._last_id = event_id
+        message = self.format_event(event_id, payload)
+        self._events.append((event_id, message))
+        self.published += 1
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self._drop(queue)
+
+    def _drop(self, queue):
+        self._subscribers.discard(queue)
+        self.dropped_subscribers += 1
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+    @property
+    def last_event_id(self):
+        return self._last_id
+
+    def subscribe(self, last_event_id=None):
+        """回傳 (佇列, 錯過的事件)；last_event_id 不在緩衝區內時，錯過的事件為空，由呼叫端補送目前狀態"""
+        queue = asyncio.Queue(maxsize=SSE_SUBSCRIBER_QUEUE_SIZE)
+        missed = []
+        if last_event_id is not None:
+            missed = [message for event_id, message in self._events if event_id > last_event_id]
+        self._subscribers.add(queue)
+        return queue, missed
+
+    def unsubscribe(self, queue):
+        self._subscribers.discard(queue)
+
+    def stats(self):
+        return {
+            "subscribers": len(self._subscribers),
+            "published": self.published,
+            "buffered_events": len(self._events),
+            "dropped_subscribers": self.dropped_subscribers,
+            "last_event_id": self._last_id,
+        }
+
+discount_broadcaster = DiscountBroadcaster()
+
+# --- 歷史數據彙總 (時間桶) ---
+# 各層時間桶長度 (秒)；查詢時選擇點數不超過上限的最細層級
+ROLLUP_LEVELS = (300, 900, 3600, 21600, 86400)
+# 細層級時間桶的保留天數 (未列出的層級永久保留)；更舊的區間改由較粗的層級回答
+ROLLUP_RETENTION_DAYS = {300: 90, 900: 365}
+HISTORY_WINDOWS = {
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+    "week": timedelta(weeks=1),
+    "month": timedelta(days=30),
+}
+HISTORY_MAX_POINTS = int(os.environ.get('HISTORY_MAX_POINTS', '500'))
+# 相對於現在的視窗 (realtime 與未指定區間的 hour/day/...) 的結尾對齊到這個秒數，同一段時間內的回應內容與 ETag 相同
+HISTORY_WINDOW_STEP = 60
+
+def to_utc(timestamp: Optional[datetime]):
+    """SQLite 讀回的時間與查詢參數可能沒有時區資訊，一律視為 UTC；None 原樣傳回"""
+    if timestamp is None:
+        return None
+    if timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.astimezone(timezone.utc)
+
+def to_epoch(timestamp: datetime):
+    return int(to_utc(timestamp).timestamp())
+
+async def update_rollups(db, timestamp: datetime, ppi: float):
+    """在與新紀錄相同的交易中更新各層時間桶；PPI 為 0 (爬取失敗) 的紀錄不納入彙總"""
+    if ppi is None or ppi <= 0:
+        return
+    epoch = to_epoch(timestamp)
+    for level in ROLLUP_LEVELS:
+        bucket_start = epoch - epoch % level
+        rollup = await db.get(SentimentRollup, (level, bucket_start))
+        if rollup is None:
+            db.add(SentimentRollup(bucket_seconds=level, bucket_start=bucket_start, count=1,
+                                   ppi_sum=ppi, ppi_min=ppi, ppi_max=ppi))
+        else:
+            rollup.count += 1
+            rollup.ppi_sum += ppi
+            rollup.ppi_min = min(rollup.ppi_min, ppi)
+            rollup.ppi_max = max(rollup.ppi_max, ppi)
+
+async def backfill_rollups():
+    """第一次部署時由既有的原始紀錄一次建立所有時間桶 (之後都由 update_rollups 增量維護)"""
+    async with db_session("rollup_backfill") as db:
+        has_rollups = (await db.execute(select(SentimentRollup.bucket_seconds).limit(1))).first() is not None
+        if has_rollups or await latest_record(db) is None:
+            return
+        logger.info("[彙總] 正在由既有紀錄建立歷史時間桶...")
+        buckets = {}
+        rows = await db.stream(
+            select(SentimentRecord.timestamp, SentimentRecord.ppi).where(SentimentRecord.ppi > 0).execution_options(yield_per=10000))
+        async for timestamp, ppi in rows:
+            epoch = to_epoch(timestamp)
+            for level in ROLLUP_LEVELS:
+                key = (level, epoch - epoch % level)
+                bucket = buckets.get(key)
+                if bucket is None:
+                    buckets[key] = [1, ppi, ppi, ppi]
+                else:
+                    bucket[0] += 1
+                    bucket[1] += ppi
+                    bucket[2] = min(bucket[2], ppi)
+                    bucket[3] = max(bucket[3], ppi)
+        db.add_all([
+            SentimentRollup(bucket_seconds=level, bucket_start=start, count=count, ppi_sum=total, ppi_min=low, ppi_max=high)
+            for (level, start), (count, total, low, high) in buckets.items()
+        ])
+        await db.commit()
+        logger.info(f"[彙總] 已建立 {len(buckets)} 個時間桶。")
+
+def rollup_retained_since(level: int, now: float = None):
+    """該層級時間桶最早保留到的 epoch 秒；永久保留時為 None"""
+    days = ROLLUP_RETENTION_DAYS.get(level)
+    if days is None:
+        return None
+    return (now if now is not None else time.time()) - days * 86400
+
+def choose_rollup_level(span_seconds: float, max_points: int, start_epoch: float = None):
+    """點數不超過上限的最細層級；區間起點早於該層級的保留期限時 (已被壓縮清除) 改用較粗的層級"""
+    for level in ROLLUP_LEVELS:
+        retained_since = rollup_retained_since(level)
+        if start_epoch is not None and retained_since is not None and start_epoch < retained_since:
+            continue
+        if span_seconds / level <= max_points:
+            return level
+    return ROLLUP_LEVELS[-1]
+
+async def query_rollup_history(db, start: datetime, end: datetime, max_points: int):
+    """以時間桶回答任意區間，回傳點數不超過 max_points"""
+    start_epoch, end_epoch = to_epoch(start), to_epoch(end)
+    level = choose_rollup_level(end_epoch - start_epoch, max_points, start_epoch)
+    result = await db.execute(select(
+        SentimentRollup.bucket_start, SentimentRollup.count, SentimentRollup.ppi_sum,
+        SentimentRollup.ppi_min, SentimentRollup.ppi_max,
+    ).where(
+        SentimentRollup.bucket_seconds == level,
+        SentimentRollup.bucket_start >= start_epoch - start_epoch % level,
+        SentimentRollup.bucket_start < end_epoch,
+    ).order_by(SentimentRollup.bucket_start.asc()))
+    buckets = [tuple(row) for row in result]
+
+    # 最粗的層級仍超過上限時 (例如數年的區間)，再把相鄰的時間桶合併
+    width = level
+    while len(buckets) > max_points:
+        width *= 2
+        merged = {}
+        for bucket_start, count, total, low, high in buckets:
+            key = bucket_start - bucket_start % width
+            current = merged.get(key)
+            if current is None:
+                merged[key] = [key, count, total, low, high]
+            else:
+                current[1] += count
+                current[2] += total
+                current[3] = min(current[3], low)
+                current[4] = max(current[4], high)
+        buckets = [tuple(v) for v in merged.values()]
+
+    return [{
+        "timestamp": datetime.fromtimestamp(bucket_start, tz=timezone.utc).isoformat(),
+        "ppi": total / count,
+        "min": low,
+        "max": high,
+        "count": count,
+        "bucket_seconds": width,
+    } for bucket_start, count, total, low, high in buckets]
+
+# --- 資料保留與壓縮 ---
+# 原始紀錄保留天數，預設 0 (永久保留，不刪除任何原始紀錄)。設定後更舊的資料只留在 sentiment_rollups 的時間桶
+# (降採樣後的彙總列)；設定模擬 (/api/simulate-settings)、原始紀錄匯出與逐篇觀測都只讀原始資料，須自行確認可以捨棄
+RAW_RETENTION_DAYS = float(os.environ.get('RAW_RETENTION_DAYS', '0'))
+COMPACTION_INTERVAL_SECONDS = float(os.environ.get('COMPACTION_INTERVAL_SECONDS', '21600'))
+COMPACTION_BATCH_SIZE = int(os.environ.get('COMPACTION_BATCH_SIZE', '5000'))
+
+class RecordCompactor:
+    """刪除超過保留期限的原始紀錄與細層級時間桶。
+
+    時間桶在寫入每筆紀錄的同一個交易中更新 (update_rollups)，刪除原始紀錄不會遺失彙總；
+    紀錄的逐篇觀測一併刪除，不再被參照的文章也會清除。
+    原始紀錄依 id 分批刪除並逐批提交，不會長時間鎖住表格；最新一筆有效紀錄永遠保留，
+    讓 /api/current-discount 在爬蟲長時間停擺後仍能回溯。
+    """
+    def __init__(self, batch_size=COMPACTION_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.runs = 0
+        self.records_deleted = 0
+        self.rollups_deleted = 0
+        self.last_run_at = None
+        self.last_result = None
+
+    async def run(self, now: datetime = None):
+        now = now or datetime.now(timezone.utc)
+        started = time.perf_counter()
+        records = await self._delete_records(now) if RAW_RETENTION_DAYS > 0 else 0
+        rollups = await self._delete_rollups(now.timestamp())
+        self.runs += 1
+        self.records_deleted += records
+        self.rollups_deleted += rollups
+        self.last_run_at = now
+        self.last_result = {"records_deleted": records, "rollups_deleted": rollups,
+                            "seconds": round(time.perf_counter() - started, 3)}
+        if records or rollups:
+            logger.info(f"[壓縮] 已刪除 {records} 筆過期原始紀錄與 {rollups} 個細層級時間桶。", extra=self.last_result)
+        return self.last_result
+
+    async def _delete_records(self, now: datetime):
+        cutoff = now - timedelta(days=RAW_RETENTION_DAYS)
+        deleted = 0
+        async with db_session("compaction") as db:
+            keep = await latest_record(db, valid_only=True)
+            while True:
+                query = select(SentimentRecord.id).where(SentimentRecord.timestamp < cutoff)
+                if keep is not None:
+                    query = query.where(SentimentRecord.id != keep.id)
+                ids = (await db.execute(query.order_by(SentimentRecord.id.asc()).limit(self.batch_size))).scalars().all()
+                if not ids:
+                    break
+                await db.execute(delete(ArticleObservation).where(ArticleObservation.record_id.in_(ids)))
+                await db.execute(delete(SentimentRecord).where(SentimentRecord.id.in_(ids)))
+                await db.commit()
+                deleted += len(ids)
+                await asyncio.sleep(0)
+            if deleted:
+                # 不再被任何觀測參照的文章
+                await db.execute(delete(Article).where(~exists().where(ArticleObservation.article_ref == Article.id)))
+                await db.commit()
+        return deleted
+
+    async def _delete_rollups(self, now: float):
+        deleted = 0
+        async with db_session("compaction") as db:
+            for level in ROLLUP_RETENTION_DAYS:
+                result = await db.execute(delete(SentimentRollup).where(
+                    SentimentRollup.bucket_seconds == level,
+                    SentimentRollup.bucket_start < rollup_retained_since(level, now) - level))
+                deleted += result.rowcount or 0
+            await db.commit()
+        return deleted
+
+    def stats(self):
+        return {
+            "raw_retention_days": RAW_RETENTION_DAYS or None,
+            "rollup_retention_days": ROLLUP_RETENTION_DAYS,
+            "runs": self.runs,
+            "records_deleted": self.records_deleted,
+            "rollups_deleted": self.rollups_deleted,
+            "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+            "last_result": self.last_result,
+        }
+
+record_compactor = RecordCompactor()
+
+def maintenance_queries(now: datetime):
+    """維護報告中比對執行計畫的查詢，條件與各端點實際送出的查詢相同"""
+    day_ago = to_epoch(now - timedelta(days=1))
+    return {
+        "history_realtime": (select(SentimentRecord.timestamp, SentimentRecord.ppi)
+                             .where(SentimentRecord.timestamp >= now - timedelta(hours=1))
+                             .order_by(SentimentRecord.timestamp.asc(), SentimentRecord.id.asc())),
+        "latest_valid_record": latest_record_query(valid_only=True),
+        "export_day": export_query("records", now - timedelta(days=1), now, ROLLUP_LEVELS[0])[1],
+        "history_day_rollups": (select(SentimentRollup.bucket_start, SentimentRollup.count, SentimentRollup.ppi_sum)
+                                .where(SentimentRollup.bucket_seconds == ROLLUP_LEVELS[0],
+                                       SentimentRollup.bucket_start >= day_ago - day_ago % ROLLUP_LEVELS[0])
+                                .order_by(SentimentRollup.bucket_start.asc())),
+        "compaction_batch": (select(SentimentRecord.id)
+                             .where(SentimentRecord.timestamp < now - timedelta(days=RAW_RETENTION_DAYS or 30))
+                             .order_by(SentimentRecord.id.asc()).limit(COMPACTION_BATCH_SIZE)),
+    }
+
+async def explain(connection, query):
+    compiled = query.compile(dialect=connection.dialect)
+    prefix = "EXPLAIN QUERY PLAN " if connection.dialect.name == "sqlite" else "EXPLAIN "
+    params = tuple(compiled.params[name] for name in compiled.positiontup or ())
+    result = await connection.exec_driver_sql(prefix + str(compiled), params)
+    # SQLite 回傳 (id, parent, notused, detail)，PostgreSQL 每列一行文字
+    return [row[-1] for row in result]
+
+async def table_sizes(connection):
+    sizes = {}
+    for table in Base.metadata.sorted_tables:
+        rows = (await connection.execute(select(func.count()).select_from(table))).scalar()
+        if connection.dialect.name == "postgresql":
+            total, indexes = (await connection.execute(text(
+                "SELECT pg_total_relation_size(:name), pg_indexes_size(:name)"), {"name": table.name})).one()
+            sizes[table.name] = {"rows": rows, "total_bytes": total, "index_bytes": indexes}
+        else:
+            sizes[table.name] = {"rows": rows}
+    if connection.dialect.name == "sqlite":
+        page_size = (await connection.exec_driver_sql("PRAGMA page_size")).scalar()
+        page_count = (await connection.exec_driver_sql("PRAGMA page_count")).scalar()
+        free_pages = (await connection.exec_driver_sql("PRAGMA freelist_count")).scalar()
+        sizes["database_bytes"] = page_size * page_count
+        sizes["free_bytes"] = page_size * free_pages
+    return sizes
+
+async def maintenance_report():
+    """資料表大小、索引與主要查詢的執行計畫"""
+    async with engine.connect() as connection:
+        indexes = await connection.run_sync(lambda sync: {
+            table.name: sorted(index["name"] for index in inspect(sync).get_indexes(table.name))
+            for table in Base.metadata.sorted_tables})
+        observed = observed_ppi_query().subquery()
+        mismatched = (await connection.execute(select(func.count()).select_from(observed).join(
+            SentimentRecord, SentimentRecord.id == observed.c.record_id).where(
+            func.abs(SentimentRecord.ppi - observed.c.ppi) > 1e-6))).scalar()
+        return {
+            "tables": await table_sizes(connection),
+            "indexes": indexes,
+            # 有逐篇觀測、但儲存的 PPI 與觀測重算結果不一致的紀錄數 (正常應為 0)
+            "observed_ppi_mismatches": mismatched,
+            "plans": {name: await explain(connection, query)
+                      for name, query in maintenance_queries(datetime.now(timezone.utc)).items()},
+        }
+
+async def vacuum_analyze():
+    """刪除大量紀錄後回收空間並更新統計資訊；VACUUM 不能在交易中執行"""
+    async with engine.connect() as connection:
+        await connection.execution_options(isolation_level="AUTOCOMMIT")
+        if connection.dialect.name == "postgresql":
+            for table in Base.metadata.sorted_tables:
+                await connection.exec_driver_sql(f"VACUUM (ANALYZE) {table.name}")
+        else:
+            await connection.exec_driver_sql("VACUUM")
+            await connection.exec_driver_sql("ANALYZE")
+
+async def run_maintenance(report_only=False):
+    """python -m ptt_cli maintenance [--report-only]：建立缺少的索引、壓縮過期資料，輸出前後對照報告"""
+    if not await initialize_database(create_indexes=False):
+        return 1
+    try:
+        report = {"before": await maintenance_report()}
+        if not report_only:
+            async with engine.begin() as connection:
+                await connection.run_sync(ensure_indexes)
+            report["compaction"] = await record_compactor.run()
+            await vacuum_analyze()
+            report["after"] = await maintenance_report()
+    finally:
+        await engine.dispose()
+    print(json.dumps(report, ensure_ascii=False, indent=2, default=str))
+    return 0
+
+async def compact_periodically():
+    """只在持有領導鎖的程序執行 (與爬蟲相同)，避免多個副本同時刪除"""
+    while True:
+        await asyncio.sleep(COMPACTION_INTERVAL_SECONDS)
+        if not leader_lock.held:
+            continue
+        try:
+            await record_compactor.run()
+        except Exception as e:
+            logger.exception(f"[壓縮] 清除過期資料失敗: {e}")
+
+# --- PTT Scraper (httpx 輕量引擎為主，Playwright 為備援) ---
+# 基準測試時可指向本機的 PTT 替身伺服器 (bench/ptt_server.py)
+PTT_URL = os.environ.get('PTT_URL', 'https://www.ptt.cc').rstrip('/')
 USER_AGENTS = [
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36",
     "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36",
 ]
+# 要爬取的看板 (逗號分隔)、每個看板往「上頁」翻的頁數，以及每個看板最多分析幾篇文章
+SCRAPE_BOARDS = [b.strip() for b in os.environ.get('SCRAPE_BOARDS', 'Gossiping').split(',') if b.strip()]
+SCRAPE_PAGE_DEPTH = int(os.environ.get('SCRAPE_PAGE_DEPTH', '1'))
+ARTICLES_PER_BOARD = int(os.environ.get('ARTICLES_PER_BOARD', '10'))
+# 每個主機每秒最多發出的請求數、單篇文章逾時與整輪的時間預算 (秒)
+HOST_RATE_LIMIT = float(os.environ.get('HOST_RATE_LIMIT', '8'))
+ARTICLE_TIMEOUT = float(os.environ.get('ARTICLE_TIMEOUT', '20'))
+SCRAPE_CYCLE_BUDGET = float(os.environ.get('SCRAPE_CYCLE_BUDGET', '120'))
+# auto: 先用 httpx，被擋才改用 Playwright；httpx / playwright: 只使用指定引擎
+SCRAPE_ENGINE = os.environ.get('SCRAPE_ENGINE', 'auto').lower()
+SCRAPE_CONCURRENCY = int(os.environ.get('SCRAPE_CONCURRENCY', '5'))
+
+try:
+    import h2  # noqa: F401  httpx 的 HTTP/2 支援需要 h2 套件
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+http_client = None
+http_semaphore = None
+last_scrape_engine = None
+last_board_ppis = {}
+# 最近一輪成功爬取的逐篇結果 [(看板, 文章 ID, 標題, ArticleResult 或 None)]，與 PPI 一起寫入資料庫
+last_article_observations = []
+
+class ScrapeBlocked(Exception):
+    """純 HTTP 抓取被 PTT 擋下 (狀態碼異常或仍停在年齡確認頁)，需要改用 Playwright"""
+
+def get_http_client():
+    """取得共用的 httpx.AsyncClient (keep-alive、HTTP/2、已帶 over18 cookie)"""
+    global http_client, http_semaphore
+    if http_client is None or http_client.is_closed:
+        http_client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            headers={"User-Agent": random.choice(USER_AGENTS)},
+            cookies={"over18": "1"},
+            timeout=httpx.Timeout(20.0, connect=10.0),
+            limits=httpx.Limits(max_connections=SCRAPE_CONCURRENCY, max_keepalive_connections=SCRAPE_CONCURRENCY),
+            follow_redirects=True,
+        )
+        http_semaphore = asyncio.Semaphore(SCRAPE_CONCURRENCY)
+    return http_client
+
+async def close_http_client():
+    global http_client
+    if http_client is not None and not http_client.is_closed:
+        await http_client.aclose()
+    http_client = None
+
+class HostRateLimiter:
+    """每個主機的請求間隔下限：等待者依序 (FIFO) 排隊，輪到時等到距離上一個請求滿 interval 秒才放行。
+
+    時間槽在放行時才記錄，等待中被取消的任務 (逾時或超過整輪預算) 不會佔用後面請求的時間槽。
+    """
+    def __init__(self, rate=HOST_RATE_LIMIT):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._locks = {}
+        self._last_sent = {}
+
+    async def wait(self, url: str):
+        if not self.interval:
+            return
+        host = httpx.URL(url).host
+        lock = self._locks.get(host)
+        if lock is None:
+            lock = self._locks[host] = asyncio.Lock()
+        async with lock:
+            loop = asyncio.get_running_loop()
+            last_sent = self._last_sent.get(host)
+            if last_sent is not None and last_sent + self.interval > loop.time():
+                await asyncio.sleep(last_sent + self.interval - loop.time())
+            self._last_sent[host] = loop.time()
+
+host_rate_limiter = HostRateLimiter()
+
+# CrawlScheduler 為每個文章任務設定的回呼：第一個請求取得併發與速率限制的名額時呼叫，單篇逾時從這時才開始計算
+_article_clock = contextvars.ContextVar("article_clock", default=None)
+
+def start_article_clock():
+    callback = _article_clock.get()
+    if callback is not None:
+        callback()
+
+async def fetch_response(url: str, headers=None):
+    """以純 HTTP 取得頁面；403/429 或停在年齡確認頁時拋出 ScrapeBlocked，304/206/416 交由呼叫端處理，
+    其餘 HTTP 錯誤 (含 5xx) 照常拋出：單篇文章出錯只算該篇失敗，不讓整輪改用 Playwright"""
+    client = get_http_client()
+    async with http_semaphore:
+        await host_rate_limiter.wait(url)
+        start_article_clock()
+        response = await client.get(url, headers=headers)
+    if response.status_code in (403, 429):
+        raise ScrapeBlocked(f"HTTP {response.status_code}: {url}")
+    if response.status_code not in (304, 416):
+        response.raise_for_status()
+    if "/ask/over18" in str(response.url):
+        raise ScrapeBlocked(f"仍停留在年齡確認頁: {url}")
+    return response
+
+async def fetch_html(url: str):
+    return (await fetch_response(url)).text
+
+async def fetch_board_html(url: str):
+    """列表頁取不到就無法產生文章任務：5xx 也視為被擋，讓整輪改用 Playwright"""
+    try:
+        return await fetch_html(url)
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code >= 500:
+            raise ScrapeBlocked(f"HTTP {e.response.status_code}: {url}") from e
+        raise
+
+def board_index_url(board: str):
+    return f"{PTT_URL}/bbs/{board}/index.html"
+
+class ArticleResult(NamedTuple):
+    """單篇文章的爬取結果；neutral 為 → (及沒有標籤) 的推文數"""
+    push: int
+    boo: int
+    neutral: int
+    fetch_seconds: float
+    mode: str
+
+def compute_ppi(results):
+    """失敗的文章 (None) 不計入"""
+    total_push, total_boo = 0, 0
+    for result in results:
+        if result is None:
+            continue
+        total_push += result.push
+        total_boo += result.boo
+
+    total_votes = total_push + total_boo
+    return (total_push / total_votes) * 100 if total_votes > 0 else 0
+
+# --- 解析管線 (抓取 → 有界佇列 → 解析執行池 → 彙總) ---
+# process: 多個子程序平行解析，不佔用事件迴圈；thread: 執行緒池 (程序池無法建立或損壞時自動改用)；inline: 直接在事件迴圈解析
+PARSE_MODE = os.environ.get('PARSE_MODE', 'process').lower()
+PARSE_WORKERS = max(1, int(os.environ.get('PARSE_WORKERS', str(min(4, os.cpu_count() or 1)))))
+PARSE_QUEUE_SIZE = int(os.environ.get('PARSE_QUEUE_SIZE', '32'))
+
+class ParseStage:
+    """把 HTML 解析移出事件迴圈的管線階段。
+
+    抓取端以 run(func, *args) 把原始頁面排入有界佇列並等待結果；佇列滿時 run 會在放入前等待，
+    抓取任務因此停下 (背壓)，記憶體中待解析的頁面數不超過佇列長度加上併發的抓取數。
+    PARSE_WORKERS 個取用者各自從佇列取出工作交給執行池，執行池中同時最多 PARSE_WORKERS 個解析。
+    func 必須是 ptt_parser 中的頂層函式，才能傳給子程序。
+    """
+    def __init__(self, mode=PARSE_MODE, workers=PARSE_WORKERS, queue_size=PARSE_QUEUE_SIZE):
+        self.mode = mode
+        self.workers = workers
+        self.queue_size = queue_size
+        self._loop = None
+        self._queue = None
+        self._consumers = []
+        self._executor = None
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.backpressure_waits = 0
+        self.pool_failures = 0
+
+    def _start(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._executor = self._create_executor()
+        self._consumers = [asyncio.create_task(self._consume()) for _ in range(self.workers)]
+        logger.info(f"[解析] 解析管線已啟動 (模式: {self.mode}，{self.workers} 個工作者，佇列上限 {self.queue_size})。")
+
+    def _create_executor(self):
+        if self.mode == "process":
+            try:
+                # 子程序不以 fork 建立：事件迴圈與資料庫驅動的執行緒不應被複製
+                method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(method))
+            except (OSError, ImportError, NotImplementedError) as e:
+                logger.warning(f"[解析] 無法建立程序池，改用執行緒池: {e}")
+                self.mode = "thread"
+        if self.mode == "thread":
+            return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ptt-parse")
+        return None
+
+    async def run(self, func, *args):
+        self._start()
+        future = self._loop.create_future()
+        if self._queue.full():
+            self.backpressure_waits += 1
+            with PARSE_STAGE_SECONDS.labels("backpressure").time():
+                await self._queue.put((func, args, future, time.perf_counter()))
+        else:
+            self._queue.put_nowait((func, args, future, time.perf_counter()))
+        self.submitted += 1
+        return await future
+
+    async def _consume(self):
+        while True:
+            func, args, future, queued_at = await self._queue.get()
+            try:
+                if future.done():
+                    continue  # 等待中的抓取任務已逾時被取消
+                PARSE_STAGE_SECONDS.labels("queued").observe(time.perf_counter() - queued_at)
+                with PARSE_STAGE_SECONDS.labels("execute").time():
+                    result = await self._execute(func, args)
+            except Exception as e:
+                self.failed += 1
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                self.completed += 1
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                self._queue.task_done()
+
+    async def _execute(self, func, args):
+        if self._executor is None:
+            return func(*args)
+        try:
+            return await self._loop.run_in_executor(self._executor, func, *args)
+        except BrokenProcessPool as e:
+            # 子程序意外結束 (例如記憶體不足被終止)：改用執行緒池並重試這一頁
+            self.pool_failures += 1
+            logger.warning(f"[解析] 程序池已損壞，改用執行緒池: {e}")
+            broken, self.mode = self._executor, "thread"
+            self._executor = self._create_executor()
+            broken.shutdown(wait=False, cancel_futures=True)
+            return await self._loop.run_in_executor(self._executor, func, *args)
+
+    async def close(self):
+        for consumer in self._consumers:
+            consumer.cancel()
+        await asyncio.gather(*self._consumers, return_exceptions=True)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._loop = self._queue = self._executor = None
+        self._consumers = []
+
+    @property
+    def depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "started": self._loop is not None,  # 執行池在第一次解析時才建立
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "queued": self.depth,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "backpressure_waits": self.backpressure_waits,
+            "pool_failures": self.pool_failures,
+        }
+
+parse_stage = ParseStage()
+
+class CrawlScheduler:
+    """依看板清單與翻頁深度產生文章任務，並在全域併發上限、每主機速率限制與時間預算內完成一輪。
+
+    fetch_board(url) 回傳列表頁 HTML；scrape_article(url) 回傳 ArticleResult，失敗時回傳 None。
+    列表頁一解析完就立即排入該頁的文章任務，不必等所有看板翻頁完成；
+    單篇文章在取得名額並送出請求後超過 ARTICLE_TIMEOUT，或整輪超過 SCRAPE_CYCLE_BUDGET 時，未完成的任務會被取消。
+    """
+    def __init__(self, fetch_board, scrape_article, boards=None, depth=SCRAPE_PAGE_DEPTH,
+                 articles_per_board=ARTICLES_PER_BOARD, article_timeout=ARTICLE_TIMEOUT, budget=SCRAPE_CYCLE_BUDGET):
+        self.fetch_board = fetch_board
+        self.scrape_article = scrape_article
+        self.boards = boards or SCRAPE_BOARDS
+        self.depth = max(depth, 1)
+        self.articles_per_board = articles_per_board
+        self.article_timeout = article_timeout
+        self.budget = budget
+        self._article_tasks = {}
+        self.observations = []
+        self.timed_out = 0
+        self.cancelled = 0
+
+    async def _scrape_with_timeout(self, url):
+        """等待併發與速率限制名額的時間不計入 ARTICLE_TIMEOUT：第一個請求送出前才開始計時"""
+        clock_started = asyncio.Event()
+        token = _article_clock.set(clock_started.set)
+        try:
+            task = asyncio.create_task(self.scrape_article(url))  # 複製目前的 context，包含上面的回呼
+        finally:
+            _article_clock.reset(token)
+        waiter = asyncio.create_task(clock_started.wait())
+        try:
+            await asyncio.wait((task, waiter), return_when=asyncio.FIRST_COMPLETED)
+            return await asyncio.wait_for(task, timeout=self.article_timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            ARTICLES_ABANDONED.labels("timeout").inc()
+            logger.warning(f"爬取內頁 {url} 超過 {self.article_timeout:g} 秒，已取消。")
+            return None
+        finally:
+            waiter.cancel()
+            task.cancel()  # 整輪預算到期而被取消時，一併取消仍在排隊的爬取
+
+    async def _crawl_board(self, board):
+        url = board_index_url(board)
+        queued = 0
+        for _ in range(self.depth):
+            html = await self.fetch_board(url)
+            # 兩種引擎共用同一個列表頁解析，確保結果一致
+            links, prev_href = await parse_stage.run(parse_board_page, html)
+            if not links:
+                logger.warning(f"在 {board} 列表頁上沒有找到任何文章連結: {url}")
+            for href, title in links[:self.articles_per_board - queued]:
+                article_url = PTT_URL + href
+                task = asyncio.create_task(self._scrape_with_timeout(article_url))
+                self._article_tasks[task] = (board, article_url, title)
+                queued += 1
+            if queued >= self.articles_per_board or not prev_href:
+                break
+            url = PTT_URL + prev_href
+
+    async def run(self):
+        """回傳 {看板: [ArticleResult 或 None, ...]}，逐篇結果另存於 self.observations；任何任務被擋時取消全部並拋出 ScrapeBlocked"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.budget
+        board_tasks = [asyncio.create_task(self._crawl_board(board)) for board in self.boards]
+        try:
+            done, pending = await asyncio.wait(board_tasks, timeout=self.budget)
+            self._raise_if_blocked(done)
+            for task in done:
+                if task.exception() is not None:
+                    logger.warning(f"爬取看板列表失敗: {task.exception()}")
+            self._cancel(pending)
+
+            article_tasks = list(self._article_tasks)
+            if article_tasks:
+                done, pending = await asyncio.wait(article_tasks, timeout=max(deadline - loop.time(), 0))
+                self._raise_if_blocked(done)
+                if pending:
+                    ARTICLES_ABANDONED.labels("budget").inc(len(pending))
+                    logger.warning(f"本輪超過 {self.budget:g} 秒的時間預算，取消 {len(pending)} 篇未完成的文章。")
+                self._cancel(pending)
+        except BaseException:
+            self._cancel(board_tasks + list(self._article_tasks))
+            raise
+
+        results = {board: [] for board in self.boards}
+        for task, (board, url, title) in self._article_tasks.items():
+            result = task.result() if task.done() and not task.cancelled() and task.exception() is None else None
+            results[board].append(result)
+            self.observations.append((board, article_id_from_url(url), title, result))
+        return results
+
+    def _cancel(self, tasks):
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+                self.cancelled += 1
+
+    def _raise_if_blocked(self, done):
+        for task in done:
+            if not task.cancelled() and isinstance(task.exception(), ScrapeBlocked):
+                raise task.exception()
+
+def summarize_crawl(results, engine: str, started: float, observations=()):
+    """計算每個看板與合併後的 PPI；合併 PPI 以所有看板的推噓總數計算"""
+    global last_board_ppis, last_article_observations
+    last_article_observations = list(observations)
+    board_ppis = {}
+    for board, board_results in results.items():
+        scraped = [r for r in board_results if r is not None]
+        board_ppis[board] = {
+            "ppi": round(compute_ppi(scraped), 2),
+            "push": sum(r.push for r in scraped),
+            "boo": sum(r.boo for r in scraped),
+            "articles": len(scraped),
+            "failed": len(board_results) - len(scraped),
+        }
+    last_board_ppis = board_ppis
+    for stats in board_ppis.values():
+        ARTICLES.labels(engine.lower(), "ok").inc(stats["articles"])
+        ARTICLES.labels(engine.lower(), "failed").inc(stats["failed"])
+
+    all_results = [r for board_results in results.values() for r in board_results]
+    if not all_results:
+        logger.warning("在列表頁上沒有找到任何文章連結。")
+        return 0.0
+    ppi = compute_ppi(all_results)
+    for board, stats in board_ppis.items():
+        logger.info(f"[爬蟲] {board}: PPI {stats['ppi']:.2f}% ({stats['articles']} 篇成功, {stats['failed']} 篇失敗)",
+                    extra={"board": board, **stats})
+    elapsed = time.perf_counter() - started
+    logger.info(f"--- 深度分析完成 ({engine}) --- PPI: {ppi:.2f}% (本輪耗時 {elapsed:.2f} 秒)",
+                extra={"engine": engine, "ppi": round(ppi, 2), "seconds": round(elapsed, 3)})
+    return ppi
 
 async def deep_scrape_ppi():
-    """使用 Playwright 進行深度分析，模擬真人瀏覽"""
+    """完整一輪爬取，並記錄本輪的耗時與結果 (ok / zero_ppi / failed) 指標"""
+    started = time.perf_counter()
+    ppi = await scrape_with_fallback()
+    engine = last_scrape_engine.lower() if ppi is not None and last_scrape_engine else "none"
+    SCRAPE_CYCLE_SECONDS.labels(engine).observe(time.perf_counter() - started)
+    outcome = "failed" if ppi is None else ("zero_ppi" if ppi == 0 else "ok")
+    SCRAPE_CYCLES.labels(engine, outcome).inc()
+    return ppi
+
+async def scrape_with_fallback():
+    """預設以 httpx 抓取；純 HTTP 被擋時自動改用 Playwright，並記錄本輪使用的引擎"""
+    global last_scrape_engine, last_article_observations
+    last_article_observations = []
+    if SCRAPE_ENGINE != 'playwright':
+        try:
+            ppi = await http_scrape_ppi()
+            last_scrape_engine = 'httpx'
+            return ppi
+        except ScrapeBlocked as e:
+            if SCRAPE_ENGINE == 'httpx':
+                logger.error(f"純 HTTP 抓取被擋且已停用 Playwright 備援: {e}")
+                return None
+            logger.info(f"[爬蟲] 純 HTTP 抓取被擋 ({e})，改用 Playwright 備援...")
+        except Exception as e:
+            logger.error(f"httpx 爬取時發生未知錯誤: {e}")
+            return None
+
+    ppi = await playwright_scrape_ppi()
+    last_scrape_engine = 'playwright'
+    return ppi
+
+async def http_scrape_ppi():
+    """使用共用的 httpx.AsyncClient 抓取，不啟動瀏覽器"""
+    started = time.perf_counter()
+    logger.info(f"[爬蟲] 正在以 httpx 前往 PTT {', '.join(SCRAPE_BOARDS)} 看板...")
+    scheduler = CrawlScheduler(fetch_board_html, http_scrape_article)
+    results = await scheduler.run()
+    await asyncio.to_thread(article_cache.save)
+    return summarize_crawl(results, 'httpx', started, scheduler.observations)
+
+async def http_scrape_article(url: str):
+    """單篇文章失敗時回傳 None；被擋則往上拋出，讓整輪改用 Playwright"""
+    started = time.perf_counter()
+    try:
+        result = await incremental_scrape_article(url)
+        elapsed = time.perf_counter() - started
+        logger.debug("已分析內頁 (%s): %s - 推: %d, 噓: %d (耗時 %.2f 秒)", result.mode, url, result.push, result.boo, elapsed,
+                     extra={"url": url, "mode": result.mode, "push": result.push, "boo": result.boo, "seconds": round(elapsed, 3)})
+        return result
+    except ScrapeBlocked:
+        raise
+    except Exception as e:
+        logger.warning(f"爬取內頁 {url} 失敗: {e}")
+        return None
+
+# --- 滑動視窗 PPI (依推文時間) ---
+PPI_WINDOWS_MINUTES = (5, 15, 60)
+# 推文時間 (push-ipdatetime) 為台灣時間且不含年份，例如 "1.2.3.4 10/16 12:34"
+PTT_TIMEZONE = timezone(timedelta(hours=8))
+_PUSH_TIME = re.compile(r'(\d{1,2})/(\d{1,2})\s+(\d{1,2}):(\d{2})')
+
+def parse_push_minute(ipdatetime, now: datetime):
+    """推文時間所在的 Unix 分鐘數；年份以 now 推算，推算結果在未來一天以上時視為去年 (跨年)。無法解析時回傳 None"""
+    if not ipdatetime:
+        return None
+    match = _PUSH_TIME.search(ipdatetime)
+    if match is None:
+        return None
+    month, day, hour, minute = (int(part) for part in match.groups())
+    local_now = now.astimezone(PTT_TIMEZONE)
     try:
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=True)
-            context = await browser.new_context(user_agent=random.choice(USER_AGENTS))
-            page = await context.new_page()
-            
-            print("[爬蟲] 正在前往 PTT 八卦版...")
-            await page.goto(GOSSIPING_BOARD_URL, wait_until='domcontentloaded', timeout=60000)
-            
+        pushed_at = datetime(local_now.year, month, day, hour, minute, tzinfo=PTT_TIMEZONE)
+        if pushed_at - local_now > timedelta(days=1):
+            pushed_at = pushed_at.replace(year=local_now.year - 1)
+    except ValueError:
+        return None
+    return int(pushed_at.timestamp()) // 60
+
+class PushWindows:
+    """以每分鐘一格的環狀緩衝區統計最近 max(PPI_WINDOWS_MINUTES) 分鐘內的推/噓數。
+
+    每則推文以 O(1) 加進所屬分鐘的格子；格子記住自己代表的分鐘，被新的分鐘重用時先歸零，
+    因此記憶體固定為 60 格，與每輪推文數無關。早於最大視窗的推文直接略過，
+    時間在未來的推文 (時鐘誤差) 算在目前這一分鐘。
+    推文的去重由文章快取負責：呼叫端只送進上一輪之後新增的推文。
+    """
+    def __init__(self, windows=PPI_WINDOWS_MINUTES):
+        self.windows = tuple(sorted(windows))
+        self.size = self.windows[-1]
+        self._minute = [-1] * self.size
+        self._push = [0] * self.size
+        self._boo = [0] * self.size
+        self.ingested = 0
+        self.expired = 0
+        self.unparsed = 0
+
+    def add(self, tag, minute, now_minute):
+        if minute > now_minute:
+            minute = now_minute
+        elif minute <= now_minute - self.size:
+            self.expired += 1
+            return
+        slot = minute % self.size
+        if self._minute[slot] != minute:
+            self._minute[slot] = minute
+            self._push[slot] = 0
+            self._boo[slot] = 0
+        if tag == PUSH_TAG:
+            self._push[slot] += 1
+        elif tag == BOO_TAG:
+            self._boo[slot] += 1
+        self.ingested += 1
+
+    def ingest(self, pushes, now: datetime = None):
+        """pushes 為 extract_pushes 的結果 (標籤, 使用者, IP 與時間)"""
+        now = now or datetime.now(timezone.utc)
+        now_minute = int(now.timestamp()) // 60
+        minutes = {}
+        for tag, _user, ipdatetime in pushes:
+            if tag != PUSH_TAG and tag != BOO_TAG:
+                continue
+            # 同一篇文章的推文時間大量重複，解析結果以字串快取
+            minute = minutes.get(ipdatetime, -1)
+            if minute == -1:
+                minute = minutes[ipdatetime] = parse_push_minute(ipdatetime, now)
+            if minute is None:
+                self.unparsed += 1
+                continue
+            self.add(tag, minute, now_minute)
+
+    def counts(self, window, now: datetime = None):
+        now_minute = int((now or datetime.now(timezone.utc)).timestamp()) // 60
+        push = boo = 0
+        for slot in range(self.size):
+            if now_minute - window < self._minute[slot] <= now_minute:
+                push += self._push[slot]
+                boo += self._boo[slot]
+        return push, boo
+
+    def ppis(self, now: datetime = None):
+        """{'ppi_5m': ..., 'ppi_15m': ..., 'ppi_60m': ...}；視窗內沒有推噓時為 None"""
+        result = {}
+        for window in self.windows:
+            push, boo = self.counts(window, now)
+            result[f"ppi_{window}m"] = push / (push + boo) * 100 if push + boo else None
+        return result
+
+    def stats(self):
+        stats = {"ingested": self.ingested, "expired": self.expired, "unparsed": self.unparsed}
+        for window in self.windows:
+            push, boo = self.counts(window)
+            stats[f"{window}m"] = {"push": push, "boo": boo}
+        return stats
+
+push_windows = PushWindows()
+
+# --- 文章狀態快取 (增量爬取) ---
+ARTICLE_CACHE_SIZE = int(os.environ.get('ARTICLE_CACHE_SIZE', '500'))
+ARTICLE_CACHE_PATH = os.environ.get('ARTICLE_CACHE_PATH')  # 設定後會跨重啟保存
+# 推文位移前的這段位元組作為指紋，用來確認文章前段 (內文) 沒有被修改
+OFFSET_FINGERPRINT_BYTES = 64
+
+def article_id_from_url(url: str):
+    """https://www.ptt.cc/bbs/Gossiping/M.1700000000.A.ABC.html -> M.1700000000.A.ABC"""
+    return url.rsplit('/', 1)[-1].removesuffix('.html')
+
+class ArticleCache:
+    """以 PTT 文章 ID 為鍵的 LRU 快取。
+
+    每篇文章記錄推文行數、推噓統計、最後一行推文的位元組位移與指紋，
+    以及 ETag / Last-Modified / Content-Length，讓下一輪只需處理新增的推文。
+    """
+    def __init__(self, max_size=ARTICLE_CACHE_SIZE, path=ARTICLE_CACHE_PATH):
+        self.max_size = max_size
+        self.path = path
+        self._entries = OrderedDict()
+        self.not_modified = 0
+        self.incremental = 0
+        self.full = 0
+        self.evictions = 0
+
+    def get(self, article_id):
+        entry = self._entries.get(article_id)
+        if entry is not None:
+            self._entries.move_to_end(article_id)
+        return entry
+
+    def put(self, article_id, entry):
+        self._entries[article_id] = entry
+        self._entries.move_to_end(article_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                for article_id, entry in json.load(f).items():
+                    self.put(article_id, entry)
+            logger.info(f"[快取] 已載入 {len(self._entries)} 篇文章狀態。")
+        except Exception as e:
+            logger.warning(f"載入文章快取失敗，將重新建立: {e}")
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.warning(f"儲存文章快取失敗: {e}")
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "max_size": self.max_size,
+            "not_modified": self.not_modified,
+            "incremental": self.incremental,
+            "full": self.full,
+            "evictions": self.evictions,
+        }
+
+article_cache = ArticleCache()
+
+def _range_total_length(response):
+    content_range = response.headers.get('content-range', '')
+    total = content_range.rsplit('/', 1)[-1]
+    return int(total) if total.isdigit() else None
+
+def cached_neutral(state):
+    """快取中的 → 數；舊版快取沒有這個欄位，以推文行數扣除推噓估計"""
+    if 'neutral' in state:
+        return state['neutral']
+    return max(state.get('push_lines', 0) - state['push'] - state['boo'], 0)
+
+async def incremental_scrape_article(url: str):
+    """以條件式請求與 Range 只抓取、解析新增的推文，回傳 ArticleResult"""
+    article_id = article_id_from_url(url)
+    state = article_cache.get(article_id)
+    offset = state.get('push_offset') if state else None
+    fingerprint = bytes.fromhex(state['fingerprint']) if state and state.get('fingerprint') else None
+
+    headers = {}
+    if state:
+        if state.get('etag'):
+            headers['If-None-Match'] = state['etag']
+        if state.get('last_modified'):
+            headers['If-Modified-Since'] = state['last_modified']
+        if offset and fingerprint:
+            headers['Range'] = f"bytes={offset - len(fingerprint)}-"
+
+    fetch_started = time.perf_counter()
+    response = await fetch_response(url, headers=headers or None)
+    if response.status_code == 416:
+        # 文章被修改而變短，位移已失效
+        response = await fetch_response(url)
+    fetch_seconds = time.perf_counter() - fetch_started
+    ARTICLE_FETCH_SECONDS.labels("httpx").observe(fetch_seconds)
+
+    if response.status_code == 304:
+        article_cache.not_modified += 1
+        CACHE_LOOKUPS.labels("article", "hit").inc()
+        return ArticleResult(state['push'], state['boo'], cached_neutral(state), fetch_seconds, 'cached')
+
+    body = response.content
+    doc_start = 0
+    tail_start = None
+    if response.status_code == 206:
+        doc_start = offset - len(fingerprint)
+        total_length = _range_total_length(response)
+        if total_length is not None and total_length == state.get('content_length'):
+            article_cache.not_modified += 1
+            CACHE_LOOKUPS.labels("article", "hit").inc()
+            return ArticleResult(state['push'], state['boo'], cached_neutral(state), fetch_seconds, 'cached')
+        if body[:len(fingerprint)] == fingerprint:
+            tail_start = len(fingerprint)
+        else:
+            refetch_started = time.perf_counter()
+            response = await fetch_response(url)
+            ARTICLE_FETCH_SECONDS.labels("httpx").observe(time.perf_counter() - refetch_started)
+            fetch_seconds += time.perf_counter() - refetch_started
+            body = response.content
+            doc_start = 0
+            total_length = len(body)
+    else:
+        total_length = len(body)
+        if offset and fingerprint and body[offset - len(fingerprint):offset] == fingerprint:
+            tail_start = offset
+
+    # 解碼與解析在解析執行池中進行，這裡只彙總結果
+    encoding = response.encoding or 'utf-8'
+    if tail_start is not None:
+        new_pushes, tail_lines, tail_offset, parse_seconds = await parse_stage.run(parse_article, body[tail_start:], encoding)
+        new_push, new_boo = tally_pushes(new_pushes)
+        push_count, boo_count = state['push'] + new_push, state['boo'] + new_boo
+        neutral_count = cached_neutral(state) + len(new_pushes) - new_push - new_boo
+        push_lines = state.get('push_lines', 0) + tail_lines
+        new_offset = doc_start + tail_start + tail_offset if tail_offset is not None else offset
+        article_cache.incremental += 1
+        mode = 'incremental'
+    else:
+        pushes, push_lines, new_offset, parse_seconds = await parse_stage.run(parse_article, body, encoding)
+        push_count, boo_count = tally_pushes(pushes)
+        neutral_count = len(pushes) - push_count - boo_count
+        # 已看過的文章重新完整解析時，前 push_lines 則推文已經計入過滑動視窗
+        new_pushes = pushes[state.get('push_lines', 0):] if state else pushes
+        article_cache.full += 1
+        mode = 'full'
+    push_windows.ingest(new_pushes)
+    ARTICLE_PARSE_SECONDS.labels("httpx", mode).observe(parse_seconds)
+    CACHE_LOOKUPS.labels("article", "partial" if mode == 'incremental' else "miss").inc()
+
+    new_fingerprint = None
+    if new_offset is not None:
+        local_end = new_offset - doc_start
+        if local_end >= OFFSET_FINGERPRINT_BYTES:
+            new_fingerprint = body[local_end - OFFSET_FINGERPRINT_BYTES:local_end].hex()
+        elif fingerprint and local_end == len(fingerprint):
+            new_fingerprint = fingerprint.hex()
+
+    article_cache.put(article_id, {
+        "push_lines": push_lines,
+        "push": push_count,
+        "boo": boo_count,
+        "neutral": neutral_count,
+        "push_offset": new_offset if new_fingerprint else None,
+        "fingerprint": new_fingerprint,
+        "etag": response.headers.get('etag'),
+        "last_modified": response.headers.get('last-modified'),
+        "content_length": total_length,
+    })
+    return ArticleResult(push_count, boo_count, neutral_count, fetch_seconds, mode)
+
+# --- Playwright 瀏覽器池 (僅在 httpx 被擋時使用) ---
+BROWSER_POOL_SIZE = int(os.environ.get('BROWSER_POOL_SIZE', '4'))
+PAGE_MAX_USES = int(os.environ.get('PAGE_MAX_USES', '50'))
+CONTEXT_MAX_USES = int(os.environ.get('CONTEXT_MAX_USES', '500'))
+AGE_CHECK_BUTTON = 'button:has-text("我同意，我已年滿十八歲")'
+# lean 模式：推文在伺服器端渲染的 HTML 中，攔截並中止圖片、字型、樣式、媒體與第三方腳本
+LEAN_PAGES = os.environ.get('LEAN_PAGES', '1') != '0'
+BLOCKED_RESOURCE_TYPES = {"image", "font", "stylesheet", "media"}
+# 允許載入腳本的主機 (完全相符，不以字尾比對)
+SCRIPT_HOSTS = {"ptt.cc", "www.ptt.cc", httpx.URL(PTT_URL).host}
+ARTICLE_READY_SELECTOR = "div.push, #main-content"
+
+async def block_heavy_resources(route):
+    request = route.request
+    if request.resource_type in BLOCKED_RESOURCE_TYPES:
+        return await route.abort()
+    host = httpx.URL(request.url).host
+    if request.resource_type == "script" and host not in SCRIPT_HOSTS:
+        return await route.abort()
+    await route.continue_()
+
+class BrowserPool:
+    """長駐的 Chromium 與 context，提供固定數量、可重複使用的分頁。
+
+    瀏覽器在第一次需要時才啟動，之後跨輪次沿用；年齡確認只在建立 context 時通過一次，
+    cookie 保留在 context 中。分頁使用 N 次或崩潰後會被替換，context 使用 N 次後於兩輪之間重建。
+    """
+    def __init__(self, size=BROWSER_POOL_SIZE, page_max_uses=PAGE_MAX_USES, context_max_uses=CONTEXT_MAX_USES):
+        self.size = size
+        self.page_max_uses = page_max_uses
+        self.context_max_uses = context_max_uses
+        self._playwright = None
+        self._browser = None
+        self._context = None
+        self._idle = asyncio.Queue()
+        self._page_uses = {}
+        self._crashed = set()
+        self._context_uses = 0
+        self._lock = asyncio.Lock()
+        self.browser_launches = 0
+        self.context_recycles = 0
+        self.page_recycles = 0
+        self.crashes = 0
+        self.total_page_uses = 0
+        self.last_launch_seconds = None
+
+    @property
+    def running(self):
+        return self._browser is not None and self._browser.is_connected()
+
+    async def ensure_ready(self):
+        """在每輪 Playwright 爬取開始前呼叫 (此時沒有分頁被借出)，必要時啟動或重建"""
+        async with self._lock:
+            if not self.running:
+                await self._launch()
+            elif self._context_uses >= self.context_max_uses or len(self._page_uses) < self.size:
+                await self._new_context()
+                self.context_recycles += 1
+
+    async def _launch(self):
+        started = time.perf_counter()
+        if self._browser is not None:
+            self.crashes += 1
+            logger.info("[瀏覽器池] 偵測到瀏覽器已中斷，正在重新啟動...")
+            try:
+                await self._browser.close()
+            except Exception:
+                pass
+        if self._playwright is None:
+            from playwright.async_api import async_playwright
+            self._playwright = await async_playwright().start()
+        self._browser = await self._playwright.chromium.launch(headless=True)
+        self.browser_launches += 1
+        self._context = None
+        await self._new_context()
+        self.last_launch_seconds = time.perf_counter() - started
+        BROWSER_LAUNCH_SECONDS.observe(self.last_launch_seconds)
+        logger.info(f"[瀏覽器池] Chromium 已啟動，耗時 {self.last_launch_seconds:.2f} 秒。")
+
+    async def _new_context(self):
+        old_context = self._context
+        self._idle = asyncio.Queue()
+        self._page_uses = {}
+        self._crashed = set()
+        self._context_uses = 0
+        if old_context is not None:
             try:
-                agree_button = page.locator('button:has-text("我同意，我已年滿十八歲")')
-                await agree_button.wait_for(state='visible', timeout=5000)
-                print("[爬蟲] 偵測到年齡確認，正在點擊...")
-                await agree_button.click()
-                await page.wait_for_load_state('networkidle', timeout=60000)
+                await old_context.close()
             except Exception:
-                print("[爬蟲] 未偵測到年齡確認按鈕或已超時，直接繼續。")
+                pass
 
-            content = await page.content()
+        self._context = await self._browser.new_context(user_agent=random.choice(USER_AGENTS))
+        if LEAN_PAGES:
+            await self._context.route("**/*", block_heavy_resources)
+        await self._pass_age_check()
+        for _ in range(self.size):
+            await self._add_page()
+
+    async def _pass_age_check(self):
+        page = await self._context.new_page()
+        try:
+            await page.goto(board_index_url(SCRAPE_BOARDS[0]), wait_until='domcontentloaded', timeout=60000)
+            agree_button = page.locator(AGE_CHECK_BUTTON)
+            await agree_button.wait_for(state='visible', timeout=5000)
+            logger.info("[瀏覽器池] 偵測到年齡確認，正在點擊 (cookie 將保留在 context 中)...")
+            await agree_button.click()
+            await page.wait_for_load_state('domcontentloaded', timeout=60000)
+        except Exception:
+            logger.info("[瀏覽器池] 未偵測到年齡確認按鈕或已超時，直接繼續。")
+        finally:
             await page.close()
-            soup = BeautifulSoup(content, "html.parser")
-            
-            articles = soup.select("div.r-ent")
-            article_urls = [PTT_URL + a.select_one("div.title a")['href'] for a in articles if a.select_one("div.title a")]
-
-            if not article_urls:
-                print("[警告] 在列表頁上沒有找到任何文章連結。")
-                await browser.close()
-                return 0.0
-
-            total_push, total_boo = 0, 0
-            
-            scrape_tasks = [scrape_article(context, url) for url in article_urls[:10]]
-            results = await asyncio.gather(*scrape_tasks)
-            
-            for push, boo in results:
-                total_push += push
-                total_boo += boo
-
-            await browser.close()
-
-            total_votes = total_push + total_boo
-            ppi = (total_push / total_votes) * 100 if total_votes > 0 else 0
-            
-            print(f"--- 深度分析完成 --- PPI: {ppi:.2f}%")
-            return ppi
+
+    async def _add_page(self):
+        page = await self._context.new_page()
+        page.on("crash", lambda p: self._crashed.add(p))
+        self._page_uses[page] = 0
+        self._idle.put_nowait(page)
+
+    @asynccontextmanager
+    async def page(self):
+        """借出一個分頁，用完自動歸還；崩潰或達使用上限的分頁會被替換"""
+        page = await asyncio.wait_for(self._idle.get(), timeout=60)
+        try:
+            yield page
+        finally:
+            await self._release(page)
+
+    async def _release(self, page):
+        self.total_page_uses += 1
+        self._context_uses += 1
+        self._page_uses[page] = self._page_uses.get(page, 0) + 1
+        crashed = page in self._crashed or page.is_closed()
+        if not crashed and self._page_uses[page] < self.page_max_uses:
+            self._idle.put_nowait(page)
+            return
+
+        if crashed:
+            self.crashes += 1
+        self.page_recycles += 1
+        self._page_uses.pop(page, None)
+        self._crashed.discard(page)
+        try:
+            if not page.is_closed():
+                await page.close()
+            await self._add_page()
+        except Exception as e:
+            # context 已失效：分頁數不足，下一輪 ensure_ready 會重建 context
+            logger.info(f"[瀏覽器池] 替換分頁失敗: {e}")
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "size": self.size,
+            "idle_pages": self._idle.qsize(),
+            "in_use_pages": len(self._page_uses) - self._idle.qsize(),
+            "browser_launches": self.browser_launches,
+            "context_recycles": self.context_recycles,
+            "page_recycles": self.page_recycles,
+            "crashes": self.crashes,
+            "total_page_uses": self.total_page_uses,
+            "context_uses": self._context_uses,
+            "last_launch_seconds": round(self.last_launch_seconds, 3) if self.last_launch_seconds is not None else None,
+        }
+
+    async def close(self):
+        async with self._lock:
+            if self._browser is not None:
+                try:
+                    await self._browser.close()
+                except Exception:
+                    pass
+            if self._playwright is not None:
+                await self._playwright.stop()
+            self._playwright = None
+            self._browser = None
+            self._context = None
+            self._idle = asyncio.Queue()
+            self._page_uses = {}
+
+browser_pool = BrowserPool()
+
+async def playwright_scrape_ppi():
+    """使用長駐的瀏覽器池進行深度分析，模擬真人瀏覽"""
+    started = time.perf_counter()
+    try:
+        await browser_pool.ensure_ready()
+
+        logger.info(f"[爬蟲] 正在前往 PTT {', '.join(SCRAPE_BOARDS)} 看板...")
+        scheduler = CrawlScheduler(pooled_fetch_board, pooled_scrape_article)
+        results = await scheduler.run()
+        return summarize_crawl(results, 'Playwright', started, scheduler.observations)
     except Exception as e:
-        print(f"[重大錯誤] Playwright 爬取時發生未知錯誤: {e}")
+        logger.error(f"Playwright 爬取時發生未知錯誤: {e}")
         return None
 
-async def scrape_article(context: BrowserContext, url: str):
-    """每個任務都使用自己的獨立分頁，並模擬滾動"""
-    page = await context.new_page()
+async def pooled_fetch_board(url: str):
+    async with browser_pool.page() as page:
+        await host_rate_limiter.wait(url)
+        await page.goto(url, wait_until='domcontentloaded', timeout=60000)
+        if "/ask/over18" in page.url:
+            # cookie 失效時才需要再次點擊年齡確認
+            logger.info("[爬蟲] 偵測到年齡確認，正在點擊...")
+            await page.locator(AGE_CHECK_BUTTON).click()
+            await page.wait_for_load_state('domcontentloaded', timeout=60000)
+        return await page.content()
+
+async def pooled_scrape_article(url: str):
+    async with browser_pool.page() as page:
+        await host_rate_limiter.wait(url)
+        start_article_clock()
+        return await scrape_article(page, url)
+
+async def scrape_article(page: "Page", url: str):
+    """使用瀏覽器池借出的分頁；DOM 載入或推文區塊出現即視為就緒"""
+    started = time.perf_counter()
     try:
-        await page.goto(url, wait_until='networkidle', timeout=20000)
-        await page.evaluate('window.scrollTo(0, document.body.scrollHeight)')
-        await page.wait_for_timeout(500)
+        if LEAN_PAGES:
+            await page.goto(url, wait_until='domcontentloaded', timeout=20000)
+            await page.wait_for_selector(ARTICLE_READY_SELECTOR, state='attached', timeout=5000)
+        else:
+            await page.goto(url, wait_until='networkidle', timeout=20000)
+            await page.evaluate('window.scrollTo(0, document.body.scrollHeight)')
+            await page.wait_for_timeout(500)
+        fetch_seconds = time.perf_counter() - started
+        ARTICLE_FETCH_SECONDS.labels("playwright").observe(fetch_seconds)
 
-        article_soup = BeautifulSoup(await page.content(), 'html.parser')
-        
-        push_count = 0
-        boo_count = 0
-        
-        all_pushes = article_soup.select('div.push')
-        for push_div in all_pushes:
-            tag_span = push_div.select_one('span.push-tag')
-            if tag_span and tag_span.string:
-                tag_text = tag_span.string.strip()
-                if tag_text == '推':
-                    push_count += 1
-                elif tag_text == '噓':
-                    boo_count += 1
+        html = await page.content()
+        pushes, push_lines, _, parse_seconds = await parse_stage.run(parse_article, html)
+        ARTICLE_PARSE_SECONDS.labels("playwright", "full").observe(parse_seconds)
+        push_count, boo_count = tally_pushes(pushes)
+        neutral_count = len(pushes) - push_count - boo_count
+        # 與 httpx 共用文章快取的推文行數去重；瀏覽器取得的內容沒有 ETag 與位移，之後 httpx 會先完整抓一次
+        article_id = article_id_from_url(url)
+        state = article_cache.get(article_id)
+        push_windows.ingest(pushes[state.get('push_lines', 0):] if state else pushes)
+        article_cache.put(article_id, {"push_lines": push_lines, "push": push_count, "boo": boo_count,
+                                       "neutral": neutral_count})
         
-        print(f"[成功] 已分析內頁: {url} - 推: {push_count}, 噓: {boo_count}")
-        await page.close()
-        return push_count, boo_count
+        elapsed = time.perf_counter() - started
+        logger.debug("已分析內頁: %s - 推: %d, 噓: %d (耗時 %.2f 秒)", url, push_count, boo_count, elapsed,
+                     extra={"url": url, "push": push_count, "boo": boo_count, "seconds": round(elapsed, 3)})
+        return ArticleResult(push_count, boo_count, neutral_count, fetch_seconds, 'playwright')
     except Exception as e:
-        print(f"[警告] 爬取內頁 {url} 失敗: {e}")
-        await page.close()
-        return 0, 0
+        logger.warning(f"爬取內頁 {url} 失敗: {e}")
+        return None
 
-# --- Background Task ---
-async def scrape_and_save_periodically():
-    print("背景任務啟動，正在初始化資料庫...")
-    initialized = await run_in_threadpool(initialize_database)
+# --- 程序角色與爬蟲領導鎖 ---
+# all: API 與爬蟲在同一程序 (預設，相容單一程序部署)；api: 只提供 API，爬蟲由 `python -m ptt_cli worker` 另外執行
+APP_ROLE = os.environ.get('APP_ROLE', 'all')
+# Postgres advisory lock 的鍵值；同一個資料庫上的所有程序必須相同
+LEADER_LOCK_KEY = int(os.environ.get('LEADER_LOCK_KEY', '7710601'))
+# 本機 SQLite 沒有 advisory lock，改用檔案鎖 (同一台機器上的程序之間有效)
+LEADER_LOCK_PATH = os.environ.get('LEADER_LOCK_PATH', os.path.join(tempfile.gettempdir(), 'ptt_scraper.lock'))
+LEADER_RETRY_SECONDS = float(os.environ.get('LEADER_RETRY_SECONDS', '30'))
+# 不爬蟲的程序重新載入快照的間隔 (秒)，用來發現其他程序寫入的新紀錄與設定
+SNAPSHOT_REFRESH_SECONDS = float(os.environ.get('SNAPSHOT_REFRESH_SECONDS', '15'))
 
-    if not initialized:
-        print("[背景任務終止] 因資料庫初始化失敗，背景任務無法繼續。")
-        return
+def try_lock_file(lock_file):
+    """以不阻塞的方式鎖住整個檔案 (Windows 鎖第一個位元組)；已被其他程序鎖住時回傳 False"""
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+def unlock_file(lock_file):
+    if fcntl is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+    else:
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+class LeaderLock:
+    """確保所有 API 副本與 worker 之中只有一個程序在爬蟲。
+
+    Postgres 使用 session 層級的 advisory lock，鎖綁定在一條專用連線上，程序結束或連線中斷時自動釋放；
+    SQLite 使用檔案鎖 (flock；Windows 為 msvcrt.locking)。沒拿到鎖的程序每 LEADER_RETRY_SECONDS 秒重試一次，作為待命的接手者。
+    """
+    def __init__(self, key=LEADER_LOCK_KEY, path=LEADER_LOCK_PATH):
+        self.key = key
+        self.path = path
+        self._connection = None
+        self._file = None
+        self.acquired_at = None
+
+    @property
+    def held(self):
+        return self.acquired_at is not None
+
+    async def try_acquire(self):
+        if self.held:
+            return True
+        if engine.dialect.name == "postgresql":
+            connection = await engine.connect()
+            try:
+                await connection.execution_options(isolation_level="AUTOCOMMIT")
+                result = await connection.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": self.key})
+                locked = bool(result.scalar())
+            except Exception:
+                await connection.close()
+                raise
+            if not locked:
+                await connection.close()
+                return False
+            self._connection = connection
+        else:
+            lock_file = open(self.path, 'a+')
+            if not try_lock_file(lock_file):
+                lock_file.close()
+                return False
+            lock_file.seek(0)
+            lock_file.truncate()
+            lock_file.write(str(os.getpid()))
+            lock_file.flush()
+            self._file = lock_file
+        self.acquired_at = datetime.now(timezone.utc)
+        return True
+
+    async def acquire(self):
+        """阻塞直到取得鎖"""
+        waiting = False
+        while True:
+            try:
+                if await self.try_acquire():
+                    logger.info(f"[領導鎖] 已取得爬蟲領導權 (pid {os.getpid()})。")
+                    return
+            except Exception as e:
+                logger.warning(f"取得領導鎖時發生錯誤: {e}")
+            if not waiting:
+                logger.info(f"[領導鎖] 其他程序正在爬蟲，每 {LEADER_RETRY_SECONDS:g} 秒重試一次。")
+                waiting = True
+            await asyncio.sleep(LEADER_RETRY_SECONDS)
+
+    async def still_held(self):
+        """advisory lock 跟著連線存在；連線已斷就代表鎖可能已被別的程序取得"""
+        if not self.held:
+            return False
+        if self._connection is None:
+            return True
+        try:
+            await self._connection.execute(text("SELECT 1"))
+            return True
+        except Exception:
+            await self.release()
+            return False
+
+    async def release(self):
+        if self._connection is not None:
+            try:
+                await self._connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": self.key})
+            except Exception:
+                pass
+            try:
+                await self._connection.close()
+            except Exception:
+                pass
+            self._connection = None
+        if self._file is not None:
+            unlock_file(self._file)
+            self._file.close()
+            self._file = None
+        self.acquired_at = None
+
+    def stats(self):
+        return {
+            "held": self.held,
+            "acquired_at": self.acquired_at.isoformat() if self.acquired_at else None,
+            "backend": "advisory" if self._connection is not None or (engine is not None and engine.dialect.name == "postgresql") else "file",
+        }
+
+leader_lock = LeaderLock()
+
+# --- 自適應爬取排程 ---
+# 取得領導權後到第一輪爬取的等待；最新紀錄還很新時改為等到距離它 SCRAPE_MIN_INTERVAL 秒 (頻繁重啟時不會連續打 PTT)
+SCRAPE_STARTUP_DELAY = float(os.environ.get('SCRAPE_STARTUP_DELAY', '3'))
+SCRAPE_MIN_INTERVAL = float(os.environ.get('SCRAPE_MIN_INTERVAL', '60'))
+SCRAPE_MAX_INTERVAL = float(os.environ.get('SCRAPE_MAX_INTERVAL', '900'))
+# 間隔的隨機抖動比例 (±)，避免多個部署在同一時間打到 PTT
+SCRAPE_JITTER = float(os.environ.get('SCRAPE_JITTER', '0.1'))
+SCRAPE_BACKOFF_MAX = float(os.environ.get('SCRAPE_BACKOFF_MAX', '1800'))
+# 連續失敗幾輪後斷路，以及斷路後的冷卻時間 (秒)
+CIRCUIT_BREAKER_THRESHOLD = int(os.environ.get('CIRCUIT_BREAKER_THRESHOLD', '5'))
+CIRCUIT_BREAKER_COOLDOWN = float(os.environ.get('CIRCUIT_BREAKER_COOLDOWN', '1800'))
+# 新增推噓速度基準線的時間尺度 (小時)：遠長於一個深夜，冷清的時段不會在數小時內被當成常態
+ACTIVITY_HORIZON_HOURS = float(os.environ.get('SCRAPE_ACTIVITY_HORIZON_HOURS', '168'))
+
+class AdaptiveScrapeScheduler:
+    """決定下一輪爬取的時間。
+
+    成功時以 SCRAPE_INTERVAL_SECONDS 為目標：以兩輪之間新增推噓的速度 (PushWindows 收進的推文數差值，
+    已由文章快取去重，不受列表頁上文章輪替影響) 相對於長期基準線的比例調整間隔，
+    熱門時縮短、冷清時 (例如深夜) 拉長，限制在 SCRAPE_MIN_INTERVAL ~ SCRAPE_MAX_INTERVAL 之間，
+    再加上抖動並扣掉本輪已花的時間，讓紀錄的實際間隔接近計畫值。
+    失敗 (例外、PPI 為 None 或沒有任何文章成功) 時指數退避；連續失敗 CIRCUIT_BREAKER_THRESHOLD 次後斷路 (open)，
+    冷卻 CIRCUIT_BREAKER_COOLDOWN 秒後只試一輪 (half_open)，成功才恢復 (closed)，再失敗就繼續冷卻。
+    """
+    def __init__(self, target=SCRAPE_INTERVAL_SECONDS, min_interval=SCRAPE_MIN_INTERVAL, max_interval=SCRAPE_MAX_INTERVAL,
+                 jitter=SCRAPE_JITTER, backoff_max=SCRAPE_BACKOFF_MAX,
+                 failure_threshold=CIRCUIT_BREAKER_THRESHOLD, cooldown=CIRCUIT_BREAKER_COOLDOWN):
+        self.target = target
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.jitter = jitter
+        self.backoff_max = backoff_max
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.next_run_at = None
+        self.scheduled_at = None
+        self.last_interval = None
+        self.activity_ratio = 1.0
+        self._baseline_rate = None
+        self._samples = 0
+        self._last_ingested = None
+        self._last_success_at = None
 
-    print("背景任務：資料庫已就緒。將在 15 秒後開始第一次爬取...")
-    await asyncio.sleep(15)
+    def _schedule(self, delay):
+        self.scheduled_at = datetime.now(timezone.utc)
+        self.next_run_at = self.scheduled_at + timedelta(seconds=delay)
+        return delay
+
+    def _jittered(self, seconds):
+        return seconds * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def startup(self, latest_record_at=None):
+        delay = SCRAPE_STARTUP_DELAY
+        if latest_record_at is not None:
+            if latest_record_at.tzinfo is None:
+                latest_record_at = latest_record_at.replace(tzinfo=timezone.utc)
+            age = (datetime.now(timezone.utc) - latest_record_at).total_seconds()
+            delay = max(delay, min(self.min_interval - age, self.min_interval))
+        return self._schedule(delay)
+
+    def before_run(self):
+        if self.state == "open":
+            self.state = "half_open"
+            logger.info("[排程] 斷路器冷卻結束，試探性爬取一輪。")
+
+    def _update_activity(self, ingested):
+        """ingested 為累計收進的新推噓數 (只增不減)，與上次成功時相減即為期間內新增的推噓"""
+        now = time.monotonic()
+        if self._last_ingested is not None:
+            minutes = max((now - self._last_success_at) / 60, 1e-3)
+            rate = max(ingested - self._last_ingested, 0) / minutes
+            # 基準線是時間尺度 ACTIVITY_HORIZON_HOURS 的 EWMA，權重依本次間隔的實際秒數計算；
+            # 樣本還少時取累計平均，啟動後不會被第一個樣本主導
+            self._samples += 1
+            weight = max(1 - math.exp(-(now - self._last_success_at) / (ACTIVITY_HORIZON_HOURS * 3600)), 1 / self._samples)
+            if self._baseline_rate is None:
+                self._baseline_rate = rate
+            else:
+                self._baseline_rate += weight * (rate - self._baseline_rate)
+            self.activity_ratio = rate / self._baseline_rate if self._baseline_rate > 0 else 1.0
+        self._last_ingested = ingested
+        self._last_success_at = now
+
+    def record_success(self, cycle_seconds, ingested):
+        """回傳距離下一輪開始要等待的秒數"""
+        if self.state != "closed":
+            logger.info("[排程] 爬取恢復正常，斷路器關閉。")
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self._update_activity(ingested)
+        if self.activity_ratio > 0:
+            interval = self.target / self.activity_ratio
+        else:
+            interval = self.max_interval
+        interval = min(max(interval, self.min_interval), self.max_interval)
+        self.last_interval = interval
+        return self._schedule(max(self._jittered(interval) - cycle_seconds, 1.0))
+
+    def record_failure(self, cycle_seconds):
+        self.consecutive_failures += 1
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            if self.state != "open":
+                logger.warning(f"[排程] 連續失敗 {self.consecutive_failures} 次，斷路 {self.cooldown:g} 秒。")
+            self.state = "open"
+            delay = self.cooldown
+        else:
+            delay = min(self.min_interval * 2 ** (self.consecutive_failures - 1), self.backoff_max)
+        self.last_interval = delay
+        return self._schedule(self._jittered(delay))
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "next_run_at": self.next_run_at.isoformat() if self.next_run_at else None,
+            "last_interval_seconds": round(self.last_interval, 1) if self.last_interval is not None else None,
+            "activity_ratio": round(self.activity_ratio, 3),
+            "consecutive_failures": self.consecutive_failures,
+            "target_seconds": self.target,
+        }
+
+scrape_scheduler = AdaptiveScrapeScheduler()
+
+def scrape_activity():
+    """累計收進滑動視窗的新推噓數與本輪所有看板成功的文章數"""
+    articles = sum(stats["articles"] for stats in last_board_ppis.values())
+    return push_windows.ingested, articles
+
+# --- Background Task ---
+async def scrape_and_save_periodically():
+    """爬蟲主迴圈；資料庫需已初始化。只有持有領導鎖的程序會實際爬取與寫入"""
+    await leader_lock.acquire()
+    await asyncio.to_thread(article_cache.load)
+    await backfill_rollups()
+    asyncio.create_task(compact_periodically())
+    async with db_session("scrape_startup") as db:
+        newest = await latest_record(db)
+    delay = scrape_scheduler.startup(newest.timestamp if newest is not None else None)
+    logger.info(f"背景任務：已取得領導權。將在 {delay:g} 秒後開始第一次爬取...")
+    await asyncio.sleep(delay)
 
     while True:
+        if not await leader_lock.still_held():
+            logger.info("[領導鎖] 已失去領導權，暫停爬取並重新等待。")
+            await leader_lock.acquire()
+        scrape_scheduler.before_run()
+        started = time.perf_counter()
+        ppi = None
         try:
             ppi = await deep_scrape_ppi()
+        except Exception as e:
+            logger.exception(f"背景爬蟲任務主迴圈發生未知錯誤: {e}")
+        cycle_seconds = time.perf_counter() - started
+
+        ingested, articles = scrape_activity()
+        if ppi is None or articles == 0:
+            delay = scrape_scheduler.record_failure(cycle_seconds)
+        else:
+            delay = scrape_scheduler.record_success(cycle_seconds, ingested)
+
+        try:
             if ppi is not None and SessionLocal:
-                db = SessionLocal()
-                try:
-                    new_record = SentimentRecord(ppi=ppi, timestamp=datetime.now(timezone.utc))
+                async with db_session("scrape_insert") as db:
+                    new_record = SentimentRecord(ppi=ppi, engine=last_scrape_engine, timestamp=datetime.now(timezone.utc),
+                                                 **push_windows.ppis())
                     db.add(new_record)
-                    db.commit()
-                    print(f"PPI {ppi:.2f}% 已成功存入資料庫。")
-                finally:
-                    db.close()
+                    await update_rollups(db, new_record.timestamp, ppi)
+                    await db.flush()  # 取得 new_record.id 供逐篇觀測參照
+                    await save_observations(db, new_record.id, last_article_observations)
+                    await db.commit()
+                discount_snapshot.record_saved(new_record.id, ppi, new_record.timestamp)
+                startup_timeline.mark("first_scrape_saved")
+                logger.info(f"PPI {ppi:.2f}% ({last_scrape_engine}) 已成功存入資料庫。")
+                state = await discount_snapshot.get()
+                discount_broadcaster.publish(build_discount_payload(state))
         except Exception as e:
-            print(f"[重大錯誤] 背景爬蟲任務主迴圈發生未知錯誤: {e}")
-        
-        print(f"下一次爬取將在 3 分鐘後進行...")
-        await asyncio.sleep(180)
+            logger.exception(f"寫入爬取結果時發生未知錯誤: {e}")
+
+        logger.info(f"下一次爬取將在 {delay:.0f} 秒後進行 (排程狀態: {scrape_scheduler.state})...",
+                    extra={"delay_seconds": round(delay, 1), **scrape_scheduler.stats()})
+        await asyncio.sleep(delay)
+
+async def follow_database_changes():
+    """定期重新載入快照，把其他程序 (worker 或其他 API 副本) 寫入的新紀錄與設定推送給 SSE 訂閱者"""
+    while True:
+        await asyncio.sleep(SNAPSHOT_REFRESH_SECONDS)
+        try:
+            previous = discount_snapshot._state
+            state = await discount_snapshot.refresh()
+            # as_of 只在紀錄或設定變化時更新；本程序自己寫入的變化已經推送過
+            if previous is None or state["as_of"] != previous["as_of"]:
+                discount_broadcaster.publish(build_discount_payload(state))
+        except Exception as e:
+            logger.warning(f"重新載入折扣快照失敗: {e}")
+
+async def run_api_background():
+    logger.info("背景任務啟動，正在初始化資料庫...")
+    if not await initialize_database_with_retry():
+        logger.error("[背景任務終止] 因資料庫初始化失敗，背景任務無法繼續。")
+        return
+    try:
+        # 立即由資料庫載入快照，取代暖啟動狀態並通知已連線的 SSE 客戶端
+        state = await discount_snapshot.refresh()
+        discount_broadcaster.publish(build_discount_payload(state))
+    except Exception as e:
+        logger.warning(f"載入折扣快照失敗: {e}")
+    if APP_ROLE == "all":
+        asyncio.create_task(scrape_and_save_periodically())
+    await follow_database_changes()
+
+async def run_worker():
+    """獨立的爬蟲程序：python -m ptt_cli worker"""
+    logger.info("爬蟲 worker 啟動中，正在初始化資料庫...")
+    if not await initialize_database_with_retry():
+        logger.error("[worker 終止] 因資料庫初始化失敗，無法開始爬蟲。")
+        return 1
+    try:
+        await scrape_and_save_periodically()
+    finally:
+        await leader_lock.release()
+        await close_http_client()
+        await browser_pool.close()
+        await parse_stage.close()
+    return 0
+
+# --- 健康與就緒檢查 ---
+def health_report():
+    """各子系統狀態；只讀記憶體中的狀態，不查詢資料庫，資料庫初始化期間也能立即回應"""
+    if db_ready:
+        database = "ready"
+    else:
+        database = "failed" if db_init_error else "initializing"
+    state = discount_snapshot.peek()
+    subsystems = {
+        "database": {"status": database, "error": db_init_error,
+                     "dialect": engine.dialect.name if engine is not None else None},
+        "discount_snapshot": {"status": discount_snapshot.status(),
+                              "as_of": state["as_of"].isoformat() if state else None,
+                              "record_id": state["latest_record_id"] if state else None},
+        "parse_stage": {"status": "running" if parse_stage.stats()["started"] else "idle", "mode": parse_stage.mode},
+        "browser_pool": {"status": "running" if browser_pool.running else "idle"},
+        "stream": {"status": "ok", "subscribers": discount_broadcaster.stats()["subscribers"]},
+    }
+    if APP_ROLE == "all":
+        subsystems["scraper"] = {
+            "status": scrape_scheduler.state if leader_lock.held else "standby",
+            "leader": leader_lock.held,
+            "next_run_at": scrape_scheduler.next_run_at.isoformat() if scrape_scheduler.next_run_at else None,
+            "consecutive_failures": scrape_scheduler.consecutive_failures,
+            "last_engine": last_scrape_engine,
+        }
+    return {
+        "status": "ok" if db_ready else database,
+        "ready": db_ready,
+        "role": APP_ROLE,
+        "uptime_seconds": round(startup_timeline.uptime(), 3),
+        "startup": startup_timeline.stats(),
+        "subsystems": subsystems,
+    }
 
 # --- API Endpoints & Startup Event ---
 @app.on_event("startup")
 async def startup_event():
-    print("伺服器啟動中...")
-    print("正在排程背景初始化與爬蟲任務...")
-    asyncio.create_task(scrape_and_save_periodically())
-    print("伺服器已啟動，背景任務將在後台進行初始化。")
+    logger.info(f"伺服器啟動中 (角色: {APP_ROLE})...")
+    # 只讀一個小檔案；資料庫就緒前 /api/current-discount 先以它回應
+    discount_snapshot.restore()
+    logger.info("正在排程背景初始化任務...")
+    asyncio.create_task(run_api_background())
+    logger.info("伺服器已啟動，背景任務將在後台進行初始化。")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await leader_lock.release()
+    await close_http_client()
+    await browser_pool.close()
+    await parse_stage.close()
 
 @app.get("/")
 def read_root():
     return {"status": "PTT Discount Engine API is alive"}
 
+@app.get("/healthz")
+def healthz():
+    """存活檢查：內容為各子系統狀態與啟動時間軸。資料庫初始化期間仍回 200；
+    最近一次初始化失敗 (重試中或未設定 DATABASE_URL) 時回 503，讓平台的健康檢查可以重啟程序"""
+    report = health_report()
+    failed = report["subsystems"]["database"]["status"] == "failed"
+    return JSONResponse(report, status_code=503 if failed else 200, headers={"Cache-Control": "no-store"})
+
+@app.get("/readyz")
+def readyz():
+    """就緒檢查：資料庫初始化完成才回 200，否則 503 (內容與 /healthz 相同)"""
+    report = health_report()
+    return JSONResponse(report, status_code=200 if report["ready"] else 503, headers={"Cache-Control": "no-store"})
+
 @app.get("/api/current-discount")
-def get_current_discount():
+async def get_current_discount(request: Request):
     if not db_ready or SessionLocal is None:
+        if discount_snapshot.warm_state is None:
+            raise HTTPException(status_code=503, detail="服務正在初始化，請稍後再試。")
+        # 資料庫就緒前回應上次保存的狀態 (stale)，不讓瀏覽器或 CDN 快取
+        return JSONResponse(build_discount_payload(discount_snapshot.warm_state), headers={"Cache-Control": "no-store"})
+    state = await discount_snapshot.get()
+
+    async def build_body():
+        return build_discount_payload(state)
+
+    # next_scrape_at 在內容中：排程改變 (例如爬取失敗) 也要讓 If-Modified-Since 失效
+    last_modified = max(filter(None, (state["as_of"], scrape_scheduler.scheduled_at)))
+    return await conditional_json(request, build_body, discount_etag(state, include_schedule=True),
+                                  last_modified, seconds_until_next_scrape(state))
+
+@app.post("/api/discount-code")
+async def issue_discount_code():
+    """簽發結帳折扣碼：內含目前折扣、簽發時間與來源紀錄 id，有效 CODE_TTL_SECONDS 秒"""
+    if db_ready and SessionLocal is not None:
+        state = await discount_snapshot.get()
+    else:
+        state = discount_snapshot.warm_state
+    if state is None or state["ppi_record_id"] is None:
         raise HTTPException(status_code=503, detail="服務正在初始化，請稍後再試。")
-    
-    db = SessionLocal()
+    discount = calculate_discount(state["ppi"], state["settings"])
+    issued_at = int(time.time())
     try:
-        print("[API] /api/current-discount 被呼叫")
-        settings_query = db.query(DiscountSetting).all()
-        settings = {s.setting_name: s.setting_value for s in settings_query}
-        
-        base_discount = settings.get("base_discount", 5.0)
-        ppi_threshold = settings.get("ppi_threshold", 70.0)
-        conversion_factor = settings.get("conversion_factor", 0.5)
-        discount_cap = settings.get("discount_cap", 25.0)
+        code = ptt_codes.issue(code_signing_key, discount, state["ppi_record_id"], issued_at)
+    except ValueError:
+        # 更新前就存在資料庫中的設定可能超出範圍 (/api/update-settings 現在會拒絕這類設定)
+        raise HTTPException(status_code=409, detail=f"目前折扣 {discount:g}% 超出折扣碼可表示的 0% ~ 100%，請先修正折扣設定。")
+    CODES_ISSUED.inc()
+    return JSONResponse({
+        "code": code,
+        "discount_percentage": round(discount, 2),
+        "record_id": state["ppi_record_id"],
+        "issued_at": issued_at,
+        "expires_at": issued_at + CODE_TTL_SECONDS,
+        "ttl_seconds": CODE_TTL_SECONDS,
+    }, headers={"Cache-Control": "no-store"})
 
-        # [FIX] 改為使用 ID 排序，確保永遠抓到最新一筆
-        latest_record = db.query(SentimentRecord).order_by(SentimentRecord.id.desc()).first()
-        
-        ppi_for_calculation = 0.0
-        if latest_record:
-            ppi_for_calculation = latest_record.ppi
-            print(f"[API] 找到最新一筆 PPI (ID: {latest_record.id}): {ppi_for_calculation:.2f}%")
-            
-            if ppi_for_calculation == 0.0:
-                print("[API] 最新 PPI 為 0，正在嘗試回溯...")
-                # [FIX] 回溯時也使用 ID 排序
-                fallback_record = db.query(SentimentRecord).filter(SentimentRecord.ppi > 0).order_by(SentimentRecord.id.desc()).first()
-                if fallback_record:
-                    ppi_for_calculation = fallback_record.ppi
-                    print(f"[API] 已成功回溯，使用最後一筆有效 PPI (ID: {fallback_record.id}): {ppi_for_calculation:.2f}%")
-                else:
-                    print("[API] 資料庫中無任何有效歷史數據，PPI 將使用 0。")
-        else:
-            print("[API] 資料庫中尚無任何數據，PPI 將使用 0。")
+@app.post("/api/verify-code")
+async def verify_code(request: CodeVerification):
+    """驗證 (並預設登記使用) 折扣碼；只用簽章與記憶體中的最近折扣環，不查詢資料庫。
 
-        extra_discount = 0
-        if ppi_for_calculation < ppi_threshold:
-            extra_discount = (ppi_threshold - ppi_for_calculation) * conversion_factor
-        
-        final_discount = base_discount + extra_discount
-        final_discount = min(final_discount, discount_cap)
+    已使用的碼記在本程序的記憶體中，多個 API 副本時結帳端必須固定打同一個副本驗證。
+    """
+    if (request.code is None) == (request.codes is None):
+        raise HTTPException(status_code=400, detail="請指定 code 或 codes 其中之一。")
+    if request.codes is not None and len(request.codes) > CODE_VERIFY_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"一次最多驗證 {CODE_VERIFY_BATCH_MAX} 個碼。")
+    now = time.time()
+    if request.code is not None:
+        result = code_verifier.verify(request.code.strip(), now, request.consume)
+        CODE_VERIFICATIONS.labels(result["reason"] or "valid").inc()
+        return JSONResponse(result, headers={"Cache-Control": "no-store"})
+    results = [code_verifier.verify(code.strip(), now, request.consume) for code in request.codes]
+    outcomes = {}
+    for result in results:
+        key = result["reason"] or "valid"
+        outcomes[key] = outcomes.get(key, 0) + 1
+    for key, count in outcomes.items():
+        CODE_VERIFICATIONS.labels(key).inc(count)
+    return JSONResponse({"results": results, "valid": outcomes.get("valid", 0)}, headers={"Cache-Control": "no-store"})
 
-        return {
-            "current_ppi": round(ppi_for_calculation, 2),
-            "final_discount_percentage": round(final_discount, 2),
-            "settings": settings
-        }
-    finally:
-        db.close()
+@app.get("/api/get-settings")
+async def get_settings():
+    if not db_ready or SessionLocal is None:
+        raise HTTPException(status_code=503, detail="服務正在初始化，請稍後再試。")
+    return (await discount_snapshot.get())["settings"]
+
+@app.post("/api/update-settings")
+async def update_settings(update: SettingsUpdate):
+    if not db_ready or SessionLocal is None:
+        raise HTTPException(status_code=503, detail="服務正在初始化，請稍後再試。")
+    if not hmac.compare_digest(update.secret_key, ADMIN_SECRET_KEY):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="管理密碼錯誤。")
+
+    new_values = {
+        "base_discount": update.base_discount,
+        "ppi_threshold": update.ppi_threshold,
+        "conversion_factor": update.conversion_factor,
+    }
+    if update.discount_cap is not None:
+        new_values["discount_cap"] = update.discount_cap
+    # 折扣碼只能表示 0% ~ 100% 的折扣：各項限制在此範圍內，最終折扣 min(基本 + 加碼, 上限) 也就不會超出
+    for key, value in new_values.items():
+        low, high = SETTING_BOUNDS[key]
+        if not math.isfinite(value) or not low <= value <= high:
+            raise HTTPException(status_code=400, detail=f"{key} 必須介於 {low:g} 與 {high:g} 之間。")
+
+    async with db_session("update_settings") as db:
+        for key, value in new_values.items():
+            await db.merge(DiscountSetting(setting_name=key, setting_value=value))
+        await db.commit()
+        settings = await load_settings(db)
+
+    discount_snapshot.settings_changed(settings)
+    discount_broadcaster.publish(build_discount_payload(await discount_snapshot.get()))
+    logger.info(f"[API] 折扣設定已更新: {new_values}")
+    return {"status": "success", "settings": settings}
+
+@app.get("/api/scraper-status")
+async def get_scraper_status():
+    return {
+        "role": APP_ROLE,
+        "leader": leader_lock.stats(),
+        "scheduler": scrape_scheduler.stats(),
+        "compaction": record_compactor.stats(),
+        "ppi_windows": {key: round(value, 2) if value is not None else None for key, value in push_windows.ppis().items()},
+        "push_windows": push_windows.stats(),
+        "engine_mode": SCRAPE_ENGINE,
+        "last_engine": last_scrape_engine,
+        "boards": last_board_ppis,
+        "browser_pool": browser_pool.stats(),
+        "parse_stage": parse_stage.stats(),
+        "article_cache": article_cache.stats(),
+        "discount_snapshot": discount_snapshot.stats(),
+        "discount_codes": code_verifier.stats(),
+        "stream": discount_broadcaster.stats(),
+    }
+
+def collect_gauges():
+    SSE_SUBSCRIBERS.set(discount_broadcaster.stats()["subscribers"])
+    ARTICLE_CACHE_ENTRIES.set(article_cache.stats()["entries"])
+    LEADER.set(1 if leader_lock.held else 0)
+    if scrape_scheduler.next_run_at is not None:
+        NEXT_SCRAPE_TIMESTAMP.set(scrape_scheduler.next_run_at.timestamp())
+    SCRAPE_CONSECUTIVE_FAILURES.set(scrape_scheduler.consecutive_failures)
+    PARSE_QUEUE_DEPTH.set(parse_stage.depth)
+    CODE_REPLAY_ENTRIES.set(len(code_verifier.replay))
+
+REGISTRY.add_collector(collect_gauges)
+
+@app.get("/metrics")
+def get_metrics():
+    return Response(REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
 
 @app.get("/api/history")
-def get_history(timescale: str = "realtime"):
+async def get_history(request: Request, timescale: str = "realtime", start: Optional[datetime] = None,
+                end: Optional[datetime] = None, max_points: int = HISTORY_MAX_POINTS):
+    """realtime 回傳最近一小時的原始紀錄；hour/day/week/month 或 start/end 區間由時間桶彙總回答"""
     if not db_ready or SessionLocal is None:
         raise HTTPException(status_code=503, detail="服務正在初始化，請稍後再試。")
-    
-    db = SessionLocal()
+    if start is None and timescale != "realtime" and timescale not in HISTORY_WINDOWS:
+        raise HTTPException(status_code=400, detail=f"不支援的 timescale: {timescale}")
+    max_points = max(1, min(max_points, HISTORY_MAX_POINTS))
+    start, end = to_utc(start), to_utc(end)
+    if start is not None and end is not None and start >= end:
+        raise HTTPException(status_code=400, detail="start 必須早於 end。")
+
+    # 指定區間的歷史數據只會在新紀錄寫入時改變，驗證標頭取自最新紀錄；
+    # 相對於現在的視窗還會隨時間滑動，結尾對齊到 HISTORY_WINDOW_STEP 並納入 ETag，舊的點滑出視窗後不會再回 304
+    state = await discount_snapshot.get()
+    etag_prefix = "h"
+    last_modified = state["latest_record_at"] or state["as_of"]
+    max_age = seconds_until_next_scrape(state)
+    window_end = None
+    if start is None and (end is None or timescale == "realtime"):
+        now = time.time()
+        window_epoch = int(now) // HISTORY_WINDOW_STEP * HISTORY_WINDOW_STEP
+        window_end = datetime.fromtimestamp(window_epoch, tz=timezone.utc)
+        etag_prefix = f"h{window_epoch}-"
+        last_modified = max(to_utc(last_modified), window_end)
+        max_age = min(max_age, max(int(window_epoch + HISTORY_WINDOW_STEP - now), 0))
+
+    async def build_body():
+        points = await load_history(timescale, start, end, max_points, window_end)
+        # 以目前設定換算每個點的折扣 (ETag 已包含設定版本)，前端不必再自行實作公式
+        for point in points:
+            point["discount"] = round(calculate_discount(point["ppi"], state["settings"]), 2)
+        return points
+
+    return await conditional_json(request, build_body, discount_etag(state, prefix=etag_prefix), last_modified, max_age)
+
+async def load_history(timescale, start, end, max_points, now=None):
+    """now 為相對視窗的結尾 (預設為目前時間)"""
+    now = now or datetime.now(timezone.utc)
+    async with db_session(f"history_{timescale}" if start is None else "history_range") as db:
+        if start is None and timescale == "realtime":
+             # 時間相同時以 id 排序；(timestamp, id) 的順序可直接由 ix_sentiment_records_timestamp 提供，不必掃描全表
+             one_hour_ago = now - timedelta(hours=1)
+             result = await db.execute(select(SentimentRecord.timestamp, SentimentRecord.ppi).where(
+                 SentimentRecord.timestamp >= one_hour_ago).order_by(SentimentRecord.timestamp.asc(), SentimentRecord.id.asc()))
+             return [{"timestamp": to_utc(timestamp).isoformat(), "ppi": ppi} for timestamp, ppi in result]
+
+        end = to_utc(end) or now
+        start = to_utc(start) or end - HISTORY_WINDOWS[timescale]
+        return await query_rollup_history(db, start, end, max_points)
+
+# --- 大量匯出 ---
+EXPORT_CHUNK_ROWS = int(os.environ.get('EXPORT_CHUNK_ROWS', '5000'))
+EXPORT_RECORD_COLUMNS = ("timestamp", "ppi", "ppi_5m", "ppi_15m", "ppi_60m", "engine")
+EXPORT_ROLLUP_COLUMNS = ("bucket_start", "bucket_seconds", "count", "ppi_mean", "ppi_min", "ppi_max")
+
+def export_query(dataset: str, start: Optional[datetime], end: Optional[datetime], bucket_seconds: int):
+    """回傳 (欄位名稱, 查詢, 由資料列取出 (epoch 毫秒, PPI) 的函式)"""
+    if dataset == "records":
+        query = select(SentimentRecord.timestamp, SentimentRecord.ppi, SentimentRecord.ppi_5m,
+                       SentimentRecord.ppi_15m, SentimentRecord.ppi_60m, SentimentRecord.engine)
+        if start is not None:
+            query = query.where(SentimentRecord.timestamp >= start)
+        if end is not None:
+            query = query.where(SentimentRecord.timestamp < end)
+        return EXPORT_RECORD_COLUMNS, query.order_by(SentimentRecord.timestamp.asc()), lambda row: (ptt_export.epoch_millis(row[0]), row[1])
+
+    query = select(SentimentRollup.bucket_start, SentimentRollup.bucket_seconds, SentimentRollup.count,
+                   (SentimentRollup.ppi_sum / SentimentRollup.count).label("ppi_mean"),
+                   SentimentRollup.ppi_min, SentimentRollup.ppi_max).where(SentimentRollup.bucket_seconds == bucket_seconds)
+    if start is not None:
+        start_epoch = to_epoch(start)
+        query = query.where(SentimentRollup.bucket_start >= start_epoch - start_epoch % bucket_seconds)
+    if end is not None:
+        query = query.where(SentimentRollup.bucket_start < to_epoch(end))
+    return EXPORT_ROLLUP_COLUMNS, query.order_by(SentimentRollup.bucket_start.asc()), lambda row: (row[0] * 1000, row[3])
+
+async def stream_export(dataset: str, fmt: str, columns, query, to_sample):
+    """以伺服器端游標每次取出 EXPORT_CHUNK_ROWS 列，編碼後立即送出；記憶體用量與區間長度無關"""
+    if fmt == "binary":
+        yield ptt_export.binary_header()
+    elif fmt == "csv":
+        yield ptt_export.csv_chunk(columns, (), header=True)
+    exported = 0
     try:
-        if timescale == "realtime":
-             # [FIX] 使用 ID 排序來確保拿到的是最新的數據
-             one_hour_ago = datetime.now(timezone.utc) - timedelta(hours=1)
-             records = db.query(SentimentRecord).filter(SentimentRecord.timestamp >= one_hour_ago).order_by(SentimentRecord.id.asc()).all()
-             return [{"timestamp": r.timestamp.isoformat(), "ppi": r.ppi} for r in records]
-        
-        # ... (其餘彙總邏輯不變)
-        
+        async with db_session(f"export_{dataset}") as db:
+            result = await db.stream(query.execution_options(yield_per=EXPORT_CHUNK_ROWS))
+            async for rows in result.partitions():
+                if fmt == "binary":
+                    yield ptt_export.binary_chunk(map(to_sample, rows))
+                elif fmt == "csv":
+                    yield ptt_export.csv_chunk(columns, rows)
+                else:
+                    yield ptt_export.ndjson_chunk(columns, rows)
+                exported += len(rows)
     finally:
-        db.close()
+        EXPORT_ROWS.labels(dataset, fmt).inc(exported)
+    if fmt == "binary":
+        yield ptt_export.binary_terminator()
+
+@app.get("/api/export")
+async def export_history(dataset: str = "records", format: str = "csv", timescale: Optional[str] = None,
+                         start: Optional[datetime] = None, end: Optional[datetime] = None,
+                         bucket_seconds: int = ROLLUP_LEVELS[0]):
+    """串流匯出原始紀錄 (records) 或彙總時間桶 (rollups)；未指定區間時匯出全部資料。
+    format 為 csv、ndjson 或 binary (見 ptt_export 的格式說明，只含時間與 PPI 兩欄)"""
+    if not db_ready or SessionLocal is None:
+        raise HTTPException(status_code=503, detail="服務正在初始化，請稍後再試。")
+    if dataset not in ("records", "rollups"):
+        raise HTTPException(status_code=400, detail=f"不支援的 dataset: {dataset}")
+    if format not in ptt_export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"不支援的 format: {format}")
+    if dataset == "rollups" and bucket_seconds not in ROLLUP_LEVELS:
+        raise HTTPException(status_code=400, detail=f"bucket_seconds 必須是 {', '.join(map(str, ROLLUP_LEVELS))} 其中之一。")
+    start, end = to_utc(start), to_utc(end)
+    if start is None and timescale is not None:
+        if timescale not in HISTORY_WINDOWS:
+            raise HTTPException(status_code=400, detail=f"不支援的 timescale: {timescale}")
+        end = end or datetime.now(timezone.utc)
+        start = end - HISTORY_WINDOWS[timescale]
+    if start is not None and end is not None and start >= end:
+        raise HTTPException(status_code=400, detail="start 必須早於 end。")
+
+    columns, query, to_sample = export_query(dataset, start, end, bucket_seconds)
+    media_type, extension = ptt_export.FORMATS[format]
+    return StreamingResponse(stream_export(dataset, format, columns, query, to_sample), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="ptt-sentiment-{dataset}.{extension}"',
+                                      "Cache-Control": "no-store"})
+
+# --- 逐篇觀測 ---
+@app.get("/api/observations")
+async def get_observations(record_id: Optional[int] = None):
+    """某一輪 (預設為最新一筆紀錄) 的逐篇觀測，以及由觀測重算的 PPI，用來檢查異常的讀數"""
+    if not db_ready or SessionLocal is None:
+        raise HTTPException(status_code=503, detail="服務正在初始化，請稍後再試。")
+    async with db_session("observations") as db:
+        record = await db.get(SentimentRecord, record_id) if record_id is not None else await latest_record(db)
+        if record is None:
+            raise HTTPException(status_code=404, detail="找不到紀錄。")
+        observed = (await db.execute(observed_ppi_query().where(ArticleObservation.record_id == record.id))).first()
+        result = await db.execute(select(
+            Article.board, Article.article_id, Article.title, ArticleObservation.push, ArticleObservation.boo,
+            ArticleObservation.neutral, ArticleObservation.fetch_ms, ArticleObservation.mode,
+        ).join(Article, Article.id == ArticleObservation.article_ref)
+         .where(ArticleObservation.record_id == record.id).order_by(ArticleObservation.seq))
+        articles = [{"board": board, "article_id": article_id, "title": title, "push": push, "boo": boo,
+                     "neutral": neutral, "fetch_ms": fetch_ms, "mode": OBSERVATION_MODES[mode]}
+                    for board, article_id, title, push, boo, neutral, fetch_ms, mode in result]
+    return {
+        "record_id": record.id,
+        "timestamp": to_utc(record.timestamp).isoformat(),
+        "engine": record.engine,
+        "ppi": record.ppi,
+        "observed_ppi": observed.ppi if observed is not None else None,
+        "articles": articles,
+    }
+
+# --- What-if 模擬 ---
+SIMULATION_MAX_COMBINATIONS = int(os.environ.get('SIMULATION_MAX_COMBINATIONS', '1000'))
+SIMULATION_MAX_BINS = 100
+
+async def load_ppi_history(start: datetime, end: datetime):
+    """區間內的原始紀錄，回傳 (epoch 秒陣列, PPI 陣列)"""
+    import numpy as np
+    async with db_session("simulation_history") as db:
+        result = await db.execute(select(SentimentRecord.timestamp, SentimentRecord.ppi).where(
+            SentimentRecord.timestamp >= start, SentimentRecord.timestamp < end).order_by(SentimentRecord.timestamp.asc()))
+        rows = result.all()
+    timestamps = np.fromiter((to_epoch(timestamp) for timestamp, _ in rows), dtype=np.float64, count=len(rows))
+    ppi = np.fromiter((value or 0.0 for _, value in rows), dtype=np.float64, count=len(rows))
+    return timestamps, ppi
+
+@app.post("/api/simulate-settings")
+async def simulate_settings(request: SimulationRequest):
+    """以歷史 PPI 模擬多組候選折扣設定 (NumPy 向量化)，回傳每組的統計與直方圖"""
+    if not db_ready or SessionLocal is None:
+        raise HTTPException(status_code=503, detail="服務正在初始化，請稍後再試。")
+    if not hmac.compare_digest(request.secret_key, ADMIN_SECRET_KEY):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="管理密碼錯誤。")
+    if request.start is None and request.timescale not in HISTORY_WINDOWS:
+        raise HTTPException(status_code=400, detail=f"不支援的 timescale: {request.timescale}")
+    if not 1 <= request.histogram_bins <= SIMULATION_MAX_BINS:
+        raise HTTPException(status_code=400, detail=f"histogram_bins 必須介於 1 與 {SIMULATION_MAX_BINS} 之間。")
+
+    try:
+        import ptt_simulator
+    except ImportError:
+        raise HTTPException(status_code=503, detail="模擬需要 numpy，請先安裝 requirements.txt。")
+    current = (await discount_snapshot.get())["settings"]
+    candidates = {}
+    for key in ptt_simulator.SETTING_KEYS:
+        values = getattr(request, key)
+        candidates[key] = sorted(set(values)) if values else [current.get(key, DEFAULT_SETTINGS[key])]
+    combinations = 1
+    for values in candidates.values():
+        combinations *= len(values)
+    if combinations > SIMULATION_MAX_COMBINATIONS:
+        raise HTTPException(status_code=400, detail=f"候選設定組合數 {combinations} 超過上限 {SIMULATION_MAX_COMBINATIONS}。")
+    series_settings = None
+    if request.series_settings is not None:
+        series_settings = {key: request.series_settings.get(key, current.get(key, DEFAULT_SETTINGS[key]))
+                           for key in ptt_simulator.SETTING_KEYS}
+
+    end = to_utc(request.end) or datetime.now(timezone.utc)
+    start = to_utc(request.start) or end - HISTORY_WINDOWS[request.timescale]
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start 必須早於 end。")
+    timestamps, ppi = await load_ppi_history(start, end)
+
+    def run():
+        started = time.perf_counter()
+        filled_timestamps, filled_ppi = ptt_simulator.forward_fill_invalid(timestamps, ppi)
+        result = ptt_simulator.simulate(filled_timestamps, filled_ppi, candidates, bins=request.histogram_bins,
+                                        max_gap=SCRAPE_MAX_INTERVAL)
+        if series_settings is not None:
+            series = ptt_simulator.discount_series(filled_ppi, series_settings)
+            result["series"] = {
+                "settings": series_settings,
+                "timestamps": [datetime.fromtimestamp(ts, timezone.utc).isoformat() for ts in filled_timestamps.tolist()],
+                "discount": [round(value, 4) for value in series.tolist()],
+            }
+        result["compute_seconds"] = round(time.perf_counter() - started, 4)
+        return result
+
+    result = await asyncio.to_thread(run)
+    result.update(start=start.isoformat(), end=end.isoformat(), current_settings=current)
+    return result
+
+@app.get("/api/stream")
+async def stream_discount(request: Request, last_event_id: Optional[int] = None):
+    """以 SSE 推送折扣更新；重連時依 Last-Event-ID 標頭 (或 last_event_id 參數) 補送錯過的事件"""
+    header_id = request.headers.get('last-event-id')
+    if header_id and header_id.isdigit():
+        last_event_id = int(header_id)
+
+    queue, missed = discount_broadcaster.subscribe(last_event_id)
+    initial = None
+    if not missed and last_event_id != discount_broadcaster.last_event_id:
+        # 新連線或 id 已不在緩衝區內：先送一次目前狀態 (資料庫就緒前為暖啟動狀態，就緒後會再推送一次)
+        if db_ready and SessionLocal is not None:
+            state = await discount_snapshot.get()
+        else:
+            state = discount_snapshot.warm_state
+        if state is not None:
+            initial = DiscountBroadcaster.format_event(discount_broadcaster.last_event_id, build_discount_payload(state))
+
+    async def event_stream():
+        try:
+            for message in missed:
+                yield message
+            if initial is not None:
+                yield initial
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                if message is None:
+                    break
+                yield message
+        finally:
+            discount_broadcaster.unsubscribe(queue)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+startup_timeline.mark("import_done")
 
-# ... (其餘 API 和 WebSocket 邏輯與之前版本相同)
+if __name__ == "__main__":
+    # 相容舊的 python -m ptt_backend <指令>：改由輕量的 ptt_cli 重新啟動本程序，
+    # 否則解析程序池的每個子程序都會把整個後端當作 __main__ 重新匯入
+    os.execv(sys.executable, [sys.executable, "-m", "ptt_cli", *sys.argv[1:]])
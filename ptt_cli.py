@@ -0,0 +1,36 @@
+"""命令列入口：python -m ptt_cli [api|worker|maintenance]
+
+python -m ptt_cli worker：只跑爬蟲；python -m ptt_cli api：只跑 API (可多副本水平擴充)
+python -m ptt_cli maintenance [--report-only]：建立索引、壓縮過期資料並輸出維護報告
+
+本模組刻意不在頂層匯入 ptt_backend：解析程序池 (ptt_backend.ParseStage) 以 forkserver/spawn
+建立子程序時，每個子程序都會重新匯入 __main__，入口保持輕量，子程序才只需要匯入 ptt_parser。
+"""
+import asyncio
+import os
+import sys
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    command = argv[0] if argv else "api"
+    if command == "worker":
+        from ptt_backend import run_worker
+        try:
+            return asyncio.run(run_worker())
+        except KeyboardInterrupt:
+            return 0
+    if command == "maintenance":
+        from ptt_backend import run_maintenance
+        return asyncio.run(run_maintenance(report_only="--report-only" in argv[1:]))
+    if command == "api":
+        import uvicorn
+        os.environ['APP_ROLE'] = 'api'
+        uvicorn.run("ptt_backend:app", host=os.environ.get('HOST', '0.0.0.0'), port=int(os.environ.get('PORT', '8080')),
+                    workers=int(os.environ.get('WEB_CONCURRENCY', '1')))
+        return 0
+    return f"未知的指令: {command} (可用: worker, api, maintenance)"
+
+
+if __name__ == "__main__":
+    sys.exit(main())
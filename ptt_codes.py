@@ -0,0 +1,189 @@
+"""結帳折扣碼：由伺服器簽發、以 HMAC 驗證，驗證時不查詢資料庫。
+
+碼的內容 (20 位元組，以 Base32 編碼成 32 個字元，前面加上 "MILK")：
+    "<BHII3s"  版本 1、折扣 (萬分比，即百分比 x 100)、簽發時間 (epoch 秒)、來源 SentimentRecord id、3 位元組序號
+    6 位元組   HMAC-SHA256(key, 前 14 位元組) 的前 6 位元組
+序號在每個程序內從隨機值起算遞增，同一秒、同一筆紀錄簽發的碼也不會相同 (用亂數在尖峰時段會碰撞)。
+Base32 只有大寫字母與數字，條碼掃描器以鍵盤模式輸入時不受大小寫鎖定影響 (解碼時不分大小寫)。
+
+CodeVerifier.verify 依序檢查格式與簽章、有效時間、來源紀錄與折扣是否出現在最近的折扣環 (RecentDiscounts)，
+最後在 ReplayCache 登記使用；全部都是記憶體內的運算，單一程序每秒可驗證數萬個碼。
+"""
+import base64
+import binascii
+import heapq
+import hmac
+import itertools
+import os
+import struct
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+PREFIX = "MILK"
+VERSION = 1
+_BODY = struct.Struct("<BHII3s")
+MAC_BYTES = 6
+CODE_LENGTH = len(PREFIX) + (_BODY.size + MAC_BYTES) * 8 // 5
+MAX_DISCOUNT_BP = 10000
+_sequence = itertools.count(int.from_bytes(os.urandom(3), "little"))
+
+
+def derive_key(secret: str):
+    """由設定的密鑰衍生簽章用的金鑰，不直接拿管理密碼當 HMAC 金鑰"""
+    return hmac.digest(secret.encode("utf-8"), b"ptt-discount-code", "sha256")
+
+
+def discount_bp(discount_percentage):
+    return round(discount_percentage * 100)
+
+
+def _mac(key, body):
+    return hmac.digest(key, body, "sha256")[:MAC_BYTES]
+
+
+def issue(key, discount_percentage, record_id, issued_at=None):
+    bp = discount_bp(discount_percentage)
+    if not 0 <= bp <= MAX_DISCOUNT_BP:
+        raise ValueError(f"折扣 {discount_percentage} 超出範圍")
+    issued_at = int(time.time()) if issued_at is None else int(issued_at)
+    nonce = (next(_sequence) & 0xFFFFFF).to_bytes(3, "little")
+    body = _BODY.pack(VERSION, bp, issued_at, record_id, nonce)
+    return PREFIX + base64.b32encode(body + _mac(key, body)).decode("ascii")
+
+
+class DecodedCode(NamedTuple):
+    discount_bp: int
+    issued_at: int
+    record_id: int
+    token: bytes  # 解碼後的 20 位元組，作為重複使用檢查的鍵
+
+
+def decode(key, code: str):
+    """格式或簽章不符時回傳 (原因, None)，否則回傳 (None, DecodedCode)"""
+    if len(code) != CODE_LENGTH or code[:len(PREFIX)].upper() != PREFIX:
+        return "malformed", None
+    try:
+        token = base64.b32decode(code[len(PREFIX):], casefold=True)
+    except (binascii.Error, ValueError):
+        return "malformed", None
+    body = token[:_BODY.size]
+    if not hmac.compare_digest(token[_BODY.size:], _mac(key, body)):
+        return "bad_signature", None
+    version, bp, issued_at, record_id, _ = _BODY.unpack(body)
+    if version != VERSION:
+        return "malformed", None
+    return None, DecodedCode(bp, issued_at, record_id, token)
+
+
+class RecentDiscounts:
+    """最近 size 筆有效 PPI 紀錄與它們曾經對應的折扣 (萬分比)。
+
+    折扣同時取決於 PPI 與當時的設定，設定變更時同一筆紀錄會對應多個折扣，都視為當時確實提供過的折扣。
+    """
+    def __init__(self, size):
+        self.size = size
+        self._records = OrderedDict()  # record_id -> (ppi, {折扣萬分比, ...})
+
+    def observe(self, record_id, ppi, discount_percentage):
+        entry = self._records.get(record_id)
+        if entry is None:
+            entry = self._records[record_id] = (ppi, set())
+            while len(self._records) > self.size:
+                self._records.popitem(last=False)
+        entry[1].add(discount_bp(discount_percentage))
+
+    def lookup(self, record_id):
+        return self._records.get(record_id)
+
+    def stats(self):
+        return {
+            "records": len(self._records),
+            "size": self.size,
+            "oldest_record_id": next(iter(self._records), None),
+            "newest_record_id": next(reversed(self._records), None),
+        }
+
+
+class ReplayCache:
+    """已使用的碼保留到各自的有效期限為止，以最小堆依到期時間清除。
+
+    容量用盡時拒絕新的使用 (fail closed)，不會為了騰出空間而提早淘汰未到期的碼，否則被淘汰的碼可以再用一次。
+    """
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._expires = {}
+        self._heap = []
+        self.rejected_full = 0
+
+    def _prune(self, now):
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            _, token = heapq.heappop(heap)
+            del self._expires[token]
+
+    def seen(self, token, now):
+        self._prune(now)
+        return token in self._expires
+
+    def claim(self, token, expires_at, now):
+        """回傳 None (登記成功)、"replayed" 或 "replay_cache_full\""""
+        self._prune(now)
+        if token in self._expires:
+            return "replayed"
+        if len(self._expires) >= self.max_entries:
+            self.rejected_full += 1
+            return "replay_cache_full"
+        self._expires[token] = expires_at
+        heapq.heappush(self._heap, (expires_at, token))
+        return None
+
+    def __len__(self):
+        return len(self._expires)
+
+    def stats(self):
+        return {"entries": len(self._expires), "max_entries": self.max_entries, "rejected_full": self.rejected_full}
+
+
+class CodeVerifier:
+    """簽章 + 有效時間 + 最近折扣環 + 重複使用檢查；只在事件迴圈 (單一執行緒) 上呼叫"""
+    def __init__(self, key, ttl, recent, replay, skew=5):
+        self.key = key
+        self.ttl = ttl
+        self.recent = recent
+        self.replay = replay
+        self.skew = skew
+        self.results = {}
+
+    def verify(self, code, now=None, consume=True):
+        now = time.time() if now is None else now
+        reason, decoded = decode(self.key, code)
+        result = {"code": code, "valid": False, "reason": reason}
+        if decoded is not None:
+            expires_at = decoded.issued_at + self.ttl
+            result.update(discount_percentage=decoded.discount_bp / 100, record_id=decoded.record_id,
+                          issued_at=decoded.issued_at, expires_at=expires_at)
+            entry = self.recent.lookup(decoded.record_id)
+            if decoded.issued_at > now + self.skew:
+                reason = "not_yet_valid"
+            elif now > expires_at + self.skew:
+                reason = "expired"
+            elif entry is None:
+                reason = "unknown_record"
+            elif decoded.discount_bp not in entry[1]:
+                reason = "discount_mismatch"
+            elif consume:
+                reason = self.replay.claim(decoded.token, expires_at + self.skew, now)
+            elif self.replay.seen(decoded.token, now):
+                reason = "replayed"
+            if entry is not None:
+                result["ppi"] = entry[0]
+            result["valid"] = reason is None
+            result["reason"] = reason
+        key = reason or "valid"
+        self.results[key] = self.results.get(key, 0) + 1
+        return result
+
+    def stats(self):
+        return {"ttl_seconds": self.ttl, "results": dict(self.results),
+                "recent_discounts": self.recent.stats(), "replay_cache": self.replay.stats()}
@@ -0,0 +1,129 @@
+"""歷史資料匯出的編碼器：CSV、NDJSON 與精簡的二進位欄式格式。
+
+每個函式只處理一批資料列，由呼叫端以伺服器端游標逐批取出再逐批送出，記憶體用量與匯出區間長度無關。
+
+二進位格式 (小端序)：
+    檔頭  "<4sBBH"  magic b"PTTS"、版本 1、保留欄位
+    區塊  "<Iq"     樣本數 n、第一個樣本的 epoch 毫秒
+          n 個 uint32  與前一個樣本的毫秒差 (第一個為 0)
+          n 個 float32 PPI (沒有值時為 NaN)
+    結尾  n = 0 的區塊
+時間差超過 uint32 範圍 (約 49 天) 時會另起一個區塊。
+"""
+import csv
+import io
+import json
+import math
+import struct
+import sys
+from array import array
+from datetime import datetime, timezone
+
+FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "binary": ("application/vnd.ptt-sentiment", "bin"),
+}
+
+BINARY_MAGIC = b"PTTS"
+BINARY_VERSION = 1
+_HEADER = struct.Struct("<4sBBH")
+_FRAME = struct.Struct("<Iq")
+_MAX_DELTA = 2 ** 32 - 1
+
+
+def _utc(timestamp: datetime):
+    """SQLite 讀回的時間沒有時區資訊，一律視為 UTC"""
+    if timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.astimezone(timezone.utc)
+
+
+def _plain(value):
+    if isinstance(value, datetime):
+        return _utc(value).isoformat()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def epoch_millis(timestamp: datetime):
+    return int(_utc(timestamp).timestamp() * 1000)
+
+
+def csv_chunk(columns, rows, header=False):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    if header:
+        writer.writerow(columns)
+    for row in rows:
+        writer.writerow(["" if value is None else _plain(value) for value in row])
+    return buffer.getvalue()
+
+
+def ndjson_chunk(columns, rows):
+    return "".join(json.dumps(dict(zip(columns, map(_plain, row))), ensure_ascii=False) + "\n" for row in rows)
+
+
+def binary_header():
+    return _HEADER.pack(BINARY_MAGIC, BINARY_VERSION, 0, 0)
+
+
+def binary_terminator():
+    return _FRAME.pack(0, 0)
+
+
+def _little_endian(values):
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values.tobytes()
+
+
+def _frame(base, deltas, values):
+    return _FRAME.pack(len(deltas), base) + _little_endian(deltas) + _little_endian(values)
+
+
+def binary_chunk(samples):
+    """samples 為依時間排序的 (epoch 毫秒, PPI) 序列；回傳一或多個區塊"""
+    frames = []
+    base = previous = None
+    deltas, values = array("I"), array("f")
+    for millis, ppi in samples:
+        if previous is not None and not 0 <= millis - previous <= _MAX_DELTA:
+            frames.append(_frame(base, deltas, values))
+            deltas, values = array("I"), array("f")
+            previous = None
+        if previous is None:
+            base = previous = millis
+        deltas.append(millis - previous)
+        values.append(math.nan if ppi is None else ppi)
+        previous = millis
+    if deltas:
+        frames.append(_frame(base, deltas, values))
+    return b"".join(frames)
+
+
+def decode_binary(data: bytes):
+    """解碼整份二進位匯出，回傳 (epoch 毫秒清單, PPI 清單)；供分析腳本與驗證使用"""
+    magic, version, _, _ = _HEADER.unpack_from(data, 0)
+    if magic != BINARY_MAGIC or version != BINARY_VERSION:
+        raise ValueError("不是可辨識的 PTTS 匯出檔")
+    offset = _HEADER.size
+    timestamps, ppis = [], []
+    while True:
+        count, base = _FRAME.unpack_from(data, offset)
+        offset += _FRAME.size
+        if count == 0:
+            return timestamps, ppis
+        deltas, values = array("I"), array("f")
+        deltas.frombytes(data[offset:offset + 4 * count])
+        values.frombytes(data[offset + 4 * count:offset + 8 * count])
+        if sys.byteorder != "little":
+            deltas.byteswap()
+            values.byteswap()
+        offset += 8 * count
+        current = base
+        for delta in deltas:
+            current += delta
+            timestamps.append(current)
+        ppis.extend(values)
@@ -0,0 +1,363 @@
+"""PTT 頁面的快速解析：看板列表頁的文章連結與「上頁」連結，以及文章內頁的推文 (推/噓/→、使用者、IP 與時間)。
+
+有安裝 selectolax 時使用其 C 實作 (lexbor) 的解析器；否則退回以標準函式庫 html.parser
+逐一處理標籤事件的串流解析，只記錄需要的欄位，不建立整棵 DOM 樹。
+兩種後端的結果都與原本 BeautifulSoup('html.parser') + select() 的寫法一致，
+bench/bench_parser.py 會先以 fixture 驗證一致性，再比較速度。
+
+parse_board_page 與 parse_article 是爬蟲解析程序池 (ptt_backend.ParseStage) 執行的工作單位，
+只依賴本模組，子程序不必匯入整個後端。
+"""
+import time
+from html.parser import HTMLParser
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+    PARSER_BACKEND = "selectolax"
+except ImportError:
+    LexborHTMLParser = None
+    PARSER_BACKEND = "stream"
+
+PUSH_TAG = '推'
+PREV_PAGE_TEXT = '上頁'
+BOO_TAG = '噓'
+PUSH_DIV_MARKER = b'<div class="push'
+
+# html.parser 不會為這些元素送出結束標籤，BeautifulSoup 也將它們視為空元素
+_VOID_ELEMENTS = frozenset((
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+    'link', 'meta', 'param', 'source', 'track', 'wbr',
+))
+
+
+def extract_article_hrefs(html: str, backend: str = None):
+    """看板列表頁中每個 div.r-ent 的第一個 `div.title a` 連結 (相對網址)"""
+    if (backend or PARSER_BACKEND) == "selectolax":
+        return _lexbor_article_hrefs(html)
+    return _stream_parse(html).article_hrefs
+
+
+def extract_article_links(html: str, backend: str = None):
+    """與 extract_article_hrefs 相同的連結，連同標題文字：[(相對網址, 標題), ...]"""
+    if (backend or PARSER_BACKEND) == "selectolax":
+        return _lexbor_article_links(html)
+    parser = _stream_parse(html)
+    return list(zip(parser.article_hrefs, parser.article_titles))
+
+
+def extract_prev_page_href(html: str, backend: str = None):
+    """看板列表頁分頁按鈕 (div.btn-group-paging) 中「上頁」的連結；已是最舊一頁時回傳 None"""
+    if (backend or PARSER_BACKEND) == "selectolax":
+        return _lexbor_prev_page_href(html)
+    return _stream_parse(html).prev_page_href
+
+
+def extract_pushes(html: str, backend: str = None):
+    """文章內頁每個 div.push 的 (推文標籤, 使用者, IP 與時間)，取不到的欄位為 None"""
+    if (backend or PARSER_BACKEND) == "selectolax":
+        return _lexbor_pushes(html)
+    return _stream_parse(html).pushes
+
+
+def count_push_tags(html: str, backend: str = None):
+    """回傳文章內頁的 (推, 噓) 數量"""
+    return tally_pushes(extract_pushes(html, backend))
+
+
+def tally_pushes(pushes):
+    """extract_pushes 結果中的 (推, 噓) 數量"""
+    push_count = 0
+    boo_count = 0
+    for tag, _user, _ipdatetime in pushes:
+        if tag == PUSH_TAG:
+            push_count += 1
+        elif tag == BOO_TAG:
+            boo_count += 1
+    return push_count, boo_count
+
+
+def find_push_offset(body: bytes):
+    """回傳最後一行推文 (div.push) 結束的位元組位置；沒有推文時回傳 None"""
+    start = body.rfind(PUSH_DIV_MARKER)
+    if start == -1:
+        return None
+    end = body.find(b'</div>', start)
+    return end + len(b'</div>') if end != -1 else None
+
+
+def parse_board_page(html: str):
+    """看板列表頁的 ([(文章連結, 標題), ...], 「上頁」連結)"""
+    return extract_article_links(html), extract_prev_page_href(html)
+
+
+def parse_article(body, encoding: str = 'utf-8'):
+    """解析文章內頁 (或增量抓取時的尾段)，回傳 (推文, div.push 行數, 最後一行推文結束位移, 解析秒數)。
+
+    body 為 bytes 時在這裡解碼並計算位移；為 str (瀏覽器取得的 HTML) 時行數為推文數、位移為 None。
+    """
+    started = time.perf_counter()
+    if isinstance(body, bytes):
+        pushes = extract_pushes(body.decode(encoding, errors='replace'))
+        push_lines = body.count(PUSH_DIV_MARKER)
+        push_offset = find_push_offset(body)
+    else:
+        pushes = extract_pushes(body)
+        push_lines = len(pushes)
+        push_offset = None
+    return pushes, push_lines, push_offset, time.perf_counter() - started
+
+
+# --- selectolax (lexbor) 後端 ---
+def _lexbor_string(node):
+    """對應 BeautifulSoup 的 Tag.string：只有單一子節點時才有值，子節點為元素時往下遞迴"""
+    child = node.child
+    if child is None or child.next is not None:
+        return None
+    if child.is_text_node:
+        return child.text_content
+    if child.is_comment_node:
+        return child.comment_content
+    return _lexbor_string(child)
+
+
+def _lexbor_article_hrefs(html):
+    tree = LexborHTMLParser(html)
+    hrefs = []
+    for entry in tree.css("div.r-ent"):
+        link = entry.css_first("div.title a")
+        if link is not None:
+            href = link.attributes.get('href')
+            if href is not None:
+                hrefs.append(href)
+    return hrefs
+
+
+def _lexbor_article_links(html):
+    tree = LexborHTMLParser(html)
+    links = []
+    for entry in tree.css("div.r-ent"):
+        link = entry.css_first("div.title a")
+        if link is not None:
+            href = link.attributes.get('href')
+            if href is not None:
+                links.append((href, link.text().strip()))
+    return links
+
+
+def _lexbor_prev_page_href(html):
+    tree = LexborHTMLParser(html)
+    for link in tree.css("div.btn-group-paging a"):
+        href = link.attributes.get('href')
+        if href is not None and PREV_PAGE_TEXT in link.text():
+            return href
+    return None
+
+
+def _lexbor_pushes(html):
+    tree = LexborHTMLParser(html)
+    pushes = []
+    for push_div in tree.css("div.push"):
+        tag_span = push_div.css_first("span.push-tag")
+        user_span = push_div.css_first("span.push-userid")
+        ip_span = push_div.css_first("span.push-ipdatetime")
+        tag = _lexbor_string(tag_span) if tag_span is not None else None
+        pushes.append((
+            tag.strip() if tag else None,
+            user_span.text().strip() if user_span is not None else None,
+            ip_span.text().strip() if ip_span is not None else None,
+        ))
+    return pushes
+
+
+# --- 標準函式庫串流後端 ---
+def _has_class(attrs, name):
+    for key, value in attrs:
+        if key == 'class' and value:
+            return name in value.split()
+    return False
+
+
+class _Comment(str):
+    """span.push-tag 內的註解節點；與 BeautifulSoup 相同，不與相鄰文字合併"""
+
+
+def _capture_string(children):
+    """以擷取到的子節點還原 Tag.string 的語意；children 為 str 或子元素的 list"""
+    if len(children) != 1:
+        return None
+    child = children[0]
+    if isinstance(child, str):
+        return child
+    return _capture_string(child)
+
+
+class _PttStreamParser(HTMLParser):
+    """單次掃描同時收集文章連結與推文欄位。
+
+    以輕量的開啟標籤堆疊模擬 BeautifulSoup 的樹狀結構 (遇到結束標籤時彈出到最近的同名標籤)，
+    只有 span.push-tag 會保留子節點結構以計算 .string，其他欄位只串接文字。
+    """
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.article_hrefs = []
+        self.article_titles = []
+        self.prev_page_href = None
+        self.pushes = []
+        # 每個開啟中的元素: [標籤名稱, 角色]；角色用於離開元素時結束對應的擷取
+        self._stack = []
+        self._in_entry = False
+        self._entry_done = False
+        self._title_depth = 0
+        self._title_text = None
+        self._paging_depth = 0
+        self._paging_href = None
+        self._paging_text = None
+        self._push = None
+        self._tag_children = None
+        self._tag_nodes = None
+        self._user_text = None
+        self._ip_text = None
+
+    def handle_starttag(self, tag, attrs):
+        role = None
+        if tag == 'div':
+            if not self._in_entry and _has_class(attrs, 'r-ent'):
+                self._in_entry = True
+                self._entry_done = False
+                role = 'entry'
+            elif self._in_entry and _has_class(attrs, 'title'):
+                self._title_depth += 1
+                role = 'title'
+            elif _has_class(attrs, 'btn-group-paging'):
+                self._paging_depth += 1
+                role = 'paging'
+            if self._push is None and _has_class(attrs, 'push'):
+                self._push = [None, None, None, False, False, False]
+                role = 'push' if role is None else role + '+push'
+        elif tag == 'a' and self._title_depth and not self._entry_done:
+            # 與 select_one 相同只看第一個連結；沒有 href 時略過該篇 (原本的 a['href'] 會直接拋錯)
+            self._entry_done = True
+            for key, value in attrs:
+                if key == 'href' and value is not None:
+                    self.article_hrefs.append(value)
+                    self._title_text = []
+                    role = 'title-link'
+                    break
+        elif tag == 'a' and self._paging_depth and self._paging_text is None and self.prev_page_href is None:
+            self._paging_href = None
+            for key, value in attrs:
+                if key == 'href':
+                    self._paging_href = value
+            self._paging_text = []
+            role = 'paging-link'
+        elif tag == 'span' and self._push is not None:
+            push = self._push
+            if not push[3] and self._tag_children is None and _has_class(attrs, 'push-tag'):
+                push[3] = True
+                self._tag_children = []
+                self._tag_nodes = [self._tag_children]
+                role = 'tag'
+            elif not push[4] and self._user_text is None and _has_class(attrs, 'push-userid'):
+                push[4] = True
+                self._user_text = []
+                role = 'user'
+            elif not push[5] and self._ip_text is None and _has_class(attrs, 'push-ipdatetime'):
+                push[5] = True
+                self._ip_text = []
+                role = 'ip'
+
+        if role is None and self._tag_nodes is not None:
+            nested = []
+            self._tag_nodes[-1].append(nested)
+            if tag in _VOID_ELEMENTS:
+                return
+            self._tag_nodes.append(nested)
+            role = 'nested'
+        if tag not in _VOID_ELEMENTS:
+            self._stack.append((tag, role))
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in _VOID_ELEMENTS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        stack = self._stack
+        for index in range(len(stack) - 1, -1, -1):
+            if stack[index][0] == tag:
+                break
+        else:
+            return
+        while len(stack) > index:
+            self._close(stack.pop()[1])
+
+    def _close(self, role):
+        if role is None:
+            return
+        if role == 'nested':
+            self._tag_nodes.pop()
+        elif role == 'tag':
+            string = _capture_string(self._tag_children)
+            self._push[0] = string.strip() if string else None
+            self._tag_children = None
+            self._tag_nodes = None
+        elif role == 'user':
+            self._push[1] = ''.join(self._user_text).strip()
+            self._user_text = None
+        elif role == 'ip':
+            self._push[2] = ''.join(self._ip_text).strip()
+            self._ip_text = None
+        elif role == 'title-link':
+            self.article_titles.append(''.join(self._title_text).strip())
+            self._title_text = None
+        elif role == 'paging-link':
+            if self._paging_href is not None and PREV_PAGE_TEXT in ''.join(self._paging_text):
+                self.prev_page_href = self._paging_href
+            self._paging_text = None
+        elif role == 'paging':
+            self._paging_depth -= 1
+        else:
+            if role.endswith('push'):
+                self._finish_push()
+            if role.startswith('title'):
+                self._title_depth -= 1
+            elif role.startswith('entry'):
+                self._in_entry = False
+
+    def _finish_push(self):
+        push = self._push
+        self.pushes.append((push[0], push[1], push[2]))
+        self._push = None
+
+    def handle_data(self, data):
+        if self._tag_nodes is not None:
+            children = self._tag_nodes[-1]
+            if children and type(children[-1]) is str:
+                children[-1] += data
+            else:
+                children.append(data)
+        if self._user_text is not None:
+            self._user_text.append(data)
+        if self._ip_text is not None:
+            self._ip_text.append(data)
+        if self._paging_text is not None:
+            self._paging_text.append(data)
+        if self._title_text is not None:
+            self._title_text.append(data)
+
+    def handle_comment(self, data):
+        if self._tag_nodes is not None:
+            self._tag_nodes[-1].append(_Comment(data))
+
+    def close(self):
+        super().close()
+        # 文件結束時仍未關閉的元素 (例如增量解析時只拿到頁尾片段)
+        while self._stack:
+            self._close(self._stack.pop()[1])
+
+
+def _stream_parse(html):
+    parser = _PttStreamParser()
+    parser.feed(html)
+    parser.close()
+    return parser
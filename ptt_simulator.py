@@ -0,0 +1,110 @@
+"""折扣設定的 what-if 模擬：把歷史 PPI 載入成 NumPy 陣列，一次計算整組候選設定的折扣。
+
+折扣公式與 ptt_backend.calculate_discount 相同：
+    min(base_discount + max(ppi_threshold - ppi, 0) * conversion_factor, discount_cap)
+候選設定為各欄位候選值的笛卡兒積 (K 組)，對 T 個樣本得到 K x T 的折扣矩陣；
+矩陣依列分塊計算，每塊不超過 MAX_CHUNK_ELEMENTS 個元素，記憶體用量與 K 無關。
+統計量以時間加權：每個樣本代表到下一個樣本為止的時間 (以 max_gap 為上限，避免資料缺口被算成一整段)。
+"""
+import itertools
+
+import numpy as np
+
+SETTING_KEYS = ("base_discount", "ppi_threshold", "conversion_factor", "discount_cap")
+MAX_CHUNK_ELEMENTS = 4_000_000
+
+
+def forward_fill_invalid(timestamps, ppi):
+    """PPI 為 0 的紀錄沿用上一筆有效 PPI (與 /api/current-discount 的回溯邏輯一致)；開頭沒有有效值的樣本捨棄"""
+    valid = ppi > 0
+    if not valid.any():
+        return timestamps[:0], ppi[:0]
+    last_valid = np.maximum.accumulate(np.where(valid, np.arange(len(ppi)), -1))
+    keep = last_valid >= 0
+    return timestamps[keep], ppi[last_valid[keep]]
+
+
+def sample_weights(timestamps, max_gap):
+    """每個樣本代表的秒數：到下一個樣本的間隔，最後一個樣本與資料缺口以 max_gap 為上限"""
+    if len(timestamps) == 0:
+        return np.zeros(0)
+    gaps = np.diff(timestamps, append=timestamps[-1] + max_gap)
+    return np.clip(gaps, 0, max_gap)
+
+
+def settings_grid(candidates):
+    """{欄位: [候選值, ...]} -> 每個欄位一個長度 K 的陣列 (笛卡兒積)"""
+    combos = list(itertools.product(*(candidates[key] for key in SETTING_KEYS)))
+    columns = np.array(combos, dtype=np.float64).reshape(len(combos), len(SETTING_KEYS))
+    return {key: columns[:, index] for index, key in enumerate(SETTING_KEYS)}
+
+
+def discount_matrix(ppi, base, threshold, factor, cap):
+    """ppi 形狀 (T,)，設定形狀 (K,)；回傳 (K, T) 的折扣"""
+    extra = np.maximum(threshold[:, None] - ppi[None, :], 0.0)
+    extra *= factor[:, None]
+    extra += base[:, None]
+    return np.minimum(extra, cap[:, None], out=extra)
+
+
+def discount_series(ppi, settings):
+    """單一設定的完整折扣序列"""
+    grid = {key: np.array([float(settings[key])]) for key in SETTING_KEYS}
+    return discount_matrix(ppi, grid["base_discount"], grid["ppi_threshold"],
+                           grid["conversion_factor"], grid["discount_cap"])[0]
+
+
+def simulate(timestamps, ppi, candidates, bins=20, max_gap=600.0):
+    """回傳每組候選設定的時間加權平均、最小/最大折扣、觸及上限的時間與折扣分布直方圖。
+
+    直方圖的區間對所有設定相同 (0 到最大的 discount_cap)，方便直接比較。
+    """
+    grid = settings_grid(candidates)
+    combos = len(grid["base_discount"])
+    weights = sample_weights(timestamps, max_gap)
+    total_seconds = float(weights.sum())
+    low = 0.0
+    high = float(max(grid["discount_cap"].max(), grid["base_discount"].max(), 1e-9)) if combos else 1.0
+    edges = np.linspace(low, high, bins + 1)
+    width = (high - low) / bins
+
+    mean = np.zeros(combos)
+    minimum = np.zeros(combos)
+    maximum = np.zeros(combos)
+    at_cap_seconds = np.zeros(combos)
+    histogram = np.zeros((combos, bins), dtype=np.int64)
+    samples = len(ppi)
+    if samples:
+        rows_per_chunk = max(1, MAX_CHUNK_ELEMENTS // samples)
+        for start in range(0, combos, rows_per_chunk):
+            rows = slice(start, min(start + rows_per_chunk, combos))
+            cap = grid["discount_cap"][rows]
+            discounts = discount_matrix(ppi, grid["base_discount"][rows], grid["ppi_threshold"][rows],
+                                        grid["conversion_factor"][rows], cap)
+            count = discounts.shape[0]
+            if total_seconds > 0:
+                mean[rows] = discounts @ weights / total_seconds
+            minimum[rows] = discounts.min(axis=1)
+            maximum[rows] = discounts.max(axis=1)
+            at_cap_seconds[rows] = (discounts >= cap[:, None]) @ weights
+            bucket = np.clip(((discounts - low) / width).astype(np.int64), 0, bins - 1)
+            bucket += (np.arange(count) * bins)[:, None]
+            histogram[rows] = np.bincount(bucket.ravel(), minlength=count * bins).reshape(count, bins)
+
+    results = []
+    for index in range(combos):
+        results.append({
+            "settings": {key: float(grid[key][index]) for key in SETTING_KEYS},
+            "mean_discount": round(float(mean[index]), 4),
+            "min_discount": round(float(minimum[index]), 4),
+            "max_discount": round(float(maximum[index]), 4),
+            "at_cap_seconds": round(float(at_cap_seconds[index]), 1),
+            "at_cap_fraction": round(float(at_cap_seconds[index]) / total_seconds, 4) if total_seconds else 0.0,
+            "histogram": histogram[index].tolist(),
+        })
+    return {
+        "samples": samples,
+        "covered_seconds": round(total_seconds, 1),
+        "histogram_edges": [round(float(edge), 4) for edge in edges],
+        "combinations": results,
+    }